@@ -0,0 +1,255 @@
+"""
+Decode a directory of .cpt data files without the GUI.
+
+Each file is opened as a PGP message, its signature is checked against the
+given public keys and a summary of the data package is written out:
+component information, diagnostic codes, distance, engine hours and ECU
+time. The files are decoded in parallel in a process pool. With --pdf the
+workers also render a PDF report for each file, so a fleet of reports is
+made in parallel.
+
+The summaries can be written as JSON lines, one file per line, or as a
+columnar JSON file with one list per column and the nested keys joined
+with "/":
+    python -m TURP1210.BatchDecode data_files --key "Client Public Key.pem" --output summary.jsonl
+    python -m TURP1210.BatchDecode data_files --format columns --output summary.json
+    python -m TURP1210.BatchDecode data_files --pdf reports
+"""
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+import pgpy
+from TURP1210.PDFReports import FLAReportTemplate
+
+import logging
+logger = logging.getLogger(__name__)
+
+FORMATS = ["jsonl", "columns"]
+SUMMARY_SECTIONS = ["Component Information",
+                    "Distance Information",
+                    "ECU Time Information",
+                    "Time Records"]
+DTC_FIELDS = ["SA", "Source", "SPN", "Suspect Parameter Number Label", "FMI", "FMI Meaning", "Count"]
+
+# Keys loaded once in each worker process by load_keys
+verification_keys = []
+# Where each worker process writes the PDF reports, if anywhere
+report_settings = {"Directory": None, "Logo": "logo.pdf"}
+
+def load_keys(key_filenames):
+    """
+    Load the PGP keys used to verify signatures.
+    """
+    del verification_keys[:]
+    for key_filename in key_filenames:
+        try:
+            key, details = pgpy.PGPKey.from_file(key_filename)
+            verification_keys.append(key)
+        except:
+            logger.warning("Could not load the key in {}".format(key_filename))
+            logger.debug(traceback.format_exc())
+
+def init_worker(key_filenames, pdf_directory=None, logo_filename="logo.pdf"):
+    load_keys(key_filenames)
+    report_settings["Directory"] = pdf_directory
+    report_settings["Logo"] = logo_filename
+
+def verify_message(pgp_message):
+    """
+    Returns True if any of the keys has a good signature on the message,
+    False if none do and None when there are no keys to check with.
+    """
+    if not pgp_message.is_signed:
+        return False
+    if not verification_keys:
+        return None
+    for key in verification_keys:
+        try:
+            result = key.verify(pgp_message)
+        except:
+            logger.debug(traceback.format_exc())
+            continue
+        for verified, by, signature, subject in result.good_signatures:
+            if verified:
+                return True
+    return False
+
+def strip_values(value):
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+def summarize_dtcs(trouble_codes):
+    return [OrderedDict((field, strip_values(dtc.get(field))) for field in DTC_FIELDS)
+            for dtc in trouble_codes.values()]
+
+def summarize(data_package):
+    """
+    Pick the vehicle information out of a data package. Sources with no
+    entries are left out.
+    """
+    summary = OrderedDict()
+    vins = []
+    for section in SUMMARY_SECTIONS:
+        summary[section] = OrderedDict()
+        for source, values in sorted(data_package.get(section, {}).items()):
+            if values:
+                summary[section][source] = values
+            if isinstance(values, dict):
+                for key, value in values.items():
+                    if key.startswith("VIN") and isinstance(value, str):
+                        vin = value.strip("* \x00")
+                        if vin and vin.strip("0") and vin not in vins:
+                            vins.append(vin)
+    summary["VIN"] = vins
+    diagnostic_codes = data_package.get("Diagnostic Codes", {})
+    summary["Diagnostic Codes"] = OrderedDict((dm, summarize_dtcs(diagnostic_codes.get(dm, {})))
+                                              for dm in ["DM01", "DM02", "DM04"])
+    summary["UDS Message Count"] = len(data_package.get("UDS Messages", {}))
+    summary["Warnings"] = data_package.get("Warnings", [])
+    return summary
+
+def make_report(pgp_message, filename):
+    """
+    Render the PDF report for a data file. Returns the report file name and
+    the result from the report.
+    """
+    pdf_filename = os.path.join(report_settings["Directory"],
+                                os.path.splitext(os.path.basename(filename))[0] + ".pdf")
+    report = FLAReportTemplate(None, icon_file=report_settings["Logo"])
+    return pdf_filename, report.go(pgp_message, pdf_filename)
+
+def decode_file(filename):
+    """
+    Open, verify and summarize one .cpt file. Errors are reported in the
+    result instead of raised so one bad file does not stop the batch.
+    """
+    result = OrderedDict([("File", filename),
+                          ("Verified", None),
+                          ("Error", None)])
+    try:
+        pgp_message = pgpy.PGPMessage.from_file(filename)
+        result["Verified"] = verify_message(pgp_message)
+        data_package = json.loads(pgp_message.message)
+    except:
+        logger.debug(traceback.format_exc())
+        result["Error"] = "File was not a properly formatted data file."
+        return result
+    try:
+        result.update(summarize(data_package))
+    except:
+        logger.debug(traceback.format_exc())
+        result["Error"] = "File was missing critical information."
+        return result
+    if report_settings["Directory"] is not None:
+        try:
+            result["Report"], result["Report Result"] = make_report(pgp_message, filename)
+        except:
+            logger.debug(traceback.format_exc())
+            result["Report Result"] = "The report could not be made."
+    return result
+
+def find_files(paths, recursive=False):
+    """
+    Expand directories into the .cpt files they hold.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", "*.cpt") if recursive else os.path.join(path, "*.cpt")
+            filenames.extend(sorted(glob.glob(pattern, recursive=recursive)))
+        else:
+            filenames.append(path)
+    return filenames
+
+def decode_files(filenames, key_filenames=[], processes=None, chunk_size=8, pdf_directory=None, logo_filename="logo.pdf"):
+    """
+    Yields the results in the same order as the files. The files are
+    decoded in a pool of processes. Reports are written to pdf_directory
+    when it is given.
+    """
+    if pdf_directory is not None:
+        os.makedirs(pdf_directory, exist_ok=True)
+    if processes == 1:
+        init_worker(key_filenames, pdf_directory, logo_filename)
+        for filename in filenames:
+            yield decode_file(filename)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes,
+                                                initializer=init_worker,
+                                                initargs=(key_filenames, pdf_directory, logo_filename)) as executor:
+        for result in executor.map(decode_file, filenames, chunksize=chunk_size):
+            yield result
+
+def flatten(value, prefix=""):
+    """
+    Turn nested dictionaries into one dictionary with the keys joined by "/".
+    Lists are kept as JSON text.
+    """
+    if isinstance(value, dict):
+        flat = OrderedDict()
+        for key, item in value.items():
+            flat.update(flatten(item, prefix + "/" + key if prefix else key))
+        return flat
+    if isinstance(value, list):
+        value = json.dumps(value)
+    return OrderedDict([(prefix, value)])
+
+def write_jsonl(results, output_file):
+    count = 0
+    for result in results:
+        output_file.write(json.dumps(result) + "\n")
+        count += 1
+    return count
+
+def write_columns(results, output_file):
+    """
+    Write one list per column. Files without a column get None.
+    """
+    columns = OrderedDict()
+    count = 0
+    for result in results:
+        for key, value in flatten(result).items():
+            if key not in columns:
+                columns[key] = [None] * count
+            columns[key].append(value)
+        count += 1
+        for column in columns.values():
+            if len(column) < count:
+                column.append(None)
+    json.dump({"rows": count, "columns": columns}, output_file)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify and summarize a directory of .cpt data files.")
+    parser.add_argument("paths", nargs="+", help="Directories or .cpt files to decode.")
+    parser.add_argument("--key", action="append", default=[],
+                        help="A PGP public key file to verify signatures with. Can be given more than once.")
+    parser.add_argument("--output", help="Write the summaries to this file instead of the screen.")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--processes", type=int, help="Number of worker processes. The default is one per CPU.")
+    parser.add_argument("--recursive", action="store_true", help="Look for .cpt files in subdirectories.")
+    parser.add_argument("--pdf", help="Also write a PDF report for each file to this directory.")
+    parser.add_argument("--logo", default="logo.pdf", help="The logo drawn on the PDF reports.")
+    args = parser.parse_args(argv)
+
+    filenames = find_files(args.paths, args.recursive)
+    start_time = time.time()
+    results = decode_files(filenames, args.key, args.processes, pdf_directory=args.pdf, logo_filename=args.logo)
+    writer = write_columns if args.format == "columns" else write_jsonl
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            count = writer(results, output_file)
+    else:
+        count = writer(results, sys.stdout)
+    sys.stderr.write("Decoded {} files in {:0.1f} seconds.\n".format(count, time.time() - start_time))
+    return count
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,475 @@
+"""
+Throughput benchmarks for the receive, decode and display pipeline.
+
+Each workload is a fixed, seeded set of RP1210_ReadMessage buffers. They are
+fed through these stages:
+    parse - RP1210ReadMessageThread.store_message into a ring buffer
+    j1939 - the J1939StateProcessor behind J1939Tab.fill_j1939_table
+    j1587 - J1587Tab.fill_j1587_table
+    iso   - ISO15765Driver.read_message
+    display - J1939Tab.update_tables, which shows the special PGNs like DM04
+              and flushes the table models. It runs once for every
+              DISPLAY_TICK_FRAMES J1939 frames, like a read_rp1210 tick.
+              The frames are decoded before the timing starts.
+The benchmark imports the TURP1210 package, which loads PyQt5, so PyQt5
+has to be installed to run any stage. The j1587, iso and display stages
+make widgets, so they run on the offscreen Qt platform and need no display.
+
+For every stage the frames per second, the 50th and 99th percentile time per
+call and the peak memory allocated are reported. A call is one frame, or
+one tick for the display stage. Frames that raise an error are counted
+instead of stopping the run. Results can be saved as JSON and compared
+against an earlier run:
+    python -m TURP1210.Benchmark --output results.json
+    python -m TURP1210.Benchmark --compare results.json
+"""
+import argparse
+import ctypes
+import json
+import os
+import queue
+import random
+import struct
+import sys
+import time
+import tracemalloc
+import traceback
+from collections import OrderedDict
+from TURP1210.RP1210.RP1210Functions import *
+from TURP1210.RP1210.RP1210RingBuffer import *
+from TURP1210.RP1210.RP1210ReadMessage import *
+from TURP1210.J1939Pipeline import *
+from TURP1210.CompiledDatabase import load_database
+
+import logging
+logger = logging.getLogger(__name__)
+
+module_directory = os.path.dirname(os.path.abspath(__file__))
+
+WORKLOADS = ["idle", "key_on_burst", "network_scan", "dm04_heavy", "uds_heavy"]
+STAGES = ["parse", "j1939", "j1587", "iso", "display"]
+
+# J1939 frames read between two calls of J1939Tab.update_tables
+DISPLAY_TICK_FRAMES = 50
+
+ENGINE_PGNS = [61444, 61443, 65265, 65262, 65263, 65270, 65266, 65271, 61442, 65254, 65253]
+SCAN_PGNS = [65259, 65260, 65242, 64965, 65226, 65227, 65229, 65253, 65255, 65248, 65217, 65254,
+             65249, 65250, 65251, 65252, 65257, 65214, 64981, 65168]
+ASCII_PGNS = [65259, 65260, 65242, 64965]
+J1587_MIDS = [128, 130, 136, 140]
+J1587_PIDS = [84, 85, 91, 92, 100, 102, 105, 108, 110, 168, 171, 183, 190, 234, 237, 243, 245, 247, 250]
+# PIDs from 192 up start with a length byte. These are the ones in J1587_PIDS.
+J1587_TEXT_PIDS = [234, 237, 243]
+J1587_LONG_PIDS = [245, 247, 250] # 4 byte counters
+
+def j1939_buffer(vda_time, pgn, sa, da, data_bytes, priority=6):
+    """
+    Build a J1939 message the way RP1210_ReadMessage returns it.
+    """
+    return struct.pack(">LB", vda_time, 0) + struct.pack("<L", pgn)[:3] + bytes([priority, sa, da]) + data_bytes
+
+def j1708_buffer(vda_time, mid, pid, data_bytes):
+    """
+    Build a J1708 message the way RP1210_ReadMessage returns it.
+    """
+    return struct.pack(">LB", vda_time, 0) + bytes([mid, pid]) + data_bytes
+
+def j1587_data(random_source, pid):
+    """
+    Make data for a PID in J1587_PIDS that the J1587 database can decode.
+    The number of data bytes depends on the PID. See J1587.
+    """
+    if pid < 128:
+        return bytes([random_source.randrange(256)])
+    elif pid < 192:
+        return bytes([random_source.randrange(256) for i in range(2)])
+    elif pid in J1587_TEXT_PIDS:
+        text = "*".join("".join(random_source.choice("ABCDEFGH0123456789") for i in range(random_source.randrange(2, 8)))
+                        for field in range(3)).encode('ascii') + b'*'
+        return bytes([len(text)]) + text
+    elif pid in J1587_LONG_PIDS:
+        return bytes([4] + [random_source.randrange(256) for i in range(4)])
+    raise ValueError("No J1587 data length for PID {}.".format(pid))
+
+def freeze_frame(random_source, extra_length=0):
+    """
+    One DM04 freeze frame: a length byte, the SPN, FMI, conversion method
+    and occurrence count, then the values J1939Tab.get_freeze_frame reads.
+    """
+    frame = bytes([random_source.randrange(256) for i in range(4)])
+    frame += bytes([random_source.randrange(16)]) # Engine torque mode (SPN 899)
+    frame += bytes([random_source.randrange(256) for i in range(7)])
+    frame += bytes([random_source.randrange(256) for i in range(extra_length)])
+    return bytes([len(frame)]) + frame
+
+def iso_frames(sid_data):
+    """
+    Split a UDS response into ISO 15765 single, first and consecutive frames.
+    """
+    if len(sid_data) < 8:
+        return [bytes([len(sid_data)]) + sid_data + bytes(7 - len(sid_data))]
+    frames = [bytes([0x10 | (len(sid_data) >> 8), len(sid_data) & 0xFF]) + sid_data[:6]]
+    sequence = 1
+    for i in range(6, len(sid_data), 7):
+        chunk = sid_data[i:i + 7]
+        frames.append(bytes([0x20 | (sequence & 0x0F)]) + chunk + bytes(7 - len(chunk)))
+        sequence += 1
+    return frames
+
+
+class Workload():
+    '''
+    A fixed set of J1939 and J1708 buffers. The same name and seed always
+    give the same buffers.
+    '''
+    def __init__(self, name, seed=1210, scale=1.0):
+        self.name = name
+        self.random = random.Random(seed)
+        self.scale = scale
+        self.buffers = {"J1939": [], "J1708": []}
+        self.vda_time = 0
+        getattr(self, "make_" + name)()
+
+    def count(self, number):
+        return max(1, int(number * self.scale))
+
+    def add_j1939(self, pgn, sa, data_bytes, da=0xFF):
+        self.vda_time += 1
+        self.buffers["J1939"].append(j1939_buffer(self.vda_time, pgn, sa, da, data_bytes))
+
+    def add_j1708(self, mid, pid, data_bytes):
+        self.vda_time += 1
+        self.buffers["J1708"].append(j1708_buffer(self.vda_time, mid, pid, data_bytes))
+
+    def make_idle(self):
+        # A parked truck: the engine broadcasts and values barely change
+        for cycle in range(self.count(400)):
+            for pgn in ENGINE_PGNS:
+                self.add_j1939(pgn, 0, bytes([cycle // 10 & 0xFF, 0x7D, 0x7D, 0x20, 0x03, 0xFF, 0xFF, 0xFF]))
+            if cycle % 4 == 0:
+                for pid in [84, 110, 168, 190]:
+                    self.add_j1708(128, pid, bytes([cycle // 40 & 0xFF]) + (b'\x00' if pid >= 128 else b''))
+
+    def make_key_on_burst(self):
+        # Every controller wakes up and sends everything at once
+        sources = [0, 1, 3, 11, 15, 23, 33, 49, 61, 71]
+        pgns = [61444, 61443, 61441, 61442, 65265, 65262, 65263, 65270, 65266, 65271, 65269, 65276,
+                65132, 65134, 65215, 65217, 65248, 65253, 65254, 65255, 65257, 65272, 65274, 65279]
+        for repeat in range(self.count(8)):
+            for sa in sources:
+                for pgn in pgns:
+                    self.add_j1939(pgn, sa, bytes([self.random.randrange(256) for i in range(8)]))
+            for mid in J1587_MIDS:
+                for pid in J1587_PIDS:
+                    self.add_j1708(mid, pid, j1587_data(self.random, pid))
+
+    def make_network_scan(self):
+        # Answers to requests for every PGN from every source, with long messages
+        sources = [0, 3, 11, 15, 23, 33, 49, 61]
+        for repeat in range(self.count(10)):
+            for sa in sources:
+                for pgn in SCAN_PGNS:
+                    if pgn == 65229:
+                        data_bytes = freeze_frame(self.random)
+                    elif pgn in ASCII_PGNS:
+                        data_bytes = "*".join("".join(self.random.choice("ABCDEFGH0123456789") for i in range(self.random.randrange(4, 17)))
+                                              for field in range(4)).encode('ascii') + b'*'
+                    else:
+                        data_bytes = bytes([self.random.randrange(256) for i in range(8)])
+                    self.add_j1939(pgn, sa, data_bytes, da=0xF9)
+            for mid in J1587_MIDS:
+                for pid in J1587_PIDS:
+                    self.add_j1708(mid, pid, j1587_data(self.random, pid))
+
+    def make_dm04_heavy(self):
+        # Freeze frames from several controllers. Each controller always sends
+        # the same number and size of frames, but the values change.
+        sources = [0, 3, 11, 15, 33, 49, 61, 71, 128, 140]
+        layouts = [(1 + i % 7, i % 6) for i in range(len(sources))] # (frames, extra bytes)
+        for repeat in range(self.count(40)):
+            for sa, (frame_count, extra_length) in zip(sources, layouts):
+                data_bytes = b''.join(freeze_frame(self.random, extra_length) for frame in range(frame_count))
+                self.add_j1939(65229, sa, data_bytes)
+            self.add_j1939(61444, 0, bytes([self.random.randrange(256) for i in range(8)]))
+
+    def make_uds_heavy(self):
+        # Read data by identifier answers over ISO 15765 next to normal broadcasts
+        identifiers = [(0xF190, 17), (0xF18C, 12), (0xF195, 24), (0xF193, 6), (0xF186, 1)]
+        for repeat in range(self.count(200)):
+            for sa in [0, 3]:
+                identifier, length = identifiers[repeat % len(identifiers)]
+                sid_data = bytes([0x62]) + struct.pack(">H", identifier) + bytes([self.random.randrange(48, 90) for i in range(length)])
+                for frame in iso_frames(sid_data):
+                    self.add_j1939(0xDA00, sa, frame, da=0xF9)
+            self.add_j1939(61444, 0, bytes([self.random.randrange(256) for i in range(8)]))
+
+    def iso_messages(self):
+        """
+        The (pgn, priority, sa, da, data) tuples that go to the ISO driver.
+        """
+        messages = []
+        for rx_buffer in self.buffers["J1939"]:
+            pgn = struct.unpack("<L", rx_buffer[5:8] + b'\x00')[0]
+            if pgn == 0xDA00:
+                messages.append((pgn, 6, rx_buffer[9], rx_buffer[10], rx_buffer[11:]))
+        return messages
+
+    def frame_count(self):
+        return sum(len(buffers) for buffers in self.buffers.values())
+
+
+class NullGraph():
+    '''
+    Takes the place of the voltage graph when there is no main window.
+    '''
+    def add_data(self, *args, **kwargs):
+        pass
+
+    def plot(self, *args, **kwargs):
+        pass
+
+
+class BenchmarkRoot():
+    '''
+    The parts of the main window the tabs and drivers use.
+    '''
+    def __init__(self, j1939db, j1587db):
+        self.j1939db = j1939db
+        self.j1587db = j1587db
+        self.voltage_graph = NullGraph()
+        self.make = ""
+        self.model = ""
+        self.source_addresses = []
+        self.data_package = {"J1587 Message and Parameter IDs": {},
+                             "Component Information": {},
+                             "Time Records": {},
+                             "ECU Time Information": {},
+                             "Distance Information": {},
+                             "Diagnostic Codes": {},
+                             "UDS Messages": {}}
+
+    def send_j1939_message(self, *args, **kwargs):
+        pass
+
+
+class DeltaReplay():
+    '''
+    Takes the place of the J1939StateProcessor of a J1939Tab. It hands
+    update_tables the deltas that were decoded ahead of time, so only the
+    display side is timed.
+    '''
+    def __init__(self, deltas):
+        self.deltas = iter(deltas)
+
+    def take_delta(self):
+        return next(self.deltas)
+
+    def reset(self):
+        pass
+
+
+def get_qt_application():
+    """
+    Make a QApplication on the offscreen platform so widgets work without a
+    display.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    application = QApplication.instance()
+    if application is None:
+        application = QApplication([sys.argv[0]])
+    return application
+
+
+class PipelineBenchmark():
+    '''
+    Runs the stages over the workloads.
+    '''
+    def __init__(self, j1939db, j1587db, repeat=3):
+        self.j1939db = j1939db
+        self.j1587db = j1587db
+        self.repeat = repeat
+        self.qt_application = None
+
+    def setup_parse(self, workload):
+        """
+        Returns a list of (function, argument) calls, one for each frame.
+        """
+        calls = []
+        ring = RP1210RingBuffer()
+        for protocol, buffers in workload.buffers.items():
+            read_thread = RP1210ReadMessageThread(None, ring, queue.Queue(), None, 1, protocol, None)
+            for rx_buffer in buffers:
+                ucTxRxBuffer = (ctypes.c_char * 2000)()
+                ctypes.memmove(ucTxRxBuffer, rx_buffer, len(rx_buffer))
+                calls.append((read_thread.store_message, (0.0, ucTxRxBuffer, len(rx_buffer))))
+        return calls
+
+    def setup_j1939(self, workload):
+        processor = J1939StateProcessor(self.j1939db)
+        return [(processor.process_message, ((0.0, rx_buffer),)) for rx_buffer in workload.buffers["J1939"]]
+
+    def setup_j1587(self, workload):
+        if self.qt_application is None:
+            self.qt_application = get_qt_application()
+        from PyQt5.QtWidgets import QTabWidget
+        from TURP1210.J1587Tab import J1587Tab
+        self.tabs = QTabWidget()
+        j1587_tab = J1587Tab(BenchmarkRoot(self.j1939db, self.j1587db), self.tabs)
+        return [(j1587_tab.fill_j1587_table, ((0.0, rx_buffer),)) for rx_buffer in workload.buffers["J1708"]]
+
+    def setup_iso(self, workload):
+        if self.qt_application is None:
+            self.qt_application = get_qt_application()
+        from TURP1210.ISO15765 import ISO15765Driver
+        iso_queue = queue.Queue()
+        driver = ISO15765Driver(BenchmarkRoot(self.j1939db, self.j1587db), iso_queue)
+        def read_one(message):
+            iso_queue.put(message)
+            driver.read_message(True)
+        return [(read_one, (message,)) for message in workload.iso_messages()]
+
+    def setup_display(self, workload):
+        """
+        Decode the J1939 frames in ticks of DISPLAY_TICK_FRAMES and return
+        one call of J1939Tab.update_tables for each tick.
+        """
+        if self.qt_application is None:
+            self.qt_application = get_qt_application()
+        from PyQt5.QtWidgets import QTabWidget
+        from TURP1210.J1939Tab import J1939Tab
+        self.tabs = QTabWidget()
+        j1939_tab = J1939Tab(BenchmarkRoot(self.j1939db, self.j1587db), self.tabs)
+        buffers = workload.buffers["J1939"]
+        deltas = []
+        for start in range(0, len(buffers), DISPLAY_TICK_FRAMES):
+            for rx_buffer in buffers[start:start + DISPLAY_TICK_FRAMES]:
+                j1939_tab.processor.process_message((0.0, rx_buffer))
+            deltas.append(j1939_tab.processor.take_delta())
+        j1939_tab.processor = DeltaReplay(deltas)
+        return [(j1939_tab.update_tables, ()) for delta in deltas]
+
+    def time_calls(self, calls):
+        """
+        Returns the time for each call in seconds and the number of calls
+        that raised an error.
+        """
+        timer = time.perf_counter
+        times = []
+        errors = 0
+        for function, arguments in calls:
+            start = timer()
+            try:
+                function(*arguments)
+            except Exception:
+                times.append(timer() - start)
+                errors += 1
+                logger.debug(traceback.format_exc())
+            else:
+                times.append(timer() - start)
+        return times, errors
+
+    def run_stage(self, stage, workload):
+        setup = getattr(self, "setup_" + stage)
+        best_times = None
+        for i in range(self.repeat):
+            calls = setup(workload)
+            if not calls:
+                return None
+            times, errors = self.time_calls(calls)
+            if best_times is None or sum(times) < sum(best_times):
+                best_times = times
+
+        # Measure memory on a separate pass since tracing slows everything down
+        calls = setup(workload)
+        tracemalloc.start()
+        self.time_calls(calls)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        best_times.sort()
+        total = sum(best_times)
+        count = len(best_times)
+        if stage == "display":
+            frames = len(workload.buffers["J1939"])
+        else:
+            frames = count
+        return OrderedDict([("frames", frames),
+                            ("frames_per_second", frames / total if total > 0 else float("inf")),
+                            ("p50_us", 1e6 * best_times[int(0.50 * (count - 1))]),
+                            ("p99_us", 1e6 * best_times[int(0.99 * (count - 1))]),
+                            ("peak_memory_kb", peak_memory / 1024),
+                            ("errors", errors)])
+
+    def run(self, workload_names=WORKLOADS, stage_names=STAGES, seed=1210, scale=1.0):
+        results = OrderedDict()
+        for name in workload_names:
+            workload = Workload(name, seed, scale)
+            results[name] = OrderedDict()
+            for stage in stage_names:
+                results[name][stage] = self.run_stage(stage, workload)
+        return results
+
+
+def format_results(results, baseline=None):
+    """
+    Make a text table of the results. With a baseline, the change in frames
+    per second is shown as a ratio.
+    """
+    lines = ["{:14s} {:7s} {:>8s} {:>12s} {:>10s} {:>10s} {:>12s} {:>7s}{}".format(
+        "Workload", "Stage", "Frames", "Frames/s", "p50 (us)", "p99 (us)", "Peak (kB)", "Errors",
+        "   vs. baseline" if baseline else "")]
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            if result is None:
+                continue
+            line = "{:14s} {:7s} {:8d} {:12.0f} {:10.1f} {:10.1f} {:12.1f} {:7d}".format(
+                name, stage, result["frames"], result["frames_per_second"],
+                result["p50_us"], result["p99_us"], result["peak_memory_kb"], result.get("errors", 0))
+            try:
+                line += "   {:0.2f}x".format(result["frames_per_second"] / baseline[name][stage]["frames_per_second"])
+            except (KeyError, TypeError, ZeroDivisionError):
+                pass
+            lines.append(line)
+    return "\n".join(lines)
+
+def load_databases():
+    j1939db = load_database(os.path.join(module_directory, "J1939db.json"))
+    j1587db = load_database(os.path.join(module_directory, "J1587db.json"))
+    return j1939db, j1587db
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the throughput of the RP1210 receive and decode stages.")
+    parser.add_argument("--workload", action="append", choices=WORKLOADS,
+                        help="Run only this workload. Can be given more than once.")
+    parser.add_argument("--stage", action="append", choices=STAGES,
+                        help="Run only this stage. Can be given more than once.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each stage. The fastest is kept.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the size of every workload.")
+    parser.add_argument("--seed", type=int, default=1210)
+    parser.add_argument("--output", help="Save the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare with results saved in this JSON file.")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    j1939db, j1587db = load_databases()
+    benchmark = PipelineBenchmark(j1939db, j1587db, args.repeat)
+    results = benchmark.run(args.workload or WORKLOADS, args.stage or STAGES, args.seed, args.scale)
+    print(format_results(results, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({"python": sys.version,
+                       "platform": sys.platform,
+                       "time": time.time(),
+                       "seed": args.seed,
+                       "scale": args.scale,
+                       "results": results}, output_file, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Replay capture files through the decoders used for live traffic.
+
+The messages from one or more capture files are merged in time order and
+handed to the same functions read_rp1210 calls:
+    J1939 - J1939Tab.fill_j1939_table, then update_tables for the PGN, SPN,
+            DM and ISO 15765 results
+    J1708 - J1587Tab.fill_j1587_table
+    CAN   - the J1939 frames, with the multi-packet messages reassembled by
+            J1939TransportProtocol, go to fill_j1939_table. This is only done
+            when no J1939 capture is replayed with it, so the messages the
+            adapter reassembled are not decoded twice.
+Messages are read from the memory mapped captures as they are needed, so the
+memory used does not grow with the length of the recording.
+
+The speed sets the pace: 1 is real time, 10 is ten times faster and None
+(or 0) is as fast as the decoders can go.
+"""
+import heapq
+import time
+import traceback
+from TURP1210.RP1210.RP1210Capture import CaptureReader
+from TURP1210.J1939Transport import J1939TransportProtocol
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+def capture_messages(reader):
+    """
+    Yields (timestamp, protocol, message) with the messages in the form
+    RP1210_ReadMessage returns them.
+    """
+    protocol = reader.protocol
+    for timestamp, message in reader.rp1210_messages():
+        yield timestamp, protocol, message
+
+def merge_captures(readers):
+    """
+    Merge the messages from several captures into time order.
+    """
+    return heapq.merge(*[capture_messages(reader) for reader in readers], key=lambda m: m[0])
+
+
+class CaptureReplay():
+    '''
+    Feeds capture files to the decoders of a main window in steps, so it can
+    be driven by a QTimer or run to the end with run().
+    '''
+    def __init__(self, root, filenames, speed=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.root = root
+        self.readers = [CaptureReader(filename) for filename in filenames]
+        self.speed = speed if speed else None
+        self.batch_size = batch_size
+        self.messages = merge_captures(self.readers)
+        self.next_message = next(self.messages, None)
+        self.first_time = None
+        self.start_time = None
+        self.message_count = 0
+        self.errors = 0
+        self.total_records = sum(len(reader) for reader in self.readers)
+        if any(reader.protocol == "J1939" for reader in self.readers):
+            self.transport = None
+        else:
+            self.transport = J1939TransportProtocol()
+        self.done = False
+
+    def due_time(self, timestamp):
+        """
+        The wall clock time a message should be decoded at.
+        """
+        if self.speed is None:
+            return 0
+        if self.first_time is None:
+            self.first_time = timestamp
+            self.start_time = time.time()
+        return self.start_time + (timestamp - self.first_time) / self.speed
+
+    def decode(self, timestamp, protocol, message):
+        try:
+            if protocol == "J1939":
+                self.root.J1939.fill_j1939_table((timestamp, message))
+            elif protocol == "J1708":
+                self.root.J1587.fill_j1587_table((timestamp, message))
+            elif protocol == "CAN" and self.transport is not None:
+                for j1939_message in self.transport.j1939_messages(timestamp, message):
+                    self.root.J1939.fill_j1939_table((timestamp, j1939_message))
+        except:
+            self.errors += 1
+            logger.debug(traceback.format_exc())
+        self.message_count += 1
+
+    def step(self, time_limit=None, wait=False):
+        """
+        Decode messages that are due, for up to time_limit seconds, and update
+        the tables. With wait set, sleep until the next message is due instead
+        of returning. Returns False once the captures are finished.
+        """
+        stop_time = None if time_limit is None else time.time() + time_limit
+        count = 0
+        while self.next_message is not None:
+            timestamp, protocol, message = self.next_message
+            delay = self.due_time(timestamp) - time.time()
+            if delay > 0:
+                if not wait:
+                    break
+                time.sleep(delay)
+            self.decode(timestamp, protocol, message)
+            self.next_message = next(self.messages, None)
+            count += 1
+            if count >= self.batch_size:
+                self.root.J1939.update_tables()
+                count = 0
+                if stop_time is not None and time.time() > stop_time:
+                    break
+        self.root.J1939.update_tables()
+        if self.next_message is None and not self.done:
+            self.done = True
+            self.finish()
+        return not self.done
+
+    def finish(self):
+        """
+        Put the decoded state into the data package.
+        """
+        self.root.J1939.update_data_package()
+        logger.info("Replayed {} messages with {} errors.".format(self.message_count, self.errors))
+        if self.transport is not None:
+            logger.info("J1939 transport sessions: {}".format(", ".join("{} {}".format(count, name) for name, count in self.transport.stats.items())))
+
+    def run(self):
+        """
+        Replay everything and return the data package.
+        """
+        while self.step(wait=True):
+            pass
+        self.close()
+        return self.root.data_package
+
+    def close(self):
+        self.messages = iter(())
+        self.next_message = None
+        for reader in self.readers:
+            try:
+                reader.close()
+            except BufferError:
+                # A message still refers to the memory map.
+                logger.debug(traceback.format_exc())
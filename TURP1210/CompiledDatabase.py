@@ -0,0 +1,251 @@
+"""
+A compact, memory mapped format for the J1939 and J1587 databases.
+
+The JSON databases are a dictionary of tables, and each table is keyed by
+integers written as strings. The compiled file stores each table as a sorted
+index of (key, offset, length) records followed by the compact JSON of every
+entry. The header records the modification time and size of the JSON file
+it was compiled from, so a compiled file is only used with that JSON. Only
+the table directory is read when the file is opened. A table's index is
+read the first time the table is used, and an entry is only decoded from
+JSON when it is looked up.
+
+To convert a JSON database:
+    python -m TURP1210.CompiledDatabase J1939db.json J1939db.tudb
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import traceback
+from bisect import bisect_left
+from collections.abc import Mapping
+
+import logging
+logger = logging.getLogger(__name__)
+
+COMPILED_EXTENSION = ".tudb"
+MAGIC = b"TUDB"
+VERSION = 2
+
+HEADER_STRUCT = struct.Struct("<4sHHdQ") # magic, version, table count, source time, source size
+TABLE_STRUCT = struct.Struct("<HIQQ") # name length, entry count, index offset, data offset
+INDEX_STRUCT = struct.Struct("<iII") # key, offset from the data start, length
+
+def get_source_stamp(json_filename):
+    """
+    Returns (modification time, size) of a JSON database file.
+    """
+    stat = os.stat(json_filename)
+    return stat.st_mtime, stat.st_size
+
+def compile_database(database, filename, source_stamp=(0.0, 0)):
+    """
+    Write a dictionary of tables to a compiled database file.
+    Every table must be keyed with integers or integer strings.
+    source_stamp is the (modification time, size) of the JSON it came from.
+    """
+    tables = []
+    for table_name, table in database.items():
+        entries = sorted((int(key), value) for key, value in table.items())
+        index = bytearray()
+        data = bytearray()
+        for key, value in entries:
+            encoded_value = json.dumps(value, separators=(',', ':')).encode('utf-8')
+            index += INDEX_STRUCT.pack(key, len(data), len(encoded_value))
+            data += encoded_value
+        tables.append((table_name.encode('utf-8'), len(entries), index, data))
+
+    directory_size = sum(TABLE_STRUCT.size + len(table[0]) for table in tables)
+    position = HEADER_STRUCT.size + directory_size
+    directory = bytearray()
+    for encoded_name, count, index, data in tables:
+        directory += TABLE_STRUCT.pack(len(encoded_name), count, position, position + len(index))
+        directory += encoded_name
+        position += len(index) + len(data)
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, 'wb') as compiled_file:
+        compiled_file.write(HEADER_STRUCT.pack(MAGIC, VERSION, len(tables), *source_stamp))
+        compiled_file.write(directory)
+        for encoded_name, count, index, data in tables:
+            compiled_file.write(index)
+            compiled_file.write(data)
+    os.replace(temp_filename, filename)
+    logger.debug("Compiled {} tables into {}".format(len(tables), filename))
+
+def compile_json_database(json_filename, filename=None):
+    """
+    Convert a JSON database file. The compiled file is put next to the JSON
+    file if no filename is given.
+    """
+    if filename is None:
+        filename = os.path.splitext(json_filename)[0] + COMPILED_EXTENSION
+    source_stamp = get_source_stamp(json_filename)
+    with open(json_filename, 'r') as json_file:
+        database = json.load(json_file)
+    compile_database(database, filename, source_stamp)
+    return filename
+
+def load_database(json_filenames, cache_directory=None):
+    """
+    Load a database, preferring the compiled version when it was compiled
+    from the current JSON. json_filenames is a path or a list of paths to
+    try, and the first JSON file that exists is used. The compiled file is
+    looked for next to it and then in the cache directory. If none matches,
+    the JSON is loaded and compiled into the cache directory so the next
+    start is fast. A compiled file is only used unchecked when there is no
+    JSON file at all.
+    Raises FileNotFoundError if there is no database at all.
+    """
+    if isinstance(json_filenames, str):
+        json_filenames = [json_filenames]
+    json_filename = json_filenames[0]
+    source_stamp = None
+    for filename in json_filenames:
+        try:
+            source_stamp = get_source_stamp(filename)
+        except OSError:
+            continue
+        json_filename = filename
+        break
+
+    base_name = os.path.splitext(os.path.basename(json_filename))[0] + COMPILED_EXTENSION
+    candidates = [os.path.splitext(filename)[0] + COMPILED_EXTENSION for filename in json_filenames]
+    if cache_directory is not None:
+        candidates.append(os.path.join(cache_directory, base_name))
+
+    for compiled_filename in candidates:
+        if not os.path.exists(compiled_filename):
+            continue
+        try:
+            database = CompiledDatabase(compiled_filename)
+        except (OSError, ValueError):
+            logger.debug(traceback.format_exc())
+            continue
+        if source_stamp is None or database.source_stamp == source_stamp:
+            return database
+        logger.debug("{} was compiled from a different {}".format(compiled_filename, json_filename))
+        database.close()
+
+    with open(json_filename, 'r') as json_file:
+        database = json.load(json_file)
+    if cache_directory is not None:
+        try:
+            compile_database(database, os.path.join(cache_directory, base_name), source_stamp)
+        except (OSError, ValueError):
+            logger.debug(traceback.format_exc())
+    return database
+
+
+class CompiledTable(Mapping):
+    '''
+    A read only table from a compiled database. Keys can be given as integers
+    or integer strings, so existing lookups like table["{}".format(spn)] work.
+    Iteration gives string keys, the same as the JSON tables.
+    '''
+    def __init__(self, buffer, count, index_offset, data_offset):
+        self.buffer = buffer
+        self.count = count
+        self.index_offset = index_offset
+        self.data_offset = data_offset
+        self.keys_list = None
+        self.values = {}
+
+    def load_index(self):
+        self.keys_list = [INDEX_STRUCT.unpack_from(self.buffer, self.index_offset + i * INDEX_STRUCT.size)[0]
+                          for i in range(self.count)]
+
+    def find(self, key):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            raise KeyError(key)
+        if self.keys_list is None:
+            self.load_index()
+        position = bisect_left(self.keys_list, key)
+        if position == self.count or self.keys_list[position] != key:
+            raise KeyError(key)
+        return key, position
+
+    def __getitem__(self, key):
+        key, position = self.find(key)
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        _, offset, length = INDEX_STRUCT.unpack_from(self.buffer, self.index_offset + position * INDEX_STRUCT.size)
+        start = self.data_offset + offset
+        value = json.loads(self.buffer[start:start + length].decode('utf-8'))
+        self.values[key] = value
+        return value
+
+    def __contains__(self, key):
+        try:
+            self.find(key)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        if self.keys_list is None:
+            self.load_index()
+        return ("{}".format(key) for key in self.keys_list)
+
+    def __len__(self):
+        return self.count
+
+
+class CompiledDatabase(Mapping):
+    '''
+    A memory mapped compiled database. Tables are made when first used.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as compiled_file:
+            self.buffer = mmap.mmap(compiled_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, table_count, source_time, source_size = HEADER_STRUCT.unpack_from(self.buffer, 0)
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC or version != VERSION:
+            self.buffer.close()
+            raise ValueError("{} is not a version {} compiled database.".format(filename, VERSION))
+        self.source_stamp = (source_time, source_size)
+        self.table_directory = {}
+        position = HEADER_STRUCT.size
+        for i in range(table_count):
+            name_length, count, index_offset, data_offset = TABLE_STRUCT.unpack_from(self.buffer, position)
+            position += TABLE_STRUCT.size
+            table_name = self.buffer[position:position + name_length].decode('utf-8')
+            position += name_length
+            self.table_directory[table_name] = (count, index_offset, data_offset)
+        self.tables = {}
+
+    def __getitem__(self, table_name):
+        try:
+            return self.tables[table_name]
+        except KeyError:
+            pass
+        table = CompiledTable(self.buffer, *self.table_directory[table_name])
+        self.tables[table_name] = table
+        return table
+
+    def __iter__(self):
+        return iter(self.table_directory)
+
+    def __len__(self):
+        return len(self.table_directory)
+
+    def close(self):
+        self.tables = {}
+        self.buffer.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python -m TURP1210.CompiledDatabase database.json [output{}]".format(COMPILED_EXTENSION))
+        sys.exit(1)
+    output_filename = compile_json_database(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print("Wrote {}".format(output_filename))
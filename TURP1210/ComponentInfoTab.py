@@ -232,30 +232,20 @@ class ComponentInfoTab(QWidget):
         self.send_requests(65259, 243)
 
     def send_requests(self, pgn, mid=234):
-        total_requests = 3*(len(self.root.source_addresses) + 1)
+        # Only ask the addresses that have not answered yet
+        sa_list = [0xff] + self.root.source_addresses
+        targets = [("J1939", pgn, sa) for sa in sa_list if not self.root.find_j1939_data(pgn, sa)]
+        targets.append(("J1587", mid))
         progress = QProgressDialog(self)
         progress.setMinimumWidth(600)
         progress.setWindowTitle("Requesting Vehicle Network Messages")
         progress.setMinimumDuration(0)
         #progress.setWindowModality(Qt.WindowModal) # Improves stability of program
         progress.setModal(False) 
-        progress.setMaximum(total_requests)
-        request_count = 1
-        for i in range(3):
-            self.root.send_j1587_request(mid)
-            sa_list = [0xff] + self.root.source_addresses
-            random.shuffle(sa_list)
-            for sa in sa_list:
-
-                if self.root.find_j1939_data(pgn,sa):
-                    break
-                if progress.wasCanceled():
-                    break
-                self.root.send_j1939_request(pgn, sa)
-                time.sleep(0.1 + 0.1 * random.random())
-                request_count += 1
-                progress.setValue(request_count)
-                QCoreApplication.processEvents()
+        progress.setMaximum(len(targets))
+        scheduler = self.root.make_scan_scheduler(max_attempts=3)
+        scheduler.add_targets(targets)
+        self.root.run_scan_scheduler(scheduler, progress)
 
         progress.deleteLater()             
         self.rebuild_trees()
@@ -0,0 +1,207 @@
+"""
+Serializers for the data package.
+
+canonical - compact JSON with sorted keys, no whitespace and only ASCII
+            characters. The same data always gives the same text, so this is
+            the form that is signed and stored. Without an indent the json
+            module uses its C encoder, which is several times faster.
+pretty    - JSON with sorted keys and an indent of 4 for people to read.
+binary    - a MessagePack encoding of the same data, described below.
+
+Binary schema (version 1):
+    b"TUDP"            magic
+    0x01               version
+    one MessagePack object holding the data package:
+        dict  -> map with the keys as strings, sorted like the canonical JSON
+        list, tuple -> array
+        str   -> str (UTF-8)
+        bytes -> bin
+        int   -> int, up to 64 bits
+        float -> float 64
+        True, False, None -> true, false, nil
+Dictionary keys are turned into strings the same way the json module does,
+so the binary and JSON forms decode to the same data.
+"""
+import json
+import struct
+
+import logging
+logger = logging.getLogger(__name__)
+
+BINARY_MAGIC = b"TUDP"
+BINARY_VERSION = 1
+
+def canonical_dumps(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+def canonical_bytes(data):
+    return canonical_dumps(data).encode('ascii')
+
+def pretty_dumps(data):
+    return json.dumps(data, sort_keys=True, indent=4)
+
+def json_key(key):
+    """
+    Convert a dictionary key the way json.dumps does.
+    """
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    if isinstance(key, int):
+        return int.__repr__(key)
+    if isinstance(key, float):
+        return json.dumps(key)
+    raise TypeError("Keys must be str, int, float, bool or None, not {}".format(type(key).__name__))
+
+def pack_object(value, out):
+    if value is None:
+        out.append(0xc0)
+    elif value is True:
+        out.append(0xc3)
+    elif value is False:
+        out.append(0xc2)
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -32 <= value < 0:
+            out.append(value & 0xff)
+        elif 0 <= value <= 0xffffffffffffffff:
+            out += b'\xcf' + struct.pack(">Q", value)
+        elif -0x8000000000000000 <= value < 0:
+            out += b'\xd3' + struct.pack(">q", value)
+        else:
+            raise OverflowError("Integer {} does not fit in 64 bits".format(value))
+    elif isinstance(value, float):
+        out += b'\xcb' + struct.pack(">d", value)
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        length = len(encoded)
+        if length < 32:
+            out.append(0xa0 | length)
+        elif length < 0x10000:
+            out += b'\xda' + struct.pack(">H", length)
+        else:
+            out += b'\xdb' + struct.pack(">L", length)
+        out += encoded
+    elif isinstance(value, (bytes, bytearray)):
+        length = len(value)
+        if length < 0x100:
+            out += b'\xc4' + bytes([length])
+        elif length < 0x10000:
+            out += b'\xc5' + struct.pack(">H", length)
+        else:
+            out += b'\xc6' + struct.pack(">L", length)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        length = len(value)
+        if length < 16:
+            out.append(0x90 | length)
+        elif length < 0x10000:
+            out += b'\xdc' + struct.pack(">H", length)
+        else:
+            out += b'\xdd' + struct.pack(">L", length)
+        for item in value:
+            pack_object(item, out)
+    elif isinstance(value, dict):
+        length = len(value)
+        if length < 16:
+            out.append(0x80 | length)
+        elif length < 0x10000:
+            out += b'\xde' + struct.pack(">H", length)
+        else:
+            out += b'\xdf' + struct.pack(">L", length)
+        for key, item in sorted((json_key(key), item) for key, item in value.items()):
+            pack_object(key, out)
+            pack_object(item, out)
+    else:
+        raise TypeError("Object of type {} can't be packed".format(type(value).__name__))
+
+def binary_dumps(data):
+    out = bytearray(BINARY_MAGIC)
+    out.append(BINARY_VERSION)
+    pack_object(data, out)
+    return bytes(out)
+
+# Formats for the fixed size MessagePack types: (struct format, size)
+FIXED_TYPES = {0xca: (">f", 4),
+               0xcb: (">d", 8),
+               0xcc: (">B", 1),
+               0xcd: (">H", 2),
+               0xce: (">L", 4),
+               0xcf: (">Q", 8),
+               0xd0: (">b", 1),
+               0xd1: (">h", 2),
+               0xd2: (">l", 4),
+               0xd3: (">q", 8)}
+# Types with a length before the contents: (kind, length format, length size)
+SIZED_TYPES = {0xc4: ("bin", ">B", 1),
+               0xc5: ("bin", ">H", 2),
+               0xc6: ("bin", ">L", 4),
+               0xd9: ("str", ">B", 1),
+               0xda: ("str", ">H", 2),
+               0xdb: ("str", ">L", 4),
+               0xdc: ("array", ">H", 2),
+               0xdd: ("array", ">L", 4),
+               0xde: ("map", ">H", 2),
+               0xdf: ("map", ">L", 4)}
+
+def unpack_object(buffer, index):
+    """
+    Returns (value, next index) for the object starting at index.
+    """
+    code = buffer[index]
+    index += 1
+    if code < 0x80:
+        return code, index
+    if code >= 0xe0:
+        return code - 0x100, index
+    if code < 0x90:
+        kind, length = "map", code & 0x0f
+    elif code < 0xa0:
+        kind, length = "array", code & 0x0f
+    elif code < 0xc0:
+        kind, length = "str", code & 0x1f
+    elif code == 0xc0:
+        return None, index
+    elif code == 0xc2:
+        return False, index
+    elif code == 0xc3:
+        return True, index
+    elif code in FIXED_TYPES:
+        value_format, size = FIXED_TYPES[code]
+        return struct.unpack_from(value_format, buffer, index)[0], index + size
+    elif code in SIZED_TYPES:
+        kind, length_format, size = SIZED_TYPES[code]
+        length = struct.unpack_from(length_format, buffer, index)[0]
+        index += size
+    else:
+        raise ValueError("Unsupported MessagePack type 0x{:02X}".format(code))
+
+    if kind == "str":
+        return bytes(buffer[index:index + length]).decode('utf-8'), index + length
+    elif kind == "bin":
+        return bytes(buffer[index:index + length]), index + length
+    elif kind == "array":
+        items = []
+        for i in range(length):
+            item, index = unpack_object(buffer, index)
+            items.append(item)
+        return items, index
+    mapping = {}
+    for i in range(length):
+        key, index = unpack_object(buffer, index)
+        mapping[key], index = unpack_object(buffer, index)
+    return mapping, index
+
+def binary_loads(buffer):
+    if bytes(buffer[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+        raise ValueError("Not a binary data package.")
+    if buffer[len(BINARY_MAGIC)] != BINARY_VERSION:
+        raise ValueError("Binary data package version {} is not supported.".format(buffer[len(BINARY_MAGIC)]))
+    value, index = unpack_object(memoryview(buffer), len(BINARY_MAGIC) + 1)
+    return value
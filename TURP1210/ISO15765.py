@@ -6,6 +6,7 @@ import struct
 import threading
 import json
 import base64
+from collections import OrderedDict
 from TURP1210.RP1210.RP1210Functions import *
 
 
@@ -18,6 +19,9 @@ ISO_PGN = 0xDA00
 
 SIDNR = 0x7F
 
+# Seconds to wait for the next consecutive frame (N_Cr in ISO 15765-2)
+N_CR = 1.0
+
 service_identifier = { 0x7F: "Negative Response",
                        0x10: "Diagnostic Session Control",
                        0x11: "ECU Reset",
@@ -92,43 +96,124 @@ def transport_separate_data(data):
         yield block[data_ptr:data_ptr + 7]
         data_ptr += 7
 
-class ISOTransportQueue:
-    def __init__(self, source_address, dest_address, first_frame_message):
+class ISOTransportSession:
+    '''
+    One segmented message that is being received. The frames are written
+    into a buffer of the message length as they come in.
+    '''
+    def __init__(self, source_address, dest_address, first_frame_message, start_time):
         self.dest_address = dest_address
         self.source_address = source_address
         (self.data_length, first_data) = dissect_first_frame(first_frame_message)
-        remaining_data = self.data_length - 6
-        num_data_messages = remaining_data // 7 if remaining_data % 7 == 0 else remaining_data // 7 + 1
-        self.message_queue = [None] * (num_data_messages + 1)
-        self.message_queue[0] = first_data
-
-    def add_message(self, consecutive_frame):
+        self.buffer = bytearray(self.data_length)
+        self.received = 0
+        self.next_sequence = 1
+        self.deadline = start_time + N_CR
+        self.write(first_data)
+
+    def write(self, data):
+        count = min(len(data), self.data_length - self.received)
+        self.buffer[self.received:self.received + count] = memoryview(data)[:count]
+        self.received += count
+
+    def add_message(self, consecutive_frame, now):
+        """
+        Add the data of a consecutive frame. The sequence number counts up
+        from 1 and wraps from 15 to 0. Returns False if it is out of order.
+        """
         (seq_num, data_portion) = dissect_consecutive_frame(consecutive_frame)
-        i = seq_num
-        while i < len(self.message_queue):
-            if self.message_queue[i] is None:
-                self.message_queue[i] = data_portion
-                return
-            else:
-                i += 16
-
-        #raise Exception("ISO15765 message_queue full")
+        if seq_num != self.next_sequence:
+            return False
+        self.next_sequence = (self.next_sequence + 1) & 0x0F
+        self.write(data_portion)
+        self.deadline = now + N_CR
+        return True
 
     def is_full(self):
-        return None not in self.message_queue
+        return self.received == self.data_length
 
     def get_data(self):
         if self.is_full():
-            return b''.join(self.message_queue)[:self.data_length]
+            return bytes(self.buffer)
         else:
-            raise Exception("Called get_data on ISOTransportQueue before full")
+            raise Exception("Called get_data on ISOTransportSession before full")
+
+
+class ISOReassembler():
+    '''
+    Reassembles the segmented ISO 15765 messages of many ECUs at once. The
+    sessions are keyed by (SA, DA), so an ECU answering two testers, or two
+    ECUs answering at the same time, do not mix their frames.
+    '''
+    def __init__(self):
+        self.sessions = OrderedDict() # (SA, DA): ISOTransportSession
+        self.stats = OrderedDict([("Single Frames", 0),
+                                  ("First Frames", 0),
+                                  ("Completed", 0),
+                                  ("Timed Out", 0),
+                                  ("Sequence Errors", 0),
+                                  ("Replaced", 0),
+                                  ("Unexpected Frames", 0)])
+
+    def start_session(self, src_addr, dst_addr, first_frame_message, now=None):
+        """
+        Start a session for a first frame. A new first frame ends a session
+        that was open between the same addresses. Returns False if the
+        frame is not a valid first frame.
+        """
+        if now is None:
+            now = time.time()
+        self.check_timeouts(now)
+        data_length = dissect_first_frame(first_frame_message)[0]
+        if data_length < 7 or len(first_frame_message) < 8:
+            self.stats["Unexpected Frames"] += 1
+            return False
+        key = (src_addr, dst_addr)
+        if key in self.sessions:
+            self.stats["Replaced"] += 1
+        self.sessions[key] = ISOTransportSession(src_addr, dst_addr, first_frame_message, now)
+        self.stats["First Frames"] += 1
+        return True
+
+    def add_consecutive_frame(self, src_addr, dst_addr, consecutive_frame, now=None):
+        """
+        Add a consecutive frame to its session. Returns the session when it
+        completes the message, otherwise None.
+        """
+        if now is None:
+            now = time.time()
+        self.check_timeouts(now)
+        key = (src_addr, dst_addr)
+        session = self.sessions.get(key)
+        if session is None:
+            self.stats["Unexpected Frames"] += 1
+            return None
+        if not session.add_message(consecutive_frame, now):
+            # A missing or repeated frame spoils the message
+            logger.debug("ISO 15765 sequence error from {} to {}".format(src_addr, dst_addr))
+            self.stats["Sequence Errors"] += 1
+            del self.sessions[key]
+            return None
+        if session.is_full():
+            del self.sessions[key]
+            self.stats["Completed"] += 1
+            return session
+        return None
+
+    def check_timeouts(self, now):
+        for key, session in list(self.sessions.items()):
+            if now > session.deadline:
+                logger.debug("ISO 15765 message from {} to {} timed out with {} of {} bytes".format(
+                    session.source_address, session.dest_address, session.received, session.data_length))
+                self.stats["Timed Out"] += 1
+                del self.sessions[key]
 
 
 class ISO15765Driver():
     def __init__(self, parent, iso_read_queue,):
         self.read_queue = iso_read_queue
         self.root = parent
-        self.transport_queues = {}
+        self.reassembler = ISOReassembler()
         self.uds_count = 0
         self.uds_messages = {}
 
@@ -149,33 +234,27 @@ class ISO15765Driver():
             #if display:
             #    logger.debug("Received ISO message: {}".format((pgn, priority, src_addr, dst_addr, message_data)))
             if is_first_frame(message_data):
-                #don't do anything if we already see a session from this source
                 #logger.debug("This was the First Frame of an ISO message.")
-                if not self.transport_queues.get(src_addr):
-                    self.transport_queues[src_addr] = ISOTransportQueue(src_addr,
-                                                                            dst_addr,
-                                                                            message_data)
+                if self.reassembler.start_session(src_addr, dst_addr, message_data):
                     fc_data = bytes([(0x3 << 4), 0, 0, 0, 0, 0, 0, 0])
                     if not display: # Only respond if not displaying. Display is a different object
                         self.send_message(fc_data, dst=src_addr)
 
             elif is_consecutive_frame(message_data):
                 #logger.debug("This was a consecutive frame of an ISO message.")
-                this_queue = self.transport_queues.get(src_addr)
-                if this_queue:
-                    this_queue.add_message(message_data)
-                    if this_queue.is_full():
-                        completed_data = this_queue.get_data()
-                        del(self.transport_queues[src_addr])
-                        if display:
-                            self.display_values(completed_data,
-                                                this_queue.source_address,
-                                                this_queue.dest_address)
-                        return (0xda00, 6, this_queue.source_address,
-                                this_queue.dest_address, completed_data)
+                this_session = self.reassembler.add_consecutive_frame(src_addr, dst_addr, message_data)
+                if this_session is not None:
+                    completed_data = this_session.get_data()
+                    if display:
+                        self.display_values(completed_data,
+                                            this_session.source_address,
+                                            this_session.dest_address)
+                    return (0xda00, 6, this_session.source_address,
+                            this_session.dest_address, completed_data)
             elif is_fc_frame(message_data):
                 pass
             else:
+                self.reassembler.stats["Single Frames"] += 1
                 data_length, message_data = dissect_other_frame(message_data)
                 if display:
                     self.display_values(message_data[:data_length], src_addr, dst_addr)
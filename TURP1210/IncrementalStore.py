@@ -0,0 +1,385 @@
+"""
+An append-only store for data packages and their network logs.
+
+A save only appends what changed since the last one:
+    - each top level section of the data package whose JSON changed
+    - for the large keyed sections, like the J1939 PGNs and SPNs, each entry
+      whose JSON changed, so one changed PGN does not save the whole table
+    - the bytes added to each log file since the last save
+Every chunk is hashed with SHA-256 and the hashes are chained, so a chunk
+can't be changed or dropped without breaking every link after it. The
+manifest lists the chunks in order and a small head records the last link.
+The head is signed when a signing function is given.
+
+Entries that change on every save, like message counts, leave old chunks
+behind. When those take up more than the live data, the store is compacted:
+the live chunks are copied into a new store, which starts a new chain, and
+it replaces the old one.
+
+Files in the store directory:
+    chunks.bin     the chunk data, one after the other
+    manifest.jsonl one line per chunk
+    head.json      the last link of the chain, chunk count and store size
+    head.pgp       head.json signed
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import traceback
+from collections import OrderedDict
+from TURP1210.DataPackageEncoder import canonical_bytes
+
+import logging
+logger = logging.getLogger(__name__)
+
+CHUNK_FILE = "chunks.bin"
+MANIFEST_FILE = "manifest.jsonl"
+HEAD_FILE = "head.json"
+SIGNED_HEAD_FILE = "head.pgp"
+STORE_EXTENSION = ".store"
+COMPACT_EXTENSION = ".compact"
+OLD_EXTENSION = ".old"
+
+GENESIS = "0" * 64
+LOG_CHUNK_SIZE = 1 << 20
+# Stores smaller than this are not compacted
+COMPACT_MIN_BYTES = 1 << 20
+
+SECTION = "Section"
+ENTRY = "Entry"
+DELETED = "Deleted"
+LOG = "Log"
+
+# Sections saved one entry at a time
+ENTRY_SECTIONS = ["J1939 Parameter Group Numbers",
+                  "J1939 Suspect Parameter Numbers",
+                  "J1587 Message and Parameter IDs",
+                  "UDS Messages"]
+
+EMPTY_SECTION = canonical_bytes({})
+
+def get_store_path(filename):
+    """
+    The store for a data file sits next to it.
+    """
+    return os.path.splitext(filename)[0] + STORE_EXTENSION
+
+def chain_hash(previous, kind, name, digest):
+    return hashlib.sha256("{}{}{}{}".format(previous, kind, name, digest).encode('utf-8')).hexdigest()
+
+def get_chain_name(entry):
+    """
+    The name linked into the chain. Entries of a section include their key.
+    """
+    if "Key" in entry:
+        return "{}/{}".format(entry["Name"], entry["Key"])
+    return entry["Name"]
+
+
+class IncrementalStore():
+    '''
+    Saves a data package and its logs by appending the changes.
+    '''
+    def __init__(self, path, sign=None, entry_sections=ENTRY_SECTIONS):
+        """
+        sign is called with the head dictionary and should return a signed
+        message, like UserData.make_pgp_message. The sections named in
+        entry_sections are saved one entry at a time.
+        """
+        self.path = path
+        self.sign = sign
+        self.entry_sections = set(entry_sections)
+        self.chunk_filename = os.path.join(path, CHUNK_FILE)
+        self.manifest_filename = os.path.join(path, MANIFEST_FILE)
+        if not os.path.isdir(path) and os.path.isdir(path + OLD_EXTENSION):
+            # A compaction stopped before the new store was in place
+            os.replace(path + OLD_EXTENSION, path)
+        os.makedirs(path, exist_ok=True)
+        self.load_manifest()
+
+    def reset_state(self):
+        self.entries = []
+        self.section_hashes = {}
+        self.entry_hashes = {} # section: {key: hash}
+        self.live_lengths = {} # (section, key): chunk length
+        self.log_sizes = {}
+        self.chain = GENESIS
+        self.store_size = 0
+
+    def load_manifest(self):
+        """
+        Pick up where the last save left off. Chunk data written after the
+        last manifest line, from a save that did not finish, is dropped.
+        """
+        self.reset_state()
+        try:
+            with open(self.manifest_filename, 'r') as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.debug("Ignoring an incomplete line in {}".format(self.manifest_filename))
+                        break
+                    self.add_entry(entry)
+        except FileNotFoundError:
+            pass
+        with open(self.chunk_filename, 'ab') as chunk_file:
+            if chunk_file.tell() > self.store_size:
+                chunk_file.truncate(self.store_size)
+
+    def add_entry(self, entry):
+        self.entries.append(entry)
+        self.chain = entry["Chain"]
+        self.store_size = entry["Offset"] + entry["Length"]
+        name = entry["Name"]
+        if entry["Kind"] == SECTION:
+            # A section chunk replaces the section and any entries saved for it
+            self.section_hashes[name] = entry["SHA256"]
+            for key in self.entry_hashes.pop(name, {}):
+                self.live_lengths.pop((name, key), None)
+            self.entry_hashes[name] = {}
+            self.live_lengths[(name, None)] = entry["Length"]
+        elif entry["Kind"] == ENTRY:
+            self.entry_hashes.setdefault(name, {})[entry["Key"]] = entry["SHA256"]
+            self.live_lengths[(name, entry["Key"])] = entry["Length"]
+        elif entry["Kind"] == DELETED:
+            if "Key" in entry:
+                self.entry_hashes.get(name, {}).pop(entry["Key"], None)
+                self.live_lengths.pop((name, entry["Key"]), None)
+            else:
+                self.section_hashes.pop(name, None)
+                for key in self.entry_hashes.pop(name, {}):
+                    self.live_lengths.pop((name, key), None)
+                self.live_lengths.pop((name, None), None)
+        elif entry["Kind"] == LOG:
+            self.log_sizes[name] = entry["Log Offset"] + entry["Length"]
+
+    @property
+    def live_size(self):
+        """
+        The bytes of the chunks a load would still use.
+        """
+        return sum(self.live_lengths.values()) + sum(self.log_sizes.values())
+
+    def append_chunk(self, chunk_file, manifest_file, kind, name, payload, log_offset=None, key=None):
+        digest = hashlib.sha256(payload).hexdigest()
+        chunk_file.write(payload)
+        entry = OrderedDict([("Kind", kind),
+                             ("Name", name)])
+        if key is not None:
+            entry["Key"] = key
+        entry.update([("Offset", self.store_size),
+                      ("Length", len(payload)),
+                      ("SHA256", digest),
+                      ("Chain", chain_hash(self.chain, kind, get_chain_name(entry), digest))])
+        if log_offset is not None:
+            entry["Log Offset"] = log_offset
+        manifest_file.write(json.dumps(entry) + "\n")
+        self.add_entry(entry)
+        return len(payload)
+
+    def save_entries(self, chunk_file, manifest_file, name, section):
+        new_bytes = 0
+        if self.section_hashes.get(name) != hashlib.sha256(EMPTY_SECTION).hexdigest():
+            # The entries are added to an empty section
+            new_bytes += self.append_chunk(chunk_file, manifest_file, SECTION, name, EMPTY_SECTION)
+        entry_hashes = self.entry_hashes[name]
+        for key in sorted(section):
+            payload = canonical_bytes(section[key])
+            if hashlib.sha256(payload).hexdigest() != entry_hashes.get(key):
+                new_bytes += self.append_chunk(chunk_file, manifest_file, ENTRY, name, payload, key=key)
+        for key in sorted(set(entry_hashes) - set(section)):
+            self.append_chunk(chunk_file, manifest_file, DELETED, name, b'', key=key)
+        return new_bytes
+
+    def save_sections(self, chunk_file, manifest_file, data_package):
+        new_bytes = 0
+        for name in sorted(data_package):
+            if name in self.entry_sections and isinstance(data_package[name], dict):
+                new_bytes += self.save_entries(chunk_file, manifest_file, name, data_package[name])
+                continue
+            payload = canonical_bytes(data_package[name])
+            if hashlib.sha256(payload).hexdigest() != self.section_hashes.get(name) or self.entry_hashes.get(name):
+                new_bytes += self.append_chunk(chunk_file, manifest_file, SECTION, name, payload)
+        for name in sorted(set(self.section_hashes) - set(data_package)):
+            self.append_chunk(chunk_file, manifest_file, DELETED, name, b'')
+        return new_bytes
+
+    def save_log(self, chunk_file, manifest_file, name, log_filename):
+        """
+        Append the bytes added to a log since the last save. A log that got
+        shorter was started over, so it is saved again from the start.
+        """
+        try:
+            log_size = os.path.getsize(log_filename)
+        except OSError:
+            logger.debug(traceback.format_exc())
+            return 0
+        offset = self.log_sizes.get(name, 0)
+        if log_size < offset:
+            offset = 0
+        new_bytes = 0
+        with open(log_filename, 'rb') as log_file:
+            log_file.seek(offset)
+            while offset < log_size:
+                payload = log_file.read(min(LOG_CHUNK_SIZE, log_size - offset))
+                if not payload:
+                    break
+                new_bytes += self.append_chunk(chunk_file, manifest_file, LOG, name, payload, offset)
+                offset += len(payload)
+        return new_bytes
+
+    def save(self, data_package, log_files={}):
+        """
+        Append the changed sections and the new log data, then write the
+        head. log_files maps a log name to its file. The store is compacted
+        when it has grown to more than twice its live data. Returns the
+        number of bytes appended.
+        """
+        start_time = time.time()
+        with open(self.chunk_filename, 'ab') as chunk_file, open(self.manifest_filename, 'a') as manifest_file:
+            new_bytes = self.save_sections(chunk_file, manifest_file, data_package)
+            for name, log_filename in log_files.items():
+                new_bytes += self.save_log(chunk_file, manifest_file, name, log_filename)
+            # The chunks have to be on disk before the manifest points to them
+            chunk_file.flush()
+            os.fsync(chunk_file.fileno())
+        self.write_head()
+        logger.debug("Appended {} bytes to {} in {:0.3f} seconds.".format(new_bytes, self.path, time.time() - start_time))
+        if self.store_size > COMPACT_MIN_BYTES and self.store_size > 2 * self.live_size:
+            self.compact()
+        return new_bytes
+
+    def get_live_entries(self):
+        """
+        Returns the manifest entries a load would use, in store order, with
+        each section before its entries.
+        """
+        live = OrderedDict() # section: (section entry, {key: entry})
+        logs = OrderedDict()
+        for entry in self.entries:
+            name = entry["Name"]
+            if entry["Kind"] == SECTION:
+                live.pop(name, None)
+                live[name] = (entry, OrderedDict())
+            elif entry["Kind"] == ENTRY and name in live:
+                live[name][1].pop(entry["Key"], None)
+                live[name][1][entry["Key"]] = entry
+            elif entry["Kind"] == DELETED:
+                if "Key" not in entry:
+                    live.pop(name, None)
+                elif name in live:
+                    live[name][1].pop(entry["Key"], None)
+            elif entry["Kind"] == LOG:
+                # A chunk written at an offset replaces everything after it
+                chunks = logs.setdefault(name, [])
+                while chunks and chunks[-1]["Log Offset"] >= entry["Log Offset"]:
+                    chunks.pop()
+                chunks.append(entry)
+        live_entries = []
+        for section_entry, keyed_entries in live.values():
+            live_entries.append(section_entry)
+            live_entries.extend(keyed_entries.values())
+        return live_entries + [chunk for chunks in logs.values() for chunk in chunks]
+
+    def compact(self):
+        """
+        Copy the live chunks into a new store and put it in place of this one.
+        """
+        start_time = time.time()
+        old_size = self.store_size
+        compact_path = self.path + COMPACT_EXTENSION
+        shutil.rmtree(compact_path, ignore_errors=True)
+        compacted = IncrementalStore(compact_path, self.sign, self.entry_sections)
+        with open(self.chunk_filename, 'rb') as source_file, \
+             open(compacted.chunk_filename, 'ab') as chunk_file, \
+             open(compacted.manifest_filename, 'a') as manifest_file:
+            for entry in self.get_live_entries():
+                compacted.append_chunk(chunk_file, manifest_file, entry["Kind"], entry["Name"],
+                                       self.read_chunk(source_file, entry),
+                                       entry.get("Log Offset"), entry.get("Key"))
+            chunk_file.flush()
+            os.fsync(chunk_file.fileno())
+        compacted.write_head()
+        os.replace(self.path, self.path + OLD_EXTENSION)
+        os.replace(compact_path, self.path)
+        shutil.rmtree(self.path + OLD_EXTENSION, ignore_errors=True)
+        self.load_manifest()
+        logger.info("Compacted {} from {} to {} bytes in {:0.3f} seconds.".format(self.path, old_size, self.store_size, time.time() - start_time))
+
+    def get_head(self):
+        return OrderedDict([("Chain Head", self.chain),
+                            ("Chunk Count", len(self.entries)),
+                            ("Store Size", self.store_size),
+                            ("Time", time.time())])
+
+    def write_head(self):
+        head = self.get_head()
+        self.write_file(HEAD_FILE, json.dumps(head, indent=4))
+        if self.sign is not None:
+            try:
+                self.write_file(SIGNED_HEAD_FILE, str(self.sign(head)))
+            except:
+                logger.debug(traceback.format_exc())
+
+    def write_file(self, name, contents):
+        # Replace the file in one step so a crash leaves the old one
+        filename = os.path.join(self.path, name)
+        with open(filename + ".tmp", 'w') as out_file:
+            out_file.write(contents)
+        os.replace(filename + ".tmp", filename)
+
+    def read_chunk(self, chunk_file, entry):
+        chunk_file.seek(entry["Offset"])
+        return chunk_file.read(entry["Length"])
+
+    def load(self):
+        """
+        Rebuild the data package from the live chunks of each section.
+        """
+        data_package = {}
+        with open(self.chunk_filename, 'rb') as chunk_file:
+            for entry in self.get_live_entries():
+                if entry["Kind"] == SECTION:
+                    data_package[entry["Name"]] = json.loads(self.read_chunk(chunk_file, entry).decode('utf-8'))
+                elif entry["Kind"] == ENTRY:
+                    data_package[entry["Name"]][entry["Key"]] = json.loads(self.read_chunk(chunk_file, entry).decode('utf-8'))
+        return data_package
+
+    def read_log(self, name):
+        """
+        Returns the saved contents of a log as bytes.
+        """
+        contents = bytearray()
+        with open(self.chunk_filename, 'rb') as chunk_file:
+            for entry in self.entries:
+                if entry["Kind"] == LOG and entry["Name"] == name:
+                    del contents[entry["Log Offset"]:]
+                    contents += self.read_chunk(chunk_file, entry)
+        return bytes(contents)
+
+    def verify(self):
+        """
+        Check every chunk against its hash, every link of the chain and the
+        head. Returns True if they all match.
+        """
+        previous = GENESIS
+        with open(self.chunk_filename, 'rb') as chunk_file:
+            for entry in self.entries:
+                digest = hashlib.sha256(self.read_chunk(chunk_file, entry)).hexdigest()
+                if digest != entry["SHA256"]:
+                    logger.info("Chunk {} at {} does not match its hash.".format(get_chain_name(entry), entry["Offset"]))
+                    return False
+                previous = chain_hash(previous, entry["Kind"], get_chain_name(entry), digest)
+                if previous != entry["Chain"]:
+                    logger.info("The chain is broken at chunk {} at {}.".format(get_chain_name(entry), entry["Offset"]))
+                    return False
+        try:
+            with open(os.path.join(self.path, HEAD_FILE), 'r') as head_file:
+                head = json.load(head_file)
+        except (OSError, ValueError):
+            logger.debug(traceback.format_exc())
+            return False
+        return head["Chain Head"] == previous and head["Chunk Count"] == len(self.entries)
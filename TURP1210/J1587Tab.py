@@ -85,6 +85,7 @@ class J1587Tab(QWidget):
         self.j1587_count = 0  # successful 1708 messages
         self.more_info_pids = {}
         self.to_send_1587_list = {}
+        self.response_queue = None # Set by a network scan to see the PIDs as they come in
     
     def init_ui(self):
         tab_layout = QVBoxLayout()
@@ -328,6 +329,8 @@ class J1587Tab(QWidget):
 
         for pid_pair in pid_list:
             pid = pid_pair[0]
+            if self.response_queue is not None:
+                self.response_queue.put(("J1587", current_time, mid, pid))
             if pid in self.pids_to_not_decode:
                 continue
             data_bytes = pid_pair[1]
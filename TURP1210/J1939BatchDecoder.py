@@ -0,0 +1,171 @@
+import numpy as np
+from collections import OrderedDict
+from TURP1210.J1939Decoder import J1939Decoder, SPN_NUMERIC
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Values with more bits than this can't be held exactly in a float64, so they
+# are scaled with Python integers to match the live decoder.
+FLOAT_MANTISSA_BITS = 53
+
+BYTE_SWAP_TYPES = {16: np.uint16,
+                   32: np.uint32,
+                   64: np.uint64}
+
+def records_to_arrays(records):
+    """
+    Convert an iterable of (timestamp, pgn, sa, data_bytes) records into the
+    columns used by the J1939BatchDecoder. The payloads are padded with 0xFF
+    to the longest message.
+    """
+    records = list(records)
+    timestamps = np.array([r[0] for r in records], dtype=np.float64)
+    pgns = np.array([r[1] for r in records], dtype=np.uint32)
+    source_addresses = np.array([r[2] for r in records], dtype=np.uint8)
+    width = max([8] + [len(r[3]) for r in records])
+    width += -width % 8
+    payloads = np.full((len(records), width), 0xFF, dtype=np.uint8)
+    for row, record in enumerate(records):
+        data_bytes = record[3]
+        payloads[row, :len(data_bytes)] = np.frombuffer(bytes(data_bytes), dtype=np.uint8)
+    return timestamps, pgns, source_addresses, payloads
+
+
+class SPNColumn():
+    '''
+    The decoded history of one SPN from one source address.
+    '''
+    def __init__(self, spn_plan, sa, timestamps, raw_values, values):
+        self.spn_plan = spn_plan
+        self.spn = spn_plan.spn
+        self.pgn = spn_plan.pgn
+        self.sa = sa
+        self.timestamps = timestamps
+        self.raw_values = raw_values
+        self.values = values
+        self.out_of_range_high = np.asarray(values > spn_plan.high_value, dtype=bool)
+        self.out_of_range_low = np.asarray(values < spn_plan.low_value, dtype=bool)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def extend(self, other):
+        """
+        Merge in another column for the same SPN and source address. This
+        happens when an SPN is defined in more than one PGN.
+        """
+        order = np.argsort(np.concatenate((self.timestamps, other.timestamps)), kind='stable')
+        self.timestamps = np.concatenate((self.timestamps, other.timestamps))[order]
+        self.raw_values = np.concatenate((self.raw_values, other.raw_values))[order]
+        self.values = np.concatenate((self.values, other.values))[order]
+        self.out_of_range_high = np.concatenate((self.out_of_range_high, other.out_of_range_high))[order]
+        self.out_of_range_low = np.concatenate((self.out_of_range_low, other.out_of_range_low))[order]
+
+    def formatted_values(self):
+        """
+        The values as strings, the same as the Value column in the SPN table.
+        """
+        return [self.spn_plan.format_value(v) for v in self.values.tolist()]
+
+    def meanings(self):
+        """
+        The same text as the Meaning column in the SPN table.
+        """
+        return [self.spn_plan.get_meaning(v) for v in self.values.tolist()]
+
+
+class J1939BatchDecoder():
+    '''
+    Decodes whole columns of J1939 messages at once with NumPy. The messages
+    are grouped by PGN and every numeric SPN in the group is extracted with
+    one mask and shift over the group. The plans come from the J1939Decoder,
+    so the results match J1939Tab.look_up_spns. ASCII, Component ID and raw
+    SPNs have no numeric value and are skipped.
+    '''
+    def __init__(self, j1939db, pgns_to_not_decode=[], decoder=None):
+        if decoder is None:
+            decoder = J1939Decoder(j1939db)
+        self.decoder = decoder
+        self.pgns_to_not_decode = set(pgns_to_not_decode)
+
+    def get_words(self, payloads):
+        """
+        Turn an N x width array of bytes into an N x width/8 array of big
+        endian 64-bit words.
+        """
+        payloads = np.ascontiguousarray(payloads, dtype=np.uint8)
+        if payloads.ndim != 2:
+            raise ValueError("Payloads must be a 2 dimensional array of bytes.")
+        pad = -payloads.shape[1] % 8
+        if pad:
+            payloads = np.hstack((payloads, np.full((payloads.shape[0], pad), 0xFF, dtype=np.uint8)))
+        return payloads.view('>u8').astype(np.uint64)
+
+    def get_raw_values(self, spn_plan, words):
+        word_index = spn_plan.byte_offset // 8
+        if word_index < words.shape[1]:
+            word = words[:, word_index]
+        else:
+            #Missing data is not available (0xFF)
+            word = np.full(words.shape[0], 0xFFFFFFFFFFFFFFFF, dtype=np.uint64)
+        mask = spn_plan.mask & 0xFFFFFFFFFFFFFFFF
+        if spn_plan.shift >= 64 or mask == 0:
+            return np.zeros(words.shape[0], dtype=np.uint64)
+        shifted_decimal = (word & np.uint64(mask)) >> np.uint64(spn_plan.shift)
+        if spn_plan.byte_order is None:
+            return shifted_decimal
+        #reverse the byte order
+        swap_type = BYTE_SWAP_TYPES[spn_plan.byte_order[0].size * 8]
+        return shifted_decimal.astype(swap_type).byteswap().astype(np.uint64)
+
+    def get_numerical_values(self, spn_plan, raw_values):
+        if spn_plan.mask.bit_length() - spn_plan.shift > FLOAT_MANTISSA_BITS:
+            return np.array([r * spn_plan.scale + spn_plan.offset for r in raw_values.tolist()], dtype=object)
+        return raw_values.astype(np.float64) * spn_plan.scale + spn_plan.offset
+
+    def decode(self, timestamps, pgns, source_addresses, payloads):
+        """
+        Decode every numeric SPN in the messages.
+        Returns an OrderedDict of SPNColumns keyed by repr((spn, sa)), in the
+        order the SPNs were first seen.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        pgns = np.asarray(pgns, dtype=np.uint32)
+        source_addresses = np.asarray(source_addresses, dtype=np.uint8)
+        words = self.get_words(payloads)
+
+        groups = pgns.astype(np.uint64) << np.uint64(8) | source_addresses
+        group_keys, first_rows, group_index, group_counts = np.unique(groups, return_index=True,
+                                                                      return_inverse=True, return_counts=True)
+        # Rows of each group are contiguous and in time order after a stable sort
+        sorted_rows = np.argsort(group_index.ravel(), kind='stable')
+        group_starts = np.concatenate(([0], np.cumsum(group_counts)))
+        order = np.argsort(first_rows, kind='stable')
+
+        spn_columns = OrderedDict()
+        for i in order:
+            pgn = int(group_keys[i] >> np.uint64(8))
+            sa = int(group_keys[i] & np.uint64(0xFF))
+            if pgn in self.pgns_to_not_decode:
+                continue
+            spn_plans = self.decoder.get_plan(pgn)
+            if not spn_plans:
+                continue
+            rows = sorted_rows[group_starts[i]:group_starts[i + 1]]
+            group_words = words[rows]
+            for spn_plan in spn_plans:
+                if spn_plan.kind != SPN_NUMERIC:
+                    continue
+                raw_values = self.get_raw_values(spn_plan, group_words)
+                values = self.get_numerical_values(spn_plan, raw_values)
+                spn_key = repr((spn_plan.spn, sa))
+                spn_column = SPNColumn(spn_plan, sa, timestamps[rows], raw_values, values)
+                if spn_key in spn_columns:
+                    spn_columns[spn_key].extend(spn_column)
+                else:
+                    spn_columns[spn_key] = spn_column
+        return spn_columns
+
+    def decode_records(self, records):
+        return self.decode(*records_to_arrays(records))
@@ -0,0 +1,218 @@
+import struct
+import traceback
+from functools import lru_cache
+from TURP1210.RP1210.RP1210Functions import get_printable_chars
+
+import logging
+logger = logging.getLogger(__name__)
+
+# SPNs that are displayed as integers even though their resolution is fractional.
+TIME_SPNS = [959, 960, 961, 963, 962, 964]
+
+# The positions of the fields in the Component ID (PGN 65259) string.
+COMPONENT_ID_PGN = 65259
+COMPONENT_ID_FIELDS = {586: 0, # Make
+                       587: 1, # Model
+                       588: 2, # Serial Number
+                       233: 3} # Unit Number
+
+# Decoding methods for an SPN
+SPN_COMPONENT_ID = 0
+SPN_ASCII = 1
+SPN_NUMERIC = 2
+SPN_RAW = 3
+SPN_INVALID = 4
+
+WORD_STRUCT = struct.Struct(">Q")
+
+# Pairs of (format, reversed format) used to swap the byte order of a field.
+BYTE_ORDER_STRUCTS = {8:  None,
+                      16: (struct.Struct(">H"), struct.Struct("<H")),
+                      32: (struct.Struct(">L"), struct.Struct("<L")),
+                      64: (struct.Struct(">Q"), struct.Struct("<Q"))}
+
+class SPNDecodePlan():
+    '''
+    Everything needed to decode one SPN out of a PGN payload. This is built once
+    from the J1939 database so the per-message work is only masking, shifting and
+    scaling.
+    '''
+    __slots__ = ["spn", "pgn", "name", "units", "acronym", "kind", "field_index",
+                 "byte_offset", "mask", "shift", "byte_order", "scale", "offset",
+                 "high_value", "low_value", "is_bit", "as_integer", "bit_decodings"]
+
+    def __init__(self, spn, pgn, spn_dict, pgn_acronym, bit_decodings, time_spns):
+        self.spn = spn
+        self.pgn = pgn
+        self.name = spn_dict["Name"]
+        self.units = spn_dict["Units"]
+        self.acronym = pgn_acronym
+        self.field_index = None
+        self.byte_offset = 0
+        self.mask = 0
+        self.shift = 0
+        self.byte_order = None
+        self.scale = spn_dict["Resolution"]
+        self.offset = spn_dict["Offset"]
+        self.high_value = spn_dict["OperationalHigh"]
+        self.low_value = spn_dict["OperationalLow"]
+        self.is_bit = self.units == 'bit'
+        self.as_integer = False
+        self.bit_decodings = {}
+
+        if pgn == COMPONENT_ID_PGN:
+            self.kind = SPN_COMPONENT_ID
+            self.field_index = COMPONENT_ID_FIELDS.get(spn)
+        elif self.units == 'ASCII':
+            self.kind = SPN_ASCII
+        elif self.scale > 0 or self.scale == -3:
+            self.kind = SPN_NUMERIC
+            self.compile_bit_field(spn_dict["StartBit"], spn_dict["SPNLength"])
+            if self.scale <= 0:
+                self.scale = 1
+            self.as_integer = self.scale >= 1 or spn in time_spns
+            if self.is_bit and bit_decodings is not None:
+                for key, meaning in bit_decodings.items():
+                    self.bit_decodings[int(key)] = meaning.strip().capitalize()
+        else: #Should not be converted to a decimal number
+            self.kind = SPN_RAW
+
+    def compile_bit_field(self, spn_start, spn_length):
+        """
+        Precompute the 64-bit word, mask, shift and byte swap for the SPN.
+        The start bit is counted from the most significant bit of the first
+        data byte, so fields past the first 8 bytes are found in later words.
+        """
+        while (spn_start + spn_length) > 64:
+            spn_start -= 64
+            self.byte_offset += 8
+        self.shift = 64 - spn_start - spn_length
+        if self.shift < 0 or spn_length > 64:
+            logger.debug("SPN {} with start bit {} and length {} cannot be masked.".format(self.spn, spn_start, spn_length))
+            self.kind = SPN_INVALID
+            return
+        self.mask = ((1 << spn_length) - 1) << self.shift
+
+        if spn_length <= 8:
+            self.byte_order = BYTE_ORDER_STRUCTS[8]
+        elif spn_length <= 16:
+            self.byte_order = BYTE_ORDER_STRUCTS[16]
+        elif spn_length <= 32:
+            self.byte_order = BYTE_ORDER_STRUCTS[32]
+        else:
+            self.byte_order = BYTE_ORDER_STRUCTS[64]
+
+    def get_raw_value(self, data_bytes):
+        """
+        Return the unscaled integer for the SPN out of the data bytes.
+        Missing data is treated as not available (0xFF).
+        """
+        word_bytes = data_bytes[self.byte_offset:self.byte_offset + 8]
+        if len(word_bytes) < 8:
+            word_bytes = bytes(word_bytes) + b'\xFF' * (8 - len(word_bytes))
+        shifted_decimal = (WORD_STRUCT.unpack(word_bytes)[0] & self.mask) >> self.shift
+        if self.byte_order is None:
+            return shifted_decimal
+        #reverse the byte order
+        fmt, rev_fmt = self.byte_order
+        return fmt.unpack(rev_fmt.pack(shifted_decimal))[0]
+
+    def get_numerical_value(self, data_bytes):
+        return self.get_raw_value(data_bytes) * self.scale + self.offset
+
+    def get_meaning(self, numerical_value):
+        # Check for out of range numbers
+        if numerical_value > self.high_value:
+            return "Out of Range - High"
+        elif numerical_value < self.low_value:
+            return "Out of Range - Low"
+        elif self.is_bit:
+            return self.bit_decodings.get(int(numerical_value), "")
+        else:
+            return ""
+
+    def format_value(self, numerical_value):
+        if self.as_integer:
+            try:
+                return "{:d}".format(int(numerical_value))
+            except ValueError:
+                return "{}".format(numerical_value)
+        else:
+            try:
+                return "{:0.3f}".format(numerical_value)
+            except ValueError:
+                return "{}".format(numerical_value)
+
+    def decode(self, data_bytes):
+        """
+        Returns a tuple of (value, meaning). The meaning is None when the
+        decoding method does not produce one.
+        """
+        if self.kind == SPN_NUMERIC:
+            numerical_value = self.get_numerical_value(data_bytes)
+            return (self.format_value(numerical_value), self.get_meaning(numerical_value))
+        elif self.kind == SPN_COMPONENT_ID:
+            comp_id_list = get_printable_chars(data_bytes).split("*")
+            try:
+                return (comp_id_list[self.field_index], None)
+            except (IndexError, TypeError):
+                return ("", None)
+        elif self.kind == SPN_ASCII:
+            return (get_printable_chars(data_bytes), None)
+        else:
+            return (repr(data_bytes), None)
+
+
+class J1939Decoder():
+    '''
+    Decodes J1939 SPNs using plans compiled from the J1939 database. The plans
+    are compiled the first time a PGN is seen and kept in an LRU cache, so the
+    database strings only get formatted and looked up once per PGN. This class
+    has no GUI dependencies so it can be used for live and offline decoding.
+    '''
+    def __init__(self, j1939db, cache_size=512, time_spns=TIME_SPNS):
+        self.j1939db = j1939db
+        self.time_spns = set(time_spns)
+        self.get_plan = lru_cache(maxsize=cache_size)(self.compile_plan)
+
+    def compile_plan(self, pgn):
+        """
+        Build the tuple of SPNDecodePlans for a PGN. Returns None if the PGN is
+        not in the database.
+        """
+        try:
+            pgn_dict = self.j1939db["J1939PGNdb"]["{}".format(pgn)]
+        except KeyError:
+            return None
+
+        spn_plans = []
+        for spn in pgn_dict["SPNs"]:
+            try:
+                spn_dict = self.j1939db["J1939SPNdb"]["{}".format(spn)]
+            except KeyError:
+                logger.debug("SPN {} from PGN {} is not in the J1939 database.".format(spn, pgn))
+                continue
+            bit_decodings = self.j1939db["J1939BitDecodings"].get("{}".format(spn))
+            try:
+                spn_plans.append(SPNDecodePlan(spn, pgn, spn_dict, pgn_dict["Label"], bit_decodings, self.time_spns))
+            except (KeyError, TypeError, ValueError):
+                logger.debug(traceback.format_exc())
+        return tuple(spn_plans)
+
+    def clear_cache(self):
+        self.get_plan.cache_clear()
+
+    def cache_info(self):
+        return self.get_plan.cache_info()
+
+    def decode(self, pgn, data_bytes):
+        """
+        Decode all the SPNs in a PGN payload.
+        Returns a list of (SPNDecodePlan, value, meaning) tuples or None if there
+        is no definition for the PGN.
+        """
+        spn_plans = self.get_plan(pgn)
+        if spn_plans is None:
+            return None
+        return [(spn_plan,) + spn_plan.decode(data_bytes) for spn_plan in spn_plans
+                if spn_plan.kind != SPN_INVALID]
@@ -0,0 +1,266 @@
+import threading
+import time
+import struct
+import traceback
+from collections import OrderedDict
+from TURP1210.RP1210.RP1210Functions import *
+from TURP1210.J1939Decoder import J1939Decoder, TIME_SPNS
+from TURP1210.J1939State import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+ISO_PGN = 0xDA00
+
+# PGNs that are always decoded, even when the data did not change.
+ALWAYS_DECODE_PGNS = [65254, # Time/Date
+                      65271] # Vehicle Electrical Power
+
+# PGNs the GUI does more work with after the SPNs are decoded.
+SPECIAL_PGNS = [65254, # Time/Date
+                65259, # Component ID
+                65260, # VIN
+                65242, # Software ID
+                65271, # Vehicle Electrical Power
+                65253, # Engine Hours
+                65255, # Vehicle Hours
+                65248, # Total Vehicle Distance
+                65217, # High Resolution Distance
+                65226, # DM01
+                65227, # DM02
+                65229] # DM04
+
+class J1939StateProcessor():
+    '''
+    Decodes J1939 messages into the PGN and SPN state without touching the
+    GUI. The changes since the last call to take_delta are collected so the
+    GUI can apply them all at once. All methods are safe to call from
+    different threads.
+    '''
+    def __init__(self, j1939db, pgns_to_not_decode=[], time_spns=TIME_SPNS):
+        self.j1939db = j1939db
+        self.pgns_to_not_decode = set(pgns_to_not_decode)
+        self.decoder = J1939Decoder(j1939db, time_spns=time_spns)
+        self.lock = threading.Lock()
+        self.message_count = 0
+        self.response_queue = None
+        self.response_pgns = set()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.pgn_state = J1939StateStore()
+            self.spn_state = J1939StateStore()
+            self.clear_changes()
+
+    def clear_changes(self):
+        self.changed_pgns = OrderedDict()
+        self.changed_spns = OrderedDict()
+        self.special_messages = []
+        self.iso_messages = []
+
+    def load_state(self, pgn_state, spn_state):
+        """
+        Continue from state loaded out of a data package.
+        """
+        with self.lock:
+            self.pgn_state = J1939StateStore()
+            for key, entry in pgn_state.items():
+                self.pgn_state.add(key, dict(entry))
+            self.spn_state = J1939StateStore()
+            for key, entry in spn_state.items():
+                self.spn_state.add(key, dict(entry))
+            self.clear_changes()
+
+    def take_delta(self):
+        """
+        Returns a dictionary with copies of the PGN and SPN entries that
+        changed, the special PGN messages and the ISO 15765 frames received
+        since the last call.
+        """
+        with self.lock:
+            delta = {"PGNs": [(key, dict(self.pgn_state[key])) for key in self.changed_pgns],
+                     "SPNs": [(key, dict(self.spn_state[key])) for key in self.changed_spns],
+                     "Special": self.special_messages,
+                     "ISO": self.iso_messages}
+            self.clear_changes()
+        return delta
+
+    def watch_responses(self, response_queue, pgns):
+        """
+        Put the messages with these PGNs on the queue as they are decoded,
+        like for a ScanScheduler.
+        """
+        with self.lock:
+            self.response_pgns = set(pgns)
+            self.response_queue = response_queue
+
+    def stop_watching(self):
+        with self.lock:
+            self.response_queue = None
+            self.response_pgns = set()
+
+    def get_sa_name(self, sa):
+        try:
+            return self.j1939db["J1939SATabledb"]["{}".format(sa)]
+        except KeyError:
+            return "Unknown"
+
+    def process_message(self, j1939_buffer):
+        #See The J1939 Message from RP1210_ReadMessage in RP1210
+        current_time = j1939_buffer[0]
+        rx_buffer = j1939_buffer[1]
+        try:
+            vda_time = struct.unpack(">L", rx_buffer[0:4])[0]
+            pgn = rx_buffer[5] + (rx_buffer[6] << 8) + (rx_buffer[7] << 16)
+            pri = rx_buffer[8] # how/priority
+            sa = rx_buffer[9] #Source Address
+            da = rx_buffer[10] #Destination Address
+        except (struct.error, IndexError):
+            return
+
+        with self.lock:
+            self.message_count += 1
+            if pgn == ISO_PGN:
+                self.iso_messages.append((pgn, pri, sa, da, rx_buffer[11:]))
+                return
+
+            if rx_buffer[4] == 1: #Echo message
+                # The message gets logged, but not displayed in the table
+                return
+
+            if self.response_queue is not None and pgn in self.response_pgns:
+                self.response_queue.put(("J1939", current_time, pgn, sa, da, rx_buffer[11:]))
+
+            if pgn in self.pgns_to_not_decode:
+                return
+
+            pgn_key = pack_key(pgn, sa)
+            data_bytes = rx_buffer[11:]
+            try:
+                pgn_dict = self.pgn_state[pgn_key]
+                pgn_dict["Num"] += 1
+                previous_data_bytes = pgn_dict["Bytes"]
+            except KeyError:
+                previous_data_bytes = b''
+                pgn_dict = self.new_pgn_dict(pgn, sa, current_time, vda_time)
+                self.pgn_state.add(pgn_key, pgn_dict)
+
+            pgn_dict["Message Count"] = "{:12d}".format(pgn_dict["Num"])
+            pgn_dict["VDATime"] = vda_time
+            pgn_dict["Period (ms)"] = "{:10.2f}".format(1000 * (current_time - pgn_dict["Start Time"])/pgn_dict["Num"])
+            self.changed_pgns[pgn_key] = True
+
+            # Update if something has changed or if the time or voltage PGN comes in.
+            if data_bytes != previous_data_bytes or pgn in ALWAYS_DECODE_PGNS:
+                if data_bytes != previous_data_bytes:
+                    pgn_dict["Message Time"] = current_time
+                    pgn_dict["VDATime List"] = vda_time
+                    pgn_dict["Bytes"] = data_bytes
+                    pgn_dict["Raw Hexadecimal"] = bytes_to_hex_string(data_bytes)
+                self.look_up_spns(pgn, sa, data_bytes)
+                if pgn in SPECIAL_PGNS:
+                    self.special_messages.append((current_time, pgn, sa, data_bytes, self.get_spn_values(pgn, sa)))
+
+    def new_pgn_dict(self, pgn, sa, current_time, vda_time):
+        pgn_dict = {"Num": 1,
+                    "Start Time": current_time,
+                    "Message Time": current_time,
+                    "VDATime List": vda_time,
+                    "PGN": "{:6d}".format(pgn),
+                    "SA": "{:3d}".format(sa),
+                    "Bytes": b'',
+                    "Raw Hexadecimal": ""}
+        try:
+            pgn_dict["Acronym"] = self.j1939db["J1939PGNdb"]["{}".format(pgn)]["Label"]
+        except KeyError:
+            pgn_dict["Acronym"] = "Unknown"
+        try:
+            pgn_dict["Parameter Group Label"] = self.j1939db["J1939PGNdb"]["{}".format(pgn)]["Name"]
+        except KeyError:
+            pgn_dict["Parameter Group Label"] = "Not Provided"
+        try:
+            pgn_dict["Source"] = self.j1939db["J1939SATabledb"]["{}".format(sa)]
+        except KeyError:
+            pgn_dict["Source"] = "Reserved"
+        return pgn_dict
+
+    def get_spn_values(self, pgn, sa):
+        """
+        Copy the current SPN entries of a PGN into a dictionary keyed by SPN.
+        """
+        spn_values = {}
+        for spn_plan in self.decoder.get_plan(pgn) or []:
+            try:
+                spn_values[spn_plan.spn] = dict(self.spn_state[pack_key(spn_plan.spn, sa)])
+            except KeyError:
+                pass
+        return spn_values
+
+    def look_up_spns(self, pgn, sa, data_bytes):
+        """
+        Decode the SPNs in a message into the SPN state.
+        """
+        decoded_spns = self.decoder.decode(pgn, data_bytes)
+        if decoded_spns is None:
+            return False #We don't have meaning for the data
+
+        for spn_plan, value, meaning in decoded_spns:
+            spn = spn_plan.spn
+            spn_key = pack_key(spn, sa)
+            try:
+                spn_dict = self.spn_state[spn_key]
+            except KeyError:
+                spn_dict = {}
+                spn_dict["Value"] = ""
+                spn_dict["Last Value"] = ""
+                spn_dict["Units"] = spn_plan.units
+                spn_dict["Meaning"] = ""
+                spn_dict["Acronym"] = spn_plan.acronym
+                spn_dict["PGN"] = "{:6d}".format(pgn)
+                spn_dict["SA"] = "{:3d}".format(sa)
+                spn_dict["Source"] = self.get_sa_name(sa)
+                spn_dict["SPN"] = "{:5d}".format(spn)
+                spn_dict["Suspect Parameter Number Label"] = spn_plan.name
+                self.spn_state.add(spn_key, spn_dict)
+                self.changed_spns[spn_key] = True
+
+            spn_dict["Value"] = value
+            if meaning is not None:
+                spn_dict["Meaning"] = meaning
+
+            if spn_dict["Value"] != spn_dict["Last Value"]: #Check to see if the SPN value changed from last time.
+                spn_dict["Last Value"] = spn_dict["Value"]
+                self.changed_spns[spn_key] = True
+        return True
+
+
+class J1939DecodeThread(threading.Thread):
+    '''
+    Decodes the J1939 messages from an RP1210RingBuffer reader so the GUI
+    thread only has to apply the changes.
+    '''
+    def __init__(self, processor, rx_reader, poll_interval=0.005):
+        threading.Thread.__init__(self)
+        self.processor = processor
+        self.rx_reader = rx_reader
+        self.poll_interval = poll_interval
+        self.runSignal = True
+
+    def run(self):
+        logger.debug("J1939 decode thread started.")
+        overruns = 0
+        while self.runSignal:
+            records = self.rx_reader.read()
+            if not records:
+                time.sleep(self.poll_interval)
+                continue
+            for record in records:
+                try:
+                    self.processor.process_message((record[0], record[4]))
+                except:
+                    logger.debug(traceback.format_exc())
+            if self.rx_reader.overruns > overruns:
+                logger.debug("{} J1939 messages were overwritten before they were decoded.".format(self.rx_reader.overruns - overruns))
+                overruns = self.rx_reader.overruns
+        logger.debug("J1939 decode thread is finished.")
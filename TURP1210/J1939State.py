@@ -0,0 +1,110 @@
+import base64
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import logging
+logger = logging.getLogger(__name__)
+
+def pack_key(number, sa):
+    """
+    Pack a PGN or SPN with a source address into one integer key.
+    """
+    return (number << 8) | sa
+
+def unpack_key(key):
+    """
+    Returns the (PGN or SPN, source address) tuple for a packed key.
+    """
+    return (key >> 8, key & 0xFF)
+
+def parse_repr_key(key):
+    """
+    Turn a repr((number, sa)) key from a data package back into a packed key.
+    """
+    number, sa = [int(k) for k in key.strip("()").split(",")]
+    return pack_key(number, sa)
+
+def pgn_entry_to_data_package(entry):
+    """
+    The live PGN entries keep the last payload as raw bytes. Saved files
+    hold it as a base64 "Message List" string instead.
+    """
+    saved_entry = dict(entry)
+    try:
+        saved_entry["Message List"] = base64.b64encode(saved_entry.pop("Bytes")).decode()
+    except KeyError:
+        pass
+    return saved_entry
+
+def pgn_entry_from_data_package(entry):
+    """
+    Restore the raw bytes for a PGN entry from a saved file.
+    """
+    live_entry = dict(entry)
+    try:
+        live_entry["Bytes"] = base64.b64decode(live_entry.pop("Message List").encode('ascii'))
+    except (KeyError, AttributeError, ValueError):
+        live_entry["Bytes"] = b''
+    return live_entry
+
+
+class J1939StateStore(Mapping):
+    '''
+    The live state for PGNs or SPNs, keyed by packed (number, sa) integers.
+    Rows are numbered in the order keys are added and never move, so a table
+    model can find the row for a key without searching.
+    '''
+    def __init__(self):
+        self.entries = {}
+        self.rows = []
+        self.row_index = {}
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, key, entry):
+        """
+        Add or replace an entry. Returns the row of the entry.
+        """
+        if key not in self.entries:
+            self.row_index[key] = len(self.rows)
+            self.rows.append(key)
+        self.entries[key] = entry
+        return self.row_index[key]
+
+    def row_of(self, key):
+        return self.row_index[key]
+
+    def to_data_package(self, entry_function=None):
+        """
+        Make the dictionary keyed with repr((number, sa)) strings that is
+        saved in the data package. The entry_function can convert the live
+        entries into their saved form.
+        """
+        if entry_function is None:
+            return OrderedDict((repr(unpack_key(key)), self.entries[key]) for key in self.rows)
+        return OrderedDict((repr(unpack_key(key)), entry_function(self.entries[key])) for key in self.rows)
+
+    @classmethod
+    def from_data_package(cls, data, entry_function=None):
+        """
+        Build a store from a data package dictionary.
+        """
+        store = cls()
+        for key, entry in data.items():
+            if entry_function is not None:
+                entry = entry_function(entry)
+            try:
+                store.add(parse_repr_key(key), entry)
+            except (ValueError, AttributeError):
+                logger.debug("Skipped the data package entry with key {}".format(key))
+        return store
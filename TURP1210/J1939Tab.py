@@ -43,6 +43,8 @@ from TURP1210.RP1210.RP1210Functions import *
 from TURP1210.TableModel.TableModel import *
 from TURP1210.Graphing.graphing import *
 from TURP1210.ISO15765 import *
+from TURP1210.J1939Pipeline import *
+from TURP1210.J1939State import *
 
 import logging
 logger = logging.getLogger(__name__)
@@ -111,6 +113,8 @@ class J1939Tab(QWidget):
                                     0xF004,
                                     57344, #CM1 message
                                     ]
+        self.processor = J1939StateProcessor(self.j1939db, self.pgns_to_not_decode, self.time_spns)
+        self.decode_thread = None
     def get_pgn_label(self, pgn):
 
         try:
@@ -123,9 +127,8 @@ class J1939Tab(QWidget):
         self.j1939_count = 0  # successful 1939 messages
         self.ecm_time = {}
         self.battery_potential = {}
-        self.pgn_rows = []
-        self.j1939_unique_ids = OrderedDict()
-        self.unique_spns = OrderedDict()
+        self.j1939_unique_ids = J1939StateStore()
+        self.unique_spns = J1939StateStore()
         self.active_trouble_codes = {}
         self.previous_trouble_codes = {}
         self.freeze_frame = {}
@@ -153,9 +156,12 @@ class J1939Tab(QWidget):
         self.j1939_id_table = QTableView()
         self.pgn_data_model = J1939TableModel()
         self.pgn_table_proxy = Proxy()
-        self.pgn_data_model.setDataDict(self.j1939_unique_ids)
+        self.pgn_data_model.setDataStore(self.j1939_unique_ids)
         self.j1939_id_table_columns = ["PGN","Acronym","Parameter Group Label","SA","Source","Message Count","Period (ms)","Raw Hexadecimal"]
         self.pgn_resizable_rows = [0,1,2,3,4]
+        self.pgn_count_column = self.j1939_id_table_columns.index("Message Count")
+        self.pgn_period_column = self.j1939_id_table_columns.index("Period (ms)")
+        self.pgn_hex_column = self.j1939_id_table_columns.index("Raw Hexadecimal")
         self.pgn_data_model.setDataHeader(self.j1939_id_table_columns)
         self.pgn_table_proxy.setSourceModel(self.pgn_data_model)
         self.j1939_id_table.setModel(self.pgn_table_proxy)
@@ -307,9 +313,11 @@ class J1939Tab(QWidget):
         self.spn_table = QTableView()
         self.spn_data_model = J1939TableModel()
         self.spn_table_proxy = Proxy()
-        self.spn_data_model.setDataDict(self.unique_spns)
+        self.spn_data_model.setDataStore(self.unique_spns)
         self.spn_table_columns = ["Acronym","PGN","SA","Source","SPN","Suspect Parameter Number Label","Value","Units","Meaning"]
         self.spn_resizable_rows = [0,1,2,4,5,6,7,8]
+        self.spn_value_column = self.spn_table_columns.index("Value")
+        self.spn_meaning_column = self.spn_table_columns.index("Meaning")
         self.spn_data_model.setDataHeader(self.spn_table_columns)
         self.spn_table_proxy.setSourceModel(self.spn_data_model)
         self.spn_table.setModel(self.spn_table_proxy)
@@ -382,23 +390,36 @@ class J1939Tab(QWidget):
         if self.tabs.currentIndex() == self.tabs.indexOf(self.j1939_spn_tab):
             if len(self.unique_spns) > self.previous_spn_length:
                 self.previous_spn_length = len(self.unique_spns)
-                self.spn_data_model.aboutToUpdate()
-                self.spn_data_model.signalUpdate()
                 self.spn_table.resizeRowsToContents()
                 for r in self.spn_resizable_rows:
                     self.spn_table.resizeColumnToContents(r)
         #self.spn_table.scrollToBottom()
 
+    def refresh_tables(self):
+        """
+        Show the PGN and SPN changes collected since the last call. This is
+        called once per read_rp1210 tick so the views repaint once instead
+        of once per message.
+        """
+        if self.pgn_data_model.flushUpdates():
+            self.j1939_id_table.resizeRowsToContents()
+            self.j1939_id_table.scrollToBottom()
+            for r in self.pgn_resizable_rows:
+                self.j1939_id_table.resizeColumnToContents(r)
+        if self.spn_data_model.flushUpdates():
+            self.fill_spn_table()
+
     def clear_j1939_table(self):
+        self.processor.reset()
 
         self.pgn_data_model.beginResetModel()
-        self.j1939_unique_ids = OrderedDict()
-        self.pgn_data_model.setDataDict(self.j1939_unique_ids)
+        self.j1939_unique_ids = J1939StateStore()
+        self.pgn_data_model.setDataStore(self.j1939_unique_ids)
         self.pgn_data_model.endResetModel()
         
         self.spn_data_model.beginResetModel()
-        self.unique_spns = OrderedDict()
-        self.spn_data_model.setDataDict(self.unique_spns)
+        self.unique_spns = J1939StateStore()
+        self.spn_data_model.setDataStore(self.unique_spns)
         self.spn_data_model.endResetModel()
         
         self.dm01_data_model.beginResetModel()
@@ -422,43 +443,72 @@ class J1939Tab(QWidget):
         self.uds_data_model.endResetModel()
         
     def fill_j1939_table(self, j1939_buffer):
-        #See The J1939 Message from RP1210_ReadMessage in RP1210
-        current_time = j1939_buffer[0]
-        rx_buffer = j1939_buffer[1]
-        try:
-            vda_time = struct.unpack(">L", rx_buffer[0:4])[0]
-            pgn = rx_buffer[5] + (rx_buffer[6] << 8) + (rx_buffer[7] << 16)
-            pri = rx_buffer[8] # how/priority
-            sa = rx_buffer[9] #Source Address
-            da = rx_buffer[10] #Destination Address
-        except (struct.error, IndexError):
-            return
-
-        if pgn == 0xDA00: #ISO
-            self.iso_queue.put((pgn, pri, sa, da, rx_buffer[11:]))
-            self.iso_recorder.read_message(True)
+        """
+        Decode a J1939 message from RP1210_ReadMessage. The tables are
+        updated with the change at the next call of update_tables.
+        """
+        self.processor.process_message(j1939_buffer)
+
+    def start_decode_thread(self, rx_reader):
+        """
+        Decode the messages from a ring buffer reader in a worker thread
+        instead of the GUI thread.
+        """
+        self.stop_decode_thread()
+        self.decode_thread = J1939DecodeThread(self.processor, rx_reader)
+        self.decode_thread.setDaemon(True) #needed to close the thread when the application closes.
+        self.decode_thread.start()
+
+    def stop_decode_thread(self):
+        if self.decode_thread is not None:
+            self.decode_thread.runSignal = False
+            self.decode_thread = None
+
+    def update_tables(self):
+        """
+        Apply the changes decoded since the last call. This runs once per
+        read_rp1210 tick.
+        """
+        delta = self.processor.take_delta()
+        if delta["ISO"]:
+            for iso_message in delta["ISO"]:
+                self.iso_queue.put(iso_message)
+                self.iso_recorder.read_message(True)
             self.root.data_package["UDS Messages"].update(self.iso_recorder.uds_messages)
-            return
-        
-        if rx_buffer[4] == 1: #Echo message
-            # Return when the VDA is the one that sent the message. 
-            # The message gets logged, but not displayed in the table
-            return 
 
-        if pgn in self.pgns_to_not_decode:
-            # Return when we aren't interested in the data.
-            return
+        update_pgn_cells = self.add_message_button.isChecked()
+        for pgn_key, pgn_dict in delta["PGNs"]:
+            if pgn_key in self.j1939_unique_ids:
+                row = self.j1939_unique_ids.add(pgn_key, pgn_dict)
+                if update_pgn_cells:
+                    self.pgn_data_model.markDirty(row, self.pgn_count_column)
+                    self.pgn_data_model.markDirty(row, self.pgn_period_column)
+                    self.pgn_data_model.markDirty(row, self.pgn_hex_column)
+            else:
+                # New rows are shown by refresh_tables
+                self.add_source_address(pgn_key & 0xFF)
+                self.j1939_unique_ids.add(pgn_key, pgn_dict)
+
+        for spn_key, spn_dict in delta["SPNs"]:
+            row = self.unique_spns.add(spn_key, spn_dict)
+            self.spn_data_model.markDirty(row, self.spn_value_column)
+            self.spn_data_model.markDirty(row, self.spn_meaning_column)
+
+        for special_message in delta["Special"]:
+            try:
+                self.process_special_pgn(*special_message)
+            except (KeyError, ValueError):
+                logger.debug(traceback.format_exc())
+
+        self.refresh_tables()
 
-        pgn_key = repr((pgn,sa))
+    def add_source_address(self, sa):
         source_key = "{} on J1939".format(self.get_sa_name(sa))
         if sa not in self.battery_potential.keys():
             self.battery_potential[sa] = []
             logger.debug("Set battery potential for SA {} to an empty list.".format(sa))
 
         if sa not in self.root.source_addresses:
-        #if sa not in self.ecm_time.keys():
-            #self.ecm_time[sa]=[]
-
             self.root.source_addresses.append(sa)
             self.root.data_package["Time Records"][source_key] = {}
             self.root.data_package["Component Information"][source_key] = {}
@@ -466,186 +516,113 @@ class J1939Tab(QWidget):
             self.root.data_package["Distance Information"][source_key] = {}
             
             logger.info("Added source address {} - {} to the list of known source addresses.".format(sa,self.get_sa_name(sa)))
-        
-         
-
-        data_bytes = rx_buffer[11:]
-        
-        try:
-            self.j1939_unique_ids[pgn_key]["Num"] += 1
-            previous_data_bytes = base64.b64decode(self.j1939_unique_ids[pgn_key]["Message List"].encode('ascii'))
-        except KeyError:
-            previous_data_bytes = base64.b64encode(b'').decode()
-            self.j1939_unique_ids[pgn_key] = {"Num": 1}
-            self.pgn_rows = list(self.j1939_unique_ids.keys())
-            #self.j1939_unique_ids[pgn_key]["Table Key"] = pgn_key
-            self.j1939_unique_ids[pgn_key]["Start Time"] = current_time
-            self.j1939_unique_ids[pgn_key]["Message Time"] = current_time
-            self.j1939_unique_ids[pgn_key]["Message List"] = base64.b64encode(data_bytes).decode()
-            self.j1939_unique_ids[pgn_key]["VDATime List"] = vda_time
-            try:
-                self.j1939_unique_ids[pgn_key]["Acronym"] = self.j1939db["J1939PGNdb"]["{}".format(pgn)]["Label"]
-            except KeyError:
-                self.j1939_unique_ids[pgn_key]["Acronym"] = "Unknown"
-            try:
-                self.j1939_unique_ids[pgn_key]["Parameter Group Label"] = self.j1939db["J1939PGNdb"]["{}".format(pgn)]["Name"]
-            except KeyError:
-                self.j1939_unique_ids[pgn_key]["Parameter Group Label"] = "Not Provided"
-            try:
-                self.j1939_unique_ids[pgn_key]["Source"] = self.j1939db["J1939SATabledb"]["{}".format(sa)]
-            except KeyError:
-                self.j1939_unique_ids[pgn_key]["Source"] = "Reserved"
-            self.look_up_spns(pgn, sa, data_bytes)
-
-        self.j1939_unique_ids[pgn_key]["Message Count"] = "{:12d}".format(self.j1939_unique_ids[pgn_key]["Num"])
-        self.j1939_unique_ids[pgn_key]["VDATime"] = vda_time
-        self.j1939_unique_ids[pgn_key]["PGN"] = "{:6d}".format(pgn)
-        self.j1939_unique_ids[pgn_key]["SA"] = "{:3d}".format(sa)
-        self.j1939_unique_ids[pgn_key]["Bytes"] = data_bytes
-        self.j1939_unique_ids[pgn_key]["Raw Hexadecimal"] = bytes_to_hex_string(data_bytes)
-        self.j1939_unique_ids[pgn_key]["Period (ms)"] = "{:10.2f}".format(1000 * (current_time - self.j1939_unique_ids[pgn_key]["Start Time"])/self.j1939_unique_ids[pgn_key]["Num"])
-        
-        if self.j1939_unique_ids[pgn_key]["Num"] == 1:
-            #logger.debug("Adding Row to PGN Table:")
-            #logger.debug(self.j1939_unique_ids[pgn_key])
-            self.pgn_data_model.aboutToUpdate()
-            self.pgn_data_model.setDataDict(self.j1939_unique_ids)
-            self.pgn_data_model.signalUpdate()
-            self.j1939_id_table.resizeRowsToContents()     
-            self.j1939_id_table.scrollToBottom()
-            for r in self.pgn_resizable_rows:
-                self.j1939_id_table.resizeColumnToContents(r)
-
-            QCoreApplication.processEvents()
 
-        elif self.add_message_button.isChecked():
-           
-            row = self.pgn_rows.index(pgn_key)
-            col = self.j1939_id_table_columns.index("Message Count")
-            idx = self.pgn_data_model.index(row, col)
-            entry = self.j1939_unique_ids[pgn_key]["Message Count"]
-            self.pgn_data_model.setData(idx, entry)
-                
-            col = self.j1939_id_table_columns.index("Period (ms)")
-            idx = self.pgn_data_model.index(row, col)
-            entry = self.j1939_unique_ids[pgn_key]["Period (ms)"]
-            self.pgn_data_model.setData(idx, entry)
-            
-            if not base64.b64encode(data_bytes).decode() == self.j1939_unique_ids[pgn_key]["Message List"]:
-                self.j1939_unique_ids[pgn_key]["Message Time"] = current_time
-                self.j1939_unique_ids[pgn_key]["Message List"] = base64.b64encode(data_bytes).decode()
-                self.j1939_unique_ids[pgn_key]["VDATime List"] = vda_time
-                self.look_up_spns(pgn, sa, data_bytes)
-
-                col = self.j1939_id_table_columns.index("Raw Hexadecimal")
-                idx = self.pgn_data_model.index(row, col)
-                entry = self.j1939_unique_ids[pgn_key]["Raw Hexadecimal"]
-                self.pgn_data_model.setData(idx, entry)
-        
-        # Update if something has changed or if the time or voltage PGN comes in.
-        if  data_bytes != previous_data_bytes or pgn in [65254, 65271]:
-            self.look_up_spns(pgn, sa, data_bytes)
-            if pgn == 65254:  #Time / Date PGN    
-                seconds = int(self.unique_spns[repr((959, sa))]["Value"])
-                minutes = int(self.unique_spns[repr((960, sa))]["Value"])
-                hours   = int(self.unique_spns[repr((961, sa))]["Value"])
-                month   = int(self.unique_spns[repr((963, sa))]["Value"])
-                day     = int(self.unique_spns[repr((962, sa))]["Value"])
-                year    = int(self.unique_spns[repr((964, sa))]["Value"])
-                time_struct = time.strptime("{:02d} {:02d} {} ".format(day, month, year) + 
-                    "{:02d} {:02d} {:02d}".format(hours, minutes, seconds), "%d %m %Y %H %M %S")
-            
-                # Save ecm time along with PC time as a tuple
-                new_ecm_time = calendar.timegm(time_struct) #Convert to UTC
-                #self.ecm_time[sa].append((time.time(), new_ecm_time)) #Put into floating point UTC
-                self.root.data_package["Time Records"][source_key]["Last ECM Time"] = new_ecm_time
-                self.root.data_package["Time Records"][source_key]["PC Time minus ECM Time"] = time.time() - new_ecm_time
-
-            elif pgn == 65259: #Component ID
-                make   = self.unique_spns[repr((586, sa))]["Value"]
-                model  = self.unique_spns[repr((587, sa))]["Value"]
-                serial = self.unique_spns[repr((588, sa))]["Value"]
-                unit   = self.unique_spns[repr((233, sa))]["Value"]
-                self.root.data_package["Component Information"][source_key].update({"Make": make,
-                                                                                    "Model":model,
-                                                                                    "Serial":serial, 
-                                                                                    "Unit":unit})
-            elif pgn == 65260: #VIN
-                VIN = self.unique_spns[repr((237, sa))]["Value"].replace(b'\x00'.decode('ascii','ignore'),'') #Take out non-printable characters
-                self.root.data_package["Component Information"][source_key].update({"VIN": VIN})
-            elif pgn == 65242: #Software ID
-                #num_fields = self.unique_spns[repr((965, sa))]["Value"]
-                software = self.unique_spns[repr((234, sa))]["Value"].replace(b'\x00'.decode('ascii','ignore'),'') #Take out non-printable characters
-                self.root.data_package["Component Information"][source_key].update({"Software": software})
-
-            elif pgn == 65271:  # Vehicle Electrical Power 
-                if "Out" not in self.unique_spns[repr((168,sa))]["Meaning"]: 
-                    # The voltage data is not out of range
-                    #Save Battery voltage from the ECU as a tuple along with PC time.
-                    self.battery_potential[sa].append((time.time(), float(self.unique_spns[repr((168,sa))]["Value"]) ))
-                    self.root.voltage_graph.add_data(self.battery_potential[sa], 
-                        marker = 'o-', 
-                        label = self.j1939_unique_ids[pgn_key]["Source"]+": SPN 168")
-                    self.root.voltage_graph.plot()
-                    
-                if "Out" not in self.unique_spns[repr((158,sa))]["Meaning"]:
-                    self.battery_potential[sa].append((time.time(), float(self.unique_spns[repr((158,sa))]["Value"]) ))
-                    self.root.voltage_graph.add_data(self.battery_potential[sa], 
-                        marker = '<-', 
-                        label = self.j1939_unique_ids[pgn_key]["Source"]+": SPN 158")
-                    self.root.voltage_graph.plot()
-            
-            elif pgn == 65253:  # Engine Hours / Revolutions
-                if "Out" not in self.unique_spns[repr((247,sa))]["Meaning"]: 
-                    # The value is not out of range
-                    val = float(self.unique_spns[repr((247,sa))]["Value"])
-                    units = self.unique_spns[repr((247,sa))]["Units"]
-                    self.root.data_package["ECU Time Information"][source_key].update({"Total Engine Hours of Operation":"{:0.2f} {}".format(val,units)})
-            
-            elif pgn == 65255:  # Vehicle Hours
-                if "Out" not in self.unique_spns[repr((246,sa))]["Meaning"]: 
-                    # The value is not out of range
-                    val = float(self.unique_spns[repr((246,sa))]["Value"])
-                    units = self.unique_spns[repr((246,sa))]["Units"]
-                    self.root.data_package["ECU Time Information"][source_key].update({"Total Vehicle Hours":"{:0.2f} {}".format(val,units)})
-            
-            elif pgn == 65248:  # Total Vehicle Distance
-                if "Out" not in self.unique_spns[repr((245,sa))]["Meaning"]: 
-                    # The value is not out of range
-                    val = float(self.unique_spns[repr((245,sa))]["Value"])
-                    units = self.unique_spns[repr((245,sa))]["Units"]
-                    self.root.data_package["Distance Information"][source_key].update({"Total Vehicle Distance":"{:0.2f} {}".format(val,units)})
-            
-            elif pgn == 65217:  # High Resolution Distance
-                if "Out" not in self.unique_spns[repr((917,sa))]["Meaning"]: 
-                    # The value is not out of range
-                    val = float(self.unique_spns[repr((917,sa))]["Value"])
-                    units = self.unique_spns[repr((917,sa))]["Units"]
-                    if "METER" in units.upper():
-                        val = val * 0.000621371192 
-                        units = "miles"
-                    self.root.data_package["Distance Information"][source_key].update({"High Resolution Total Vehicle Distance":"{:0.4f} {}".format(val,units)})
-            
-            elif pgn == 65226: # DM01
-                self.dm01_data_model.aboutToUpdate()
-                self.active_trouble_codes.update(self.get_DM(sa, data_bytes))
-                self.dm01_data_model.setDataDict(self.active_trouble_codes)
-                self.fill_dm01_table()
-
-            elif pgn == 65227: # DM02
-                self.dm02_data_model.aboutToUpdate()
-                self.previous_trouble_codes.update(self.get_DM(sa, data_bytes))
-                self.dm02_data_model.setDataDict(self.previous_trouble_codes)
-                self.fill_dm02_table()
-
-            elif pgn == 65229: # DM04
-                logger.debug("Found DM04.")
-                self.dm04_data_model.aboutToUpdate()
-                self.freeze_frame.update(self.get_freeze_frame(sa, data_bytes))
-                self.dm04_data_model.setDataDict(self.freeze_frame)
-                self.fill_dm04_table()
-
-        self.root.data_package["J1939 Parameter Group Numbers"].update(self.j1939_unique_ids)
+    def process_special_pgn(self, current_time, pgn, sa, data_bytes, spn_values):
+        """
+        Save the values from PGNs with time, component, distance, voltage and
+        diagnostic information into the data package.
+        """
+        self.add_source_address(sa)
+        source_key = "{} on J1939".format(self.get_sa_name(sa))
+        if pgn == 65254:  #Time / Date PGN    
+            seconds = int(spn_values[959]["Value"])
+            minutes = int(spn_values[960]["Value"])
+            hours   = int(spn_values[961]["Value"])
+            month   = int(spn_values[963]["Value"])
+            day     = int(spn_values[962]["Value"])
+            year    = int(spn_values[964]["Value"])
+            time_struct = time.strptime("{:02d} {:02d} {} ".format(day, month, year) + 
+                "{:02d} {:02d} {:02d}".format(hours, minutes, seconds), "%d %m %Y %H %M %S")
+
+            # Save ecm time along with PC time as a tuple
+            new_ecm_time = calendar.timegm(time_struct) #Convert to UTC
+            #self.ecm_time[sa].append((time.time(), new_ecm_time)) #Put into floating point UTC
+            self.root.data_package["Time Records"][source_key]["Last ECM Time"] = new_ecm_time
+            self.root.data_package["Time Records"][source_key]["PC Time minus ECM Time"] = current_time - new_ecm_time
+
+        elif pgn == 65259: #Component ID
+            make   = spn_values[586]["Value"]
+            model  = spn_values[587]["Value"]
+            serial = spn_values[588]["Value"]
+            unit   = spn_values[233]["Value"]
+            self.root.data_package["Component Information"][source_key].update({"Make": make,
+                                                                                "Model":model,
+                                                                                "Serial":serial, 
+                                                                                "Unit":unit})
+        elif pgn == 65260: #VIN
+            VIN = spn_values[237]["Value"].replace(b'\x00'.decode('ascii','ignore'),'') #Take out non-printable characters
+            self.root.data_package["Component Information"][source_key].update({"VIN": VIN})
+        elif pgn == 65242: #Software ID
+            #num_fields = spn_values[965]["Value"]
+            software = spn_values[234]["Value"].replace(b'\x00'.decode('ascii','ignore'),'') #Take out non-printable characters
+            self.root.data_package["Component Information"][source_key].update({"Software": software})
+
+        elif pgn == 65271:  # Vehicle Electrical Power 
+            if "Out" not in spn_values[168]["Meaning"]: 
+                # The voltage data is not out of range
+                #Save Battery voltage from the ECU as a tuple along with PC time.
+                self.battery_potential[sa].append((current_time, float(spn_values[168]["Value"]) ))
+                self.root.voltage_graph.add_data(self.battery_potential[sa], 
+                    marker = 'o-', 
+                    label = self.get_sa_name(sa)+": SPN 168")
+                self.root.voltage_graph.plot()
+
+            if "Out" not in spn_values[158]["Meaning"]:
+                self.battery_potential[sa].append((current_time, float(spn_values[158]["Value"]) ))
+                self.root.voltage_graph.add_data(self.battery_potential[sa], 
+                    marker = '<-', 
+                    label = self.get_sa_name(sa)+": SPN 158")
+                self.root.voltage_graph.plot()
+
+        elif pgn == 65253:  # Engine Hours / Revolutions
+            if "Out" not in spn_values[247]["Meaning"]: 
+                # The value is not out of range
+                val = float(spn_values[247]["Value"])
+                units = spn_values[247]["Units"]
+                self.root.data_package["ECU Time Information"][source_key].update({"Total Engine Hours of Operation":"{:0.2f} {}".format(val,units)})
+
+        elif pgn == 65255:  # Vehicle Hours
+            if "Out" not in spn_values[246]["Meaning"]: 
+                # The value is not out of range
+                val = float(spn_values[246]["Value"])
+                units = spn_values[246]["Units"]
+                self.root.data_package["ECU Time Information"][source_key].update({"Total Vehicle Hours":"{:0.2f} {}".format(val,units)})
+
+        elif pgn == 65248:  # Total Vehicle Distance
+            if "Out" not in spn_values[245]["Meaning"]: 
+                # The value is not out of range
+                val = float(spn_values[245]["Value"])
+                units = spn_values[245]["Units"]
+                self.root.data_package["Distance Information"][source_key].update({"Total Vehicle Distance":"{:0.2f} {}".format(val,units)})
+
+        elif pgn == 65217:  # High Resolution Distance
+            if "Out" not in spn_values[917]["Meaning"]: 
+                # The value is not out of range
+                val = float(spn_values[917]["Value"])
+                units = spn_values[917]["Units"]
+                if "METER" in units.upper():
+                    val = val * 0.000621371192 
+                    units = "miles"
+                self.root.data_package["Distance Information"][source_key].update({"High Resolution Total Vehicle Distance":"{:0.4f} {}".format(val,units)})
+
+        elif pgn == 65226: # DM01
+            self.dm01_data_model.aboutToUpdate()
+            self.active_trouble_codes.update(self.get_DM(sa, data_bytes))
+            self.dm01_data_model.setDataDict(self.active_trouble_codes)
+            self.fill_dm01_table()
+
+        elif pgn == 65227: # DM02
+            self.dm02_data_model.aboutToUpdate()
+            self.previous_trouble_codes.update(self.get_DM(sa, data_bytes))
+            self.dm02_data_model.setDataDict(self.previous_trouble_codes)
+            self.fill_dm02_table()
+
+        elif pgn == 65229: # DM04
+            logger.debug("Found DM04.")
+            self.dm04_data_model.aboutToUpdate()
+            self.freeze_frame.update(self.get_freeze_frame(sa, data_bytes))
+            self.dm04_data_model.setDataDict(self.freeze_frame)
+            self.fill_dm04_table()
 
     def get_freeze_frame(self, sa, data):
         idx = 0
@@ -734,163 +711,32 @@ class J1939Tab(QWidget):
         for key in self.battery_potential:
             self.battery_potential[key]=[]
 
-    def look_up_spns(self, pgn, sa, data_bytes):
-        try:
-            spn_list = self.j1939db["J1939PGNdb"]["{}".format(pgn)]["SPNs"]
-        except KeyError:
-            return False #We don't have meaning for the data
-        if pgn in self.pgns_to_not_decode:
-            return False
-
-        for spn in spn_list:
-            spn_key = repr((spn, sa))
-            if spn_key in self.unique_spns:
-                spn_dict = self.unique_spns[spn_key]
-            else:
-                spn_dict = {}
-                spn_dict["Value"] = ""
-                spn_dict["Last Value"] = ""
-                spn_dict["Units"] = self.j1939db["J1939SPNdb"]["{}".format(spn)]["Units"]
-                spn_dict["Meaning"] = ""
-                #spn_dict["Value List"] = []
-                #spn_dict["Time List"] = []
-                #spn_dict["Table Key"] = repr(spn_key)
-                spn_dict["Acronym"] = self.j1939db["J1939PGNdb"]["{}".format(pgn)]["Label"]
-                spn_dict["PGN"] = "{:6d}".format(pgn)
-                spn_dict["SA"] = "{:3d}".format(sa)
-                spn_dict["Source"] = self.get_sa_name(sa)
-                spn_dict["SPN"] = "{:5d}".format(spn)
-                spn_dict["Suspect Parameter Number Label"] = self.j1939db["J1939SPNdb"]["{}".format(spn)]["Name"]
-                self.unique_spns[spn_key] = spn_dict
-                #self.spn_needs_updating = True
-                self.spn_data_model.aboutToUpdate()
-                self.spn_data_model.setDataDict(self.unique_spns)
-                self.fill_spn_table()
-
-
-            spn_start = self.j1939db["J1939SPNdb"]["{}".format(spn)]["StartBit"]
-            spn_length = self.j1939db["J1939SPNdb"]["{}".format(spn)]["SPNLength"]
-            scale = self.j1939db["J1939SPNdb"]["{}".format(spn)]["Resolution"]
-            offset = self.j1939db["J1939SPNdb"]["{}".format(spn)]["Offset"]
-            high_value = self.j1939db["J1939SPNdb"]["{}".format(spn)]["OperationalHigh"]
-            low_value = self.j1939db["J1939SPNdb"]["{}".format(spn)]["OperationalLow"]
-            
-            if pgn == 65259: # Component ID
-                    comp_id_string = get_printable_chars(data_bytes)
-                    comp_id_list = comp_id_string.split("*")
-                    if spn == 586: # Make
-                        value = comp_id_list[0]
-                    elif spn == 587: # Model
-                        try:
-                            value = comp_id_list[1]
-                        except IndexError:
-                            value = ""
-                    elif spn == 588: #Serial Number
-                        try:
-                            value = comp_id_list[2]
-                        except IndexError:
-                            value = ""
-                    elif spn == 233: #Unit Number
-                        try:
-                            value = comp_id_list[3]
-                        except IndexError:
-                            value = ""
-            elif spn_dict["Units"] == 'ASCII':
-                value = get_printable_chars(data_bytes)
-            
-            elif scale > 0 or scale == -3:
-                while (spn_start+spn_length) > 64:
-                    spn_start -= 64
-                    data_bytes = data_bytes[8:]
-                if len(data_bytes) < 8:
-                    data_bytes = bytes(list(data_bytes) + [0xFF]*(8 - len(data_bytes)))
-
-                if spn_length <= 8:
-                        fmt = "B"
-                        rev_fmt = "B"
-                elif spn_length <= 16:
-                    fmt = ">H"
-                    rev_fmt = "<H"
-                elif spn_length <= 32:
-                    fmt = ">L"
-                    rev_fmt = "<L"
-                elif spn_length <= 64:
-                    fmt = ">Q"
-                    rev_fmt = "<Q"
-                shift = 64 - spn_start - spn_length
-                
-                #Create a mask one bit at a time
-                try:
-                    mask = 0
-                    for m in range(spn_length):
-                        mask += 1 << (63 - m - spn_start) 
-                except ValueError:
-                    logger.debug("Experienced a ValueError on the Bit Masks with SPN {}".format(spn))
-                    logger.debug("mask: {:08X}".format(mask))
-                    logger.debug("spn_start: {}".format(spn_start))
-                    logger.debug("spn_length: {}".format(spn_length))
-                    return
-                if scale <= 0:
-                    scale = 1
-                try:
-                    
-                    decimal_value = struct.unpack(">Q",data_bytes[0:8])[0] & mask
-                except:
-                    logger.debug(traceback.format_exc())
-                    return
-                #the < takes care of reverse byte orders
-                shifted_decimal = decimal_value >> shift
-                #reverse the byte order
-                reversed_decimal = struct.unpack(fmt,struct.pack(rev_fmt, shifted_decimal))[0]
-                numerical_value = reversed_decimal * scale + offset
-                
-                # Check for out of range numbers
-                if numerical_value > high_value:
-                    spn_dict["Meaning"] = "Out of Range - High"
-                elif numerical_value < low_value:
-                    spn_dict["Meaning"] = "Out of Range - Low"
-                elif spn_dict["Units"] == 'bit':
-                    spn_dict["Meaning"] = self.get_j1939_bits_decoded(spn,numerical_value)
-                else:
-                    spn_dict["Meaning"] = ""
-                
-                # Display the results
-                if scale >= 1 or spn in self.time_spns:
-                    try:
-                        value = "{:d}".format(int(numerical_value))
-                    except ValueError:
-                        value = "{}".format(numerical_value)
-                else:
-                    try:
-                        value = "{:0.3f}".format(numerical_value)
-                    except ValueError:
-                        value = "{}".format(numerical_value)
-
-            else: #Should not be converted to a decimal number
-                value = repr(data_bytes)
+    def load_data_package(self, data_package):
+        """
+        Show the PGNs and SPNs from a saved data package and continue
+        decoding from them.
+        """
+        self.pgn_data_model.aboutToUpdate()
+        self.j1939_unique_ids = J1939StateStore.from_data_package(data_package["J1939 Parameter Group Numbers"],
+                                                                  pgn_entry_from_data_package)
+        self.pgn_data_model.setDataStore(self.j1939_unique_ids)
+        self.pgn_data_model.signalUpdate()
+        
+        self.spn_data_model.aboutToUpdate()
+        self.unique_spns = J1939StateStore.from_data_package(data_package["J1939 Suspect Parameter Numbers"])
+        self.spn_data_model.setDataStore(self.unique_spns)
+        self.spn_data_model.signalUpdate()
+
+        self.processor.load_state(self.j1939_unique_ids, self.unique_spns)
+
+    def update_data_package(self):
+        """
+        Copy the live PGN and SPN state into the data package with the
+        repr((number, sa)) keys used in saved files.
+        """
+        self.root.data_package["J1939 Parameter Group Numbers"] = self.j1939_unique_ids.to_data_package(pgn_entry_to_data_package)
+        self.root.data_package["J1939 Suspect Parameter Numbers"] = self.unique_spns.to_data_package()
 
-            spn_dict["Value"] = value
-            self.unique_spns[spn_key].update(spn_dict)
-            
-            if spn_dict["Value"] != self.unique_spns[spn_key]["Last Value"]: #Check to see if the SPN value changed from last time.
-                self.spn_rows = list(self.unique_spns.keys())
-                row = self.spn_rows.index(spn_key)
-                col = self.spn_table_columns.index("Value")
-                idx = self.spn_data_model.index(row, col)
-                entry = str(spn_dict["Value"])
-                self.spn_data_model.setData(idx, entry)
-                
-                col = self.spn_table_columns.index("Meaning")
-                idx = self.spn_data_model.index(row, col)
-                entry = str(spn_dict["Meaning"])
-                self.spn_data_model.setData(idx, entry)
-                self.unique_spns[spn_key]["Last Value"] = spn_dict["Value"]
-            
-            self.root.data_package["J1939 Suspect Parameter Numbers"].update(self.unique_spns)        
-            
-            #logger.debug("Updated SPN Dictionary")
-            #logger.debug(self.unique_spns[spn_key])
-        return True
     def get_sa_name(self, sa):
         try:
             return self.j1939db["J1939SATabledb"]["{}".format(sa)]
@@ -916,7 +762,7 @@ class J1939Responder(threading.Thread):
         threading.Thread.__init__(self)
         self.root = parent
         self.rxqueue = rxqueue #Sign up for a CAN queue
-        self.response_dict = self.root.data_package["J1939 Parameter Group Numbers"]
+        self.response_dict = self.root.J1939.j1939_unique_ids
         self.rx_count = 0
         self.runSignal = True
         self.pgns_to_ignore = [65254]
@@ -960,7 +806,7 @@ class J1939Responder(threading.Thread):
                     if pgn_request in self.pgns_to_ignore:
                         continue
 
-                    pgn_key = repr((pgn_request,da_request)) #Switch SA to DA
+                    pgn_key = pack_key(pgn_request, da_request) #Switch SA to DA
                     logger.debug("Received Request: {}".format(bytes_to_hex_string(rxmessage[6:])))
                     try:
                         response = hex_string_to_bytes(self.response_dict[pgn_key]["Raw Hexadecimal"])
@@ -0,0 +1,237 @@
+"""
+Reassemble J1939 multi-packet messages from raw CAN frames (SAE J1939-21).
+
+A message longer than 8 bytes is sent with the transport protocol:
+    TP.CM (PGN 60416) - connection management. A broadcast starts with a BAM
+                        to the global address. A message to one address
+                        starts with an RTS, is paced by CTS messages from the
+                        receiver and ends with an End of Message Acknowledge
+                        or a Connection Abort.
+    TP.DT (PGN 60160) - data transfer. The first byte is the sequence number
+                        (1 to 255) and the rest are 7 bytes of the message.
+A sender can have one session open to each destination, so sessions are
+keyed by (SA, DA) and many can be open at once. The data packets are
+written straight into a buffer the size of the message, so no list of
+packets has to be joined at the end. Packets sent again after a CTS just
+write over the same place.
+
+The time of each frame drives the timeouts instead of the clock, so
+captures replayed from disk are handled the same as live traffic. A session
+is dropped when nothing comes for T1 (0.75 s) between data packets or T2
+(1.25 s) after an RTS or CTS.
+"""
+import struct
+from collections import OrderedDict
+from TURP1210.RP1210.RP1210Capture import can_id_to_j1939
+
+import logging
+logger = logging.getLogger(__name__)
+
+TP_CM_PGN = 0xEC00
+TP_DT_PGN = 0xEB00
+GLOBAL_ADDRESS = 0xFF
+
+# Control bytes of TP.CM
+TP_RTS = 16
+TP_CTS = 17
+TP_END_OF_MESSAGE_ACK = 19
+TP_BAM = 32
+TP_ABORT = 255
+
+PACKET_SIZE = 7
+MAX_MESSAGE_SIZE = 1785 # 255 packets of 7 bytes
+
+# Timeouts in seconds from J1939-21
+T1 = 0.75
+T2 = 1.25
+
+# Seconds between looking for sessions that timed out
+TIMEOUT_CHECK_INTERVAL = 0.1
+
+RP1210_HEADER = struct.Struct(">LB")
+
+def get_session_key(sa, da):
+    return (sa, da)
+
+def j1939_message(vda_time, pgn, priority, sa, da, data):
+    """
+    Build a J1939 message in the form RP1210_ReadMessage returns it, so it
+    can go to J1939Tab.fill_j1939_table.
+    """
+    header = RP1210_HEADER.pack(vda_time, 0)
+    return header + struct.pack("<L", pgn)[:3] + bytes([priority, sa, da]) + data
+
+
+class TransportSession():
+    '''
+    One multi-packet message that is being received.
+    '''
+    def __init__(self, start_time, pgn, priority, sa, da, size, packet_count, broadcast):
+        self.pgn = pgn
+        self.priority = priority
+        self.sa = sa
+        self.da = da
+        self.size = size
+        self.packet_count = packet_count
+        self.broadcast = broadcast
+        self.buffer = bytearray(packet_count * PACKET_SIZE)
+        self.received = bytearray(packet_count + 1) # One flag for each sequence number
+        self.received_count = 0
+        self.start_time = start_time
+        self.deadline = start_time + (T1 if broadcast else T2)
+
+    @property
+    def complete(self):
+        return self.received_count == self.packet_count
+
+    def add_packet(self, data):
+        """
+        Put a TP.DT packet in its place. Returns False if the sequence
+        number does not belong to the message.
+        """
+        sequence = data[0]
+        if sequence < 1 or sequence > self.packet_count:
+            return False
+        offset = (sequence - 1) * PACKET_SIZE
+        packet = memoryview(data)[1:1 + PACKET_SIZE]
+        self.buffer[offset:offset + len(packet)] = packet
+        if not self.received[sequence]:
+            self.received[sequence] = 1
+            self.received_count += 1
+        return True
+
+    def get_data(self):
+        """
+        The message without the padding of the last packet. The buffer is
+        not copied.
+        """
+        return memoryview(self.buffer)[:self.size]
+
+
+class J1939TransportProtocol():
+    '''
+    Follows the TP.CM and TP.DT frames on a CAN bus and returns the
+    messages they carry.
+    '''
+    def __init__(self, max_sessions=512):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict() # (SA, DA): TransportSession
+        self.next_check = None
+        self.stats = OrderedDict([("Frames", 0),
+                                  ("Sessions", 0),
+                                  ("Completed", 0),
+                                  ("Aborted", 0),
+                                  ("Timed Out", 0),
+                                  ("Replaced", 0),
+                                  ("Bad Packets", 0),
+                                  ("Dropped", 0)])
+
+    @property
+    def active_sessions(self):
+        return len(self.sessions)
+
+    def process_frame(self, timestamp, can_id, data):
+        """
+        Follow one extended CAN frame. Returns (pgn, priority, sa, da, data)
+        when it completes a message, otherwise None. The data is a memoryview
+        of the session buffer.
+        """
+        self.stats["Frames"] += 1
+        self.check_timeouts(timestamp)
+        pgn, priority, sa, da = can_id_to_j1939(can_id)
+        if pgn == TP_DT_PGN:
+            return self.add_data(timestamp, sa, da, data)
+        if pgn == TP_CM_PGN and len(data) == 8:
+            self.connection_management(timestamp, priority, sa, da, data)
+        return None
+
+    def connection_management(self, timestamp, priority, sa, da, data):
+        control = data[0]
+        pgn = data[5] + (data[6] << 8) + (data[7] << 16)
+        if control == TP_BAM or control == TP_RTS:
+            self.start_session(timestamp, pgn, priority, sa, da, data, control == TP_BAM)
+        elif control == TP_CTS:
+            # The receiver (SA) asks the sender (DA) for more packets
+            session = self.sessions.get(get_session_key(da, sa))
+            if session is not None and data[1] > 0:
+                session.deadline = timestamp + T2
+        elif control == TP_ABORT:
+            # Either side can abort
+            for key in [get_session_key(sa, da), get_session_key(da, sa)]:
+                session = self.sessions.get(key)
+                if session is not None and session.pgn == pgn:
+                    logger.debug("Transport of PGN {} from {} to {} aborted with reason {}".format(pgn, session.sa, session.da, data[1]))
+                    self.end_session(key, "Aborted")
+
+    def start_session(self, timestamp, pgn, priority, sa, da, data, broadcast):
+        size = data[1] + (data[2] << 8)
+        packet_count = data[3]
+        if size <= 8 or size > MAX_MESSAGE_SIZE or packet_count * PACKET_SIZE < size:
+            self.stats["Bad Packets"] += 1
+            return
+        if broadcast:
+            da = GLOBAL_ADDRESS
+        key = get_session_key(sa, da)
+        if key in self.sessions:
+            # A new announcement ends the session that was open
+            self.end_session(key, "Replaced")
+        elif len(self.sessions) >= self.max_sessions:
+            self.end_session(next(iter(self.sessions)), "Dropped")
+        self.sessions[key] = TransportSession(timestamp, pgn, priority, sa, da, size, packet_count, broadcast)
+        self.stats["Sessions"] += 1
+
+    def add_data(self, timestamp, sa, da, data):
+        key = get_session_key(sa, da)
+        session = self.sessions.get(key)
+        if session is None or len(data) < 2:
+            return None
+        if not session.add_packet(data):
+            self.stats["Bad Packets"] += 1
+            return None
+        if session.complete:
+            self.end_session(key, "Completed")
+            return session.pgn, session.priority, session.sa, session.da, session.get_data()
+        session.deadline = timestamp + T1
+        return None
+
+    def end_session(self, key, reason):
+        del self.sessions[key]
+        self.stats[reason] += 1
+
+    def check_timeouts(self, now):
+        if self.next_check is not None and now < self.next_check:
+            return
+        self.next_check = now + TIMEOUT_CHECK_INTERVAL
+        for key, session in list(self.sessions.items()):
+            if now > session.deadline:
+                logger.debug("Transport of PGN {} from {} to {} timed out with {} of {} packets".format(
+                    session.pgn, session.sa, session.da, session.received_count, session.packet_count))
+                self.end_session(key, "Timed Out")
+
+    def reset(self):
+        self.sessions.clear()
+        self.next_check = None
+
+    def j1939_messages(self, timestamp, message, single_frames=True):
+        """
+        Returns the J1939 messages in a CAN message from RP1210_ReadMessage,
+        in the form the J1939 client returns them. Frames that are not part
+        of the transport protocol are passed through if single_frames is set.
+        """
+        vda_time, echo = RP1210_HEADER.unpack_from(message, 0)
+        if not message[5]:
+            # J1939 only uses extended identifiers
+            return []
+        can_id = struct.unpack_from(">L", message, 6)[0]
+        data = message[10:]
+        pgn, priority, sa, da = can_id_to_j1939(can_id)
+        if pgn == TP_CM_PGN or pgn == TP_DT_PGN:
+            if echo:
+                return []
+            completed = self.process_frame(timestamp, can_id, data)
+            if completed is None:
+                return []
+            return [j1939_message(vda_time, *completed)]
+        if single_frames:
+            return [message[:5] + struct.pack("<L", pgn)[:3] + bytes([priority, sa, da]) + data]
+        return []
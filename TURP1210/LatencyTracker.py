@@ -0,0 +1,174 @@
+"""
+Learn how long each ECU takes to answer a request.
+
+The time from a request to its response is recorded for each (PGN, SA) on
+J1939 and each (MID, PID) on J1587. The timeout for a target follows the
+smoothed response time and its variation, like a TCP retransmission timer:
+    timeout = smoothed latency + 4 * latency variation
+and doubles for each retry. Targets that have never answered and timed out
+max_misses times in a row are skipped.
+
+What is learned is saved as JSON in the storage path so the next session
+starts with it. The statistics are kept per vehicle profile, so a target
+that never answered on one vehicle is still asked on the next.
+"""
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict
+from TURP1210.ScanScheduler import NACKED, TIMED_OUT, GLOBAL_ADDRESS
+
+import logging
+logger = logging.getLogger(__name__)
+
+LATENCY_FILE = "Scan Latency.json"
+
+# Smoothing gains for the latency and its variation
+LATENCY_GAIN = 0.125
+VARIATION_GAIN = 0.25
+
+def get_stats_key(target):
+    return " ".join(str(part) for part in target)
+
+def new_stats():
+    return OrderedDict([("Answers", 0),
+                        ("NACKs", 0),
+                        ("Misses", 0),
+                        ("Latency", None),
+                        ("Variation", None),
+                        ("Last Answer", None)])
+
+
+class LatencyTracker():
+    '''
+    Response times and timeouts for each scan target.
+    '''
+    def __init__(self, filename=None, profile="Default", min_timeout=0.05, max_timeout=5.0, max_misses=3):
+        self.filename = filename
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_misses = max_misses
+        self.profiles = {}
+        self.load()
+        self.set_profile(profile)
+
+    def set_profile(self, profile):
+        """
+        Use the statistics for a vehicle, like one named by its VIN.
+        """
+        self.profile = profile
+        self.stats = self.profiles.setdefault(profile, OrderedDict())
+        # The MIDs seen answering each J1587 PID
+        self.j1587_sources = {}
+        for key in self.stats:
+            parts = key.split()
+            if parts[0] == "J1587" and len(parts) == 3:
+                self.j1587_sources.setdefault(int(parts[2]), set()).add(int(parts[1]))
+
+    def get_stats(self, key):
+        try:
+            return self.stats[key]
+        except KeyError:
+            self.stats[key] = new_stats()
+            return self.stats[key]
+
+    def get_source_key(self, target, source):
+        """
+        The key the response time is kept under: (PGN, SA) or (MID, PID).
+        """
+        if target[0] == "J1939":
+            return get_stats_key(("J1939", target[1], source))
+        self.j1587_sources.setdefault(target[1], set()).add(source)
+        return get_stats_key(("J1587", source, target[1]))
+
+    def add_latency(self, stats, latency):
+        if stats["Latency"] is None:
+            stats["Latency"] = latency
+            stats["Variation"] = latency / 2
+        else:
+            stats["Variation"] += VARIATION_GAIN * (abs(stats["Latency"] - latency) - stats["Variation"])
+            stats["Latency"] += LATENCY_GAIN * (latency - stats["Latency"])
+
+    def record(self, target, status, latency=None, source=None):
+        """
+        Record the result of a request. This can be used as the on_result
+        callback of a ScanScheduler.
+        """
+        global_request = target[0] == "J1939" and target[2] == GLOBAL_ADDRESS
+        if status == TIMED_OUT:
+            if not global_request:
+                self.get_stats(get_stats_key(target))["Misses"] += 1
+            return
+        if not global_request:
+            stats = self.get_stats(get_stats_key(target))
+            stats["Misses"] = 0
+            if status == NACKED:
+                stats["NACKs"] += 1
+            else:
+                stats["Answers"] += 1
+                stats["Last Answer"] = time.time()
+        if latency is not None and source is not None:
+            self.add_latency(self.get_stats(self.get_source_key(target, source)), latency)
+
+    def get_latency_stats(self, target):
+        """
+        Returns the statistics with response times for a target. A J1587 PID
+        can be answered by several MIDs, so the slowest one is used.
+        """
+        if target[0] == "J1939":
+            stats = self.stats.get(get_stats_key(target))
+            if stats is not None and stats["Latency"] is not None:
+                return stats
+            return None
+        slowest = None
+        for mid in self.j1587_sources.get(target[1], []):
+            stats = self.stats.get(get_stats_key(("J1587", mid, target[1])))
+            if stats is not None and stats["Latency"] is not None:
+                if slowest is None or stats["Latency"] + 4 * stats["Variation"] > slowest["Latency"] + 4 * slowest["Variation"]:
+                    slowest = stats
+        return slowest
+
+    def get_timeout(self, target, attempt=1, default=1.0):
+        """
+        Returns the seconds to wait for a response. The default is used for
+        targets that have not answered yet.
+        """
+        stats = self.get_latency_stats(target)
+        if stats is None:
+            timeout = default
+        else:
+            timeout = max(self.min_timeout, min(self.max_timeout, stats["Latency"] + 4 * stats["Variation"]))
+        return min(self.max_timeout, timeout * 2 ** (attempt - 1))
+
+    def should_skip(self, target):
+        """
+        Skip targets that have never answered after max_misses tries.
+        """
+        stats = self.stats.get(get_stats_key(target))
+        if stats is None or self.max_misses is None:
+            return False
+        return stats["Answers"] == 0 and stats["NACKs"] == 0 and stats["Misses"] >= self.max_misses
+
+    def load(self):
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename, 'r') as latency_file:
+                self.profiles = json.load(latency_file, object_pairs_hook=OrderedDict)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logger.warning("Could not load the scan latencies from {}".format(self.filename))
+            logger.debug(traceback.format_exc())
+
+    def save(self):
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename + ".tmp", 'w') as latency_file:
+                json.dump(self.profiles, latency_file, indent=4)
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError:
+            logger.warning("Could not save the scan latencies to {}".format(self.filename))
+            logger.debug(traceback.format_exc())
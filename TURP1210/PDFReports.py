@@ -12,7 +12,7 @@ from reportlab.lib.styles import ParagraphStyle as PS
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.rl_config import defaultPageSize
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER
+from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER, TA_RIGHT
 from io import BytesIO
 from pdfrw import PdfReader, PdfDict
 from pdfrw.buildxobj import pagexobj
@@ -32,9 +32,14 @@ from pgpy.constants import (PubKeyAlgorithm,
                             EllipticCurveOID, 
                             SignatureType)
 
+
 import logging
 logger = logging.getLogger(__name__)
 
+# Tables with more rows than this are laid out a chunk at a time
+STREAM_TABLE_ROWS = 200
+TABLE_CHUNK_ROWS = 50
+
 #Simple table style that makes a table with an inner grid, with a thick line below the header.
 FLAReportTableStyle = TableStyle([('BOX', (0,0), (-1,-1), 0.25, colors.black),
                                   ('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
@@ -88,6 +93,8 @@ j1587_records_description = '''J1587 Message description'''
 
 j1587_faults_description = '''A = Active, I = Inactive'''
 
+scan_coverage_description = '''The network scan asks each module for the J1939 parameter groups (PGN) and J1587 parameters (PID) in its request lists. A request can be answered, refused with a negative acknowledgement (J1939 PGN 59392) when the module does not support the parameter group, or go without a response. Every pass of the scan only asks again for what has not been answered, and the scan stops when a pass gets no new answers. The table below lists the requests that were not answered. Requests that have never been answered in earlier scans of this vehicle are skipped.'''
+
 network_log_description = '''Network logs are files that containing all of the vehicle network traffic. For heavy vehicles there are two networks that are commonly used: 1) Controller Area Network (CAN) and 2) J1708, which is an older protocol based on RS485. The RP1210 compliant Vehicle Diagnostic Adapter is set up to receive all CAN and J1708 messages. These messages are stored in separate files. The J1708 log file is text based and the CAN file is a binary file. The hash digest values are calculated based on the SHA-256 algorithm.'''
 
 signature_description = '''The file contents are signed and verified.'''
@@ -135,6 +142,8 @@ class FLAReportTemplate(SimpleDocTemplate):
                               ('ALIGN', (0,0), (-1,-1), 'LEFT'),
                               ('VALIGN', (0,0), (-1,-1), 'MIDDLE')]
         self.event_groups={}
+        self.logo_xobj = None
+        self.logo_images = {}
 
     def afterFlowable(self, flowable):
         "Registers TOC entries."
@@ -167,7 +176,8 @@ class FLAReportTemplate(SimpleDocTemplate):
                                    _pageBreakQuick=1,
                                    encrypt=None)
         
-        table_options = self.table_options
+        # The J1587 table adds spans for its own rows, so keep them out of the shared options
+        table_options = list(self.table_options)
         
         self.data_package = json.loads(pgp_message.message)
         self.datafilename = self.data_package["File Name"]
@@ -391,45 +401,35 @@ class FLAReportTemplate(SimpleDocTemplate):
         self.story.append(Spacer(0.2,0.2*inch))       
         page_width = 7.5 * inch
         col_widths = [.08*page_width,.12*page_width, .30*page_width, .05*page_width, .20*page_width, .25*page_width]
-        j1939pgn_data=[[Paragraph("<b>PGN</b>", self.styles["Normal"]),
-                        Paragraph("<b>Acronym</b>", self.styles["Normal"]),
-                        Paragraph("<b>Parameter Group Name</b>", self.styles["Normal"]),
-                        Paragraph("<b>SA</b>", self.styles["Normal"]),
-                        Paragraph("<b>Source</b>", self.styles["Normal"]),
-                        Paragraph("<b>Message Hexadecimal</b>", self.styles["Normal"])]]
-
+        j1939pgn_header=[Paragraph("<b>PGN</b>", self.styles["Normal"]),
+                         Paragraph("<b>Acronym</b>", self.styles["Normal"]),
+                         Paragraph("<b>Parameter Group Name</b>", self.styles["Normal"]),
+                         Paragraph("<b>SA</b>", self.styles["Normal"]),
+                         Paragraph("<b>Source</b>", self.styles["Normal"]),
+                         Paragraph("<b>Message Hexadecimal</b>", self.styles["Normal"])]
+        j1939pgn_rows = []
         for key,value in self.data_package["J1939 Parameter Group Numbers"].items():
-            pgn = Paragraph(value["PGN"], self.styles["Normal"])
-            acronym = Paragraph(value["Acronym"], self.styles["Normal"])
-            name = Paragraph(value["Parameter Group Label"], self.styles["Normal"])
-            sa = Paragraph(value["SA"], self.styles["Normal"])
-            Source = Paragraph(value["Source"], self.styles["Normal"])
-            raw = Paragraph(value["Raw Hexadecimal"], self.styles["Normal"])
-            j1939pgn_data.append([pgn,acronym,name,sa,Source,raw])
-        
+            j1939pgn_rows.append([value["PGN"],
+                                  value["Acronym"],
+                                  value["Parameter Group Label"],
+                                  value["SA"],
+                                  value["Source"],
+                                  value["Raw Hexadecimal"]])
 
-
-        table_style = TableStyle(self.table_options)
-        
-
-        j1939pgn_table = Table(j1939pgn_data, repeatRows=1, colWidths=col_widths)
-        j1939pgn_table.setStyle(table_style)
-        self.story.append(j1939pgn_table)
+        table_style = TableStyle(table_options)
+        self.story.append(self.make_table(j1939pgn_header, j1939pgn_rows, col_widths, table_style))
 
         self.story.append(Paragraph("Parameter Group Numbers Not Included", self.styles["Heading3"]))
         self.story.append(Spacer(0.1,0.1*inch))
         page_width = 6.5 * inch
         col_widths = [.1*page_width,.90*page_width]
-        j1939pgn_exclude=[[Paragraph("<b>PGN</b>", self.styles["Normal"]),
-                           Paragraph("<b>Parameter Group Name</b>", self.styles["Normal"])]]
+        j1939pgn_exclude_header=[Paragraph("<b>PGN</b>", self.styles["Normal"]),
+                                 Paragraph("<b>Parameter Group Name</b>", self.styles["Normal"])]
         try:
+            j1939pgn_exclude = []
             for pgn in sorted(self.root.J1939.pgns_to_not_decode):
-                pgn_entry = Paragraph(str(pgn), self.styles["Normal"])
-                name_entry = Paragraph(self.root.J1939.get_pgn_label(pgn), self.styles["Normal"])
-                j1939pgn_exclude.append([pgn_entry, name_entry])
-            j1939exclude_table = Table(j1939pgn_exclude, repeatRows=1, colWidths=col_widths)
-            j1939exclude_table.setStyle(table_style)
-            self.story.append(j1939exclude_table)
+                j1939pgn_exclude.append([str(pgn), self.root.J1939.get_pgn_label(pgn)])
+            self.story.append(self.make_table(j1939pgn_exclude_header, j1939pgn_exclude, col_widths, table_style))
         except AttributeError:
             logger.debug(traceback.format_exc())
         # SPNs
@@ -440,28 +440,26 @@ class FLAReportTemplate(SimpleDocTemplate):
         self.story.append(Spacer(0.2,0.2*inch))       
         page_width = 7.5 * inch
         col_widths = [.065*page_width,.26*page_width, .075*page_width, .20*page_width, .15*page_width, .1*page_width, .15*page_width]
-        j1939spn_data=[[Paragraph("<b>SPN</b>", self.styles["Normal"]),
-                        Paragraph("<b>SPN Name</b>", self.styles["Normal"]),
-                        Paragraph("<b>PGN</b>", self.styles["Normal"]),
-                        Paragraph("<b>Source</b>", self.styles["Normal"]),
-                        Paragraph("<b>Value</b>", self.styles["Normal"]),
-                        Paragraph("<b>Units</b>", self.styles["Normal"]),\
-                        Paragraph("<b>Meaning</b>", self.styles["Normal"])]]
+        j1939spn_header=[Paragraph("<b>SPN</b>", self.styles["Normal"]),
+                         Paragraph("<b>SPN Name</b>", self.styles["Normal"]),
+                         Paragraph("<b>PGN</b>", self.styles["Normal"]),
+                         Paragraph("<b>Source</b>", self.styles["Normal"]),
+                         Paragraph("<b>Value</b>", self.styles["Normal"]),
+                         Paragraph("<b>Units</b>", self.styles["Normal"]),
+                         Paragraph("<b>Meaning</b>", self.styles["Normal"])]
+        j1939spn_rows = []
         dict1=self.data_package["J1939 Suspect Parameter Numbers"]
         for value in sorted(dict1.values(), key=lambda x: x["Suspect Parameter Number Label"]):
             meaning = value["Meaning"]
             if 'Out' not in meaning:
-                pgn = Paragraph(value["PGN"], self.styles["Normal"])
-                name = Paragraph(value["Suspect Parameter Number Label"], self.styles["Normal"])
-                spn = Paragraph(value["SPN"], self.styles["Normal"])
-                Source = Paragraph(value["Source"], self.styles["Normal"])
-                units = Paragraph(value["Units"], self.styles["Normal"])
-                val = Paragraph(value["Value"], self.styles["Normal"])
-                mean_par = Paragraph(value["Meaning"], self.styles["Normal"])
-                j1939spn_data.append([spn,name,pgn,Source,val,units, mean_par])
-        j1939spn_table = Table(j1939spn_data, repeatRows=1, colWidths=col_widths)
-        j1939spn_table.setStyle(table_style)
-        self.story.append(j1939spn_table)
+                j1939spn_rows.append([value["SPN"],
+                                      value["Suspect Parameter Number Label"],
+                                      value["PGN"],
+                                      value["Source"],
+                                      value["Value"],
+                                      value["Units"],
+                                      value["Meaning"]])
+        self.story.append(self.make_table(j1939spn_header, j1939spn_rows, col_widths, table_style))
 
         self.story.append(PageBreak())
         self.story.append(Paragraph("J1587 Network Message Values", self.styles["Heading1"]))
@@ -497,7 +495,6 @@ class FLAReportTemplate(SimpleDocTemplate):
                     meaning_table.append([Paragraph(m, self.styles["Normal"])])
                 mean_par = Table(meaning_table, colWidths=[col_widths[-1] - 0.1*inch])
             if len(value['Units']) == 0 and len(value["Meaning"]) == 0:
-               table_options = self.table_options
                table_options.append(('SPAN', (3,row_count), (5,row_count))) 
             j1587_data.append([mid,pid,name,val,units, mean_par])
             row_count+=1
@@ -522,6 +519,8 @@ class FLAReportTemplate(SimpleDocTemplate):
             self.story.append(Table(diag_table, colWidths=None))
 
         
+        self.add_scan_coverage_section(table_style)
+
         self.story.append(PageBreak())
         self.story.append(Paragraph("Forensic Context Information", self.styles["Heading2"]))
         
@@ -602,6 +601,57 @@ class FLAReportTemplate(SimpleDocTemplate):
         except IndexError:
             return old_line
             
+    def make_paragraph_row(self, row):
+        return [Paragraph(value, self.styles["Normal"]) for value in row]
+
+    def make_table(self, header, rows, col_widths, table_style):
+        '''
+        Returns a Table for the header and rows of text. Long tables are
+        streamed so their Paragraphs are only made as the pages are laid out.
+        '''
+        if len(rows) > STREAM_TABLE_ROWS:
+            return StreamingTable(header, rows, self.make_paragraph_row, col_widths, table_style)
+        table = Table([header] + [self.make_paragraph_row(row) for row in rows], repeatRows=1, colWidths=col_widths)
+        table.setStyle(table_style)
+        return table
+
+    def add_scan_coverage_section(self, table_style):
+        '''
+        List the requests of the network scan that were not answered.
+        '''
+        coverage = self.data_package.get("Scan Coverage")
+        if not coverage:
+            return
+        self.story.append(PageBreak())
+        self.story.append(Paragraph("Network Scan Coverage", self.styles["Heading1"]))
+        self.story.append(Paragraph(scan_coverage_description, self.styles["Normal"]))
+        self.story.append(Spacer(0.2,0.2*inch))
+        summary = [("Passes", coverage["Passes"]),
+                   ("Stopped When Complete", "Yes" if coverage["Converged"] else "No"),
+                   ("Requests", coverage["Requested"])]
+        summary += list(coverage["Results"].items())
+        for key, value in summary:
+            self.story.append(Paragraph("<para leftIndent=20><b>{}:</b> {}</para>".format(key, value), self.styles["Normal"]))
+        self.story.append(Spacer(0.2,0.2*inch))
+        page_width = 7.5 * inch
+        col_widths = [.09*page_width, .09*page_width, .37*page_width, .06*page_width, .19*page_width, .20*page_width]
+        coverage_header = [Paragraph("<b>Network</b>", self.styles["Normal"]),
+                           Paragraph("<b>PGN or PID</b>", self.styles["Normal"]),
+                           Paragraph("<b>Name</b>", self.styles["Normal"]),
+                           Paragraph("<b>SA</b>", self.styles["Normal"]),
+                           Paragraph("<b>Source</b>", self.styles["Normal"]),
+                           Paragraph("<b>Result</b>", self.styles["Normal"])]
+        coverage_rows = []
+        for value in coverage["Missing"]:
+            if value["Network"] == "J1939":
+                coverage_rows.append(["J1939", str(value["PGN"]), value["Name"], str(value["SA"]), value["Source"], value["Result"]])
+            else:
+                coverage_rows.append(["J1587", str(value["PID"]), value["Name"], "", "", value["Result"]])
+        if coverage_rows:
+            self.story.append(self.make_table(coverage_header, coverage_rows, col_widths, table_style))
+        else:
+            self.story.append(Paragraph("Every request was answered.", self.styles["Normal"]))
+
     def add_information_section(self, main_key, section_title, description):
         '''
         When the data_package dictionary has a section of dictionaries from different sources, we can
@@ -631,11 +681,20 @@ class FLAReportTemplate(SimpleDocTemplate):
                     except TypeError:
                         pass #none type doesn't need printed.
 
+    def get_logo(self, scale):
+        '''
+        The logo is read from its file once and drawn from memory on every page.
+        '''
+        if scale not in self.logo_images:
+            if self.logo_xobj is None:
+                self.logo_xobj = read_pdf_xobj(self.logo_file)
+            self.logo_images[scale] = PdfImage(self.logo_xobj,
+                                               width=scale*inch,
+                                               height=scale * 394/905 * inch)
+        return self.logo_images[scale]
+
     def _on_first_page(self, canvas, doc):
-        scale = 2
-        img = PdfImage(self.logo_file,
-                        width=scale*inch,
-                        height=scale * 394/905 * inch)
+        img = self.get_logo(2)
         img.drawOn(canvas,
                    3 * inch, 
                    10 * inch)
@@ -643,10 +702,7 @@ class FLAReportTemplate(SimpleDocTemplate):
         self._on_page(canvas, doc)            
 
     def _on_other_page(self, canvas, doc):
-        scale = 1.5
-        img = PdfImage(self.logo_file,
-                        width=scale*inch,
-                        height=scale * 394/905 * inch)
+        img = self.get_logo(1.5)
         img.drawOn(canvas,
                    6.5 * inch, 
                    10.0 * inch)
@@ -737,6 +793,7 @@ class FLAReportTemplate(SimpleDocTemplate):
     def add_event_chart(self, title, img):      
         logger.debug("Adding Charts Data for {} to PDF.".format(title))
         self.event_groups[title] = PdfImage(img,width=7.5*inch, height=8.5*inch,)
+
         
         
         
@@ -759,14 +816,15 @@ class PdfImage(Flowable):
 
         return(PdfImage(img))
 
+    A form made by read_pdf_xobj can be given instead of a file so the same
+    PDF is only parsed once.
     """
 
     def __init__(self, filename_or_object, width=None, height=None, kind='direct'):
-        # If using StringIO buffer, set pointer to begining
-        if hasattr(filename_or_object, 'read'):
-            filename_or_object.seek(0)
-        self.page = PdfReader(filename_or_object, decompress=False).pages[0]
-        self.xobj = pagexobj(self.page)
+        if isinstance(filename_or_object, PdfDict):
+            self.xobj = filename_or_object
+        else:
+            self.xobj = read_pdf_xobj(filename_or_object)
 
         self.imageWidth = width
         self.imageHeight = height
@@ -822,6 +880,75 @@ class PdfImage(Flowable):
         canv.doForm(xobj_name)
         canv.restoreState()
 
+def read_pdf_xobj(filename_or_object):
+    """
+    Returns the first page of a PDF file or buffer as a form that can be drawn
+    on a canvas.
+    """
+    # If using StringIO buffer, set pointer to begining
+    if hasattr(filename_or_object, 'read'):
+        filename_or_object.seek(0)
+    return pagexobj(PdfReader(filename_or_object, decompress=False).pages[0])
+
+class StreamingTable(Flowable):
+    """
+    A long table that is laid out a page at a time. The rows are kept as
+    plain values and only turned into cells with make_row, a chunk at a
+    time, when the page they go on is laid out. Each page gets a Table with
+    just its own rows and the header, so a split never copies the whole
+    table. The cells that are made are shared by the rest of the table and
+    kept for the next pass of multiBuild.
+    """
+    def __init__(self, header, rows, make_row, col_widths=None, table_style=None, chunk_rows=TABLE_CHUNK_ROWS, start=0, cells=None):
+        Flowable.__init__(self)
+        self.header = header
+        self.rows = rows
+        self.make_row = make_row
+        self.col_widths = col_widths
+        self.table_style = table_style
+        self.chunk_rows = chunk_rows
+        self.start = start
+        self.cells = [] if cells is None else cells
+        self.table = None
+
+    def get_cells(self, stop):
+        stop = min(stop, len(self.rows))
+        while len(self.cells) < stop:
+            self.cells.append(self.make_row(self.rows[len(self.cells)]))
+        return self.cells[self.start:stop]
+
+    def make_table(self, stop):
+        table = Table([self.header] + self.get_cells(stop), repeatRows=1, colWidths=self.col_widths)
+        if self.table_style is not None:
+            table.setStyle(self.table_style)
+        return table
+
+    def wrap(self, availableWidth, availableHeight):
+        stop = self.start + self.chunk_rows
+        if stop < len(self.rows):
+            # Claim more than the frame has so it splits off the rows for this page
+            return availableWidth, availableHeight + 1
+        self.table = self.make_table(stop)
+        return self.table.wrap(availableWidth, availableHeight)
+
+    def split(self, availableWidth, availableHeight):
+        # Take chunks of rows until they fill the space or run out
+        stop = self.start + self.chunk_rows
+        while True:
+            table = self.make_table(stop)
+            parts = table.split(availableWidth, availableHeight)
+            if len(parts) != 1 or stop >= len(self.rows):
+                break
+            stop += self.chunk_rows
+        if len(parts) < 2:
+            return parts
+        placed = len(parts[0]._cellvalues) - 1
+        return [parts[0], StreamingTable(self.header, self.rows, self.make_row, self.col_widths, self.table_style,
+                                         self.chunk_rows, self.start + placed, self.cells)]
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        self.table.drawOn(canvas, x, y, _sW)
+
 def get_user_data(user_data):
     """
         Returns a Reportlab Flowable based on user data 
@@ -4,133 +4,28 @@ from PyQt5.QtCore import Qt, QCoreApplication
 from ctypes import *
 from ctypes.wintypes import HWND
 import json
-import os
-import threading
-import time
-import struct
 import traceback
 from TURP1210.RP1210.RP1210Functions import *
-from TURP1210.UserData import get_storage_path
+from TURP1210.RP1210.RP1210RingBuffer import *
+from TURP1210.RP1210.RP1210ReadMessage import *
+from TURP1210.RP1210.RP1210Simulator import *
 import logging
 logger = logging.getLogger(__name__)
 
-class RP1210ReadMessageThread(threading.Thread):
-    '''This thread is designed to receive messages from the vehicle diagnostic
-    adapter (VDA) and put the data into a queue. The class arguments are as
-    follows:
-    rx_queue - A data structure that takes the received message.
-    RP1210_ReadMessage - a function handle to the VDA DLL.
-    nClientID - this lets us know which network is being used to receive the
-                messages. This will likely be a 1 or 2'''
-
-    def __init__(self, parent, rx_queue, extra_queue, RP1210_ReadMessage, nClientID, protocol, title, filename="NetworkTraffic"):
-        threading.Thread.__init__(self)
-        self.root = parent
-        self.rx_queue = rx_queue
-        self.extra_queue = extra_queue
-        self.RP1210_ReadMessage = RP1210_ReadMessage
-        self.nClientID = nClientID
-        self.runSignal = True
-        self.message_count = 0
-        self.start_time = time.time()
-        self.duration = 0
-        self.filename = os.path.join(get_storage_path(title), protocol + filename + ".bin")
-        self.protocol = protocol
-        self.pgns_to_block=[61444, 61443, 65134, 65215]
-        self.sources_to_block=[0, 11]
-        self.can_ids_to_block = []
-
-    def run(self):
-        ucTxRxBuffer = (c_char * 2000)()
-        # display a valid connection upon start.
-        logger.debug("Read Message Client ID: {}".format(self.nClientID))
-        message_bytes = b'1234'
-        with open(self.filename,'wb') as log_file:
-            pass
-        while self.runSignal: #Look into threading.events
-                self.duration = time.time() - self.start_time
-                return_value = self.RP1210_ReadMessage(c_short(self.nClientID),
-                                                       byref(ucTxRxBuffer),
-                                                       c_short(2000),
-                                                       c_short(BLOCKING_IO))
-                if return_value > 0:
-                    current_time = time.time()
-                    if ucTxRxBuffer[4] == b'\x00': #Echo is on, so we only want to see what others are sending.
-                        self.message_count +=1
-                                   
-                    if self.protocol == "CAN":
-                        vda_timestamp = struct.unpack(">L",ucTxRxBuffer[0:4])[0]
-                        extended = ucTxRxBuffer[5]
-                        if extended:
-                            can_id = struct.unpack(">L",ucTxRxBuffer[6:10])[0] #Swap endianness
-                            can_data = ucTxRxBuffer[10:return_value]
-                            dlc = int(return_value - 10)
-                        
-                        else:
-                            can_id = struct.unpack(">H",ucTxRxBuffer[6:8])[0] #Swap endianness
-                            can_data = ucTxRxBuffer[8:return_value]
-                            dlc = int(return_value - 8)
-                        
-                        # #the following conversion is to emulate the data structure from the NMFTA CAN Logger Project
-                        # # See https://github.com/Heavy-Vehicle-Networking-At-U-Tulsa/NMFTA-CAN-Logger/tree/master/_07_Low_Latency_Logger_with_Requests
-                        # try:
-                        #     microsecond_bytes = struct.pack("<L", int((dlc << 24) + (current_time % 1) * 1000000))
-                        # except struct.error:
-                        #     continue
-                        # # RP1210_ReadMessage API:
-                        # #Reverse endianess
-                        # #vda_timestamp = struct.pack("<L",struct.unpack(">L",ucTxRxBuffer[0:4])[0])  
-                        
-                        
-                        # #echo_byte = ucTxRxBuffer[4]
-                        
-                        # # Build the 24 bytes that make up a CAN message.
-                        # message_bytes = time_bytes
-                        # message_bytes += vda_timestamp
-                        # message_bytes += microsecond_bytes
-                        # message_bytes += can_id
-                        # message_bytes += can_data
-                        self.rx_queue.put( (current_time, vda_timestamp, can_id, dlc, can_data) )
-                        
-
-                    elif self.protocol == "J1708": 
-                        self.rx_queue.put((current_time, ucTxRxBuffer[:return_value]))
-                        #self.extra_queue.put((current_time, ucTxRxBuffer[5:return_value]))
-                        
-                    elif self.protocol == "J1939":
-                        pgn = struct.unpack("<L", ucTxRxBuffer[5:8] + b'\x00')[0]
-                        sa = struct.unpack("B",ucTxRxBuffer[9])[0]
-                        
-                        if (pgn not in self.pgns_to_block) or (sa not in self.sources_to_block):
-                                self.rx_queue.put((current_time, ucTxRxBuffer[:return_value]))
-                        #ISO 15765 traffic only
-                        if pgn == 0xDA00:
-                            dst_addr = struct.unpack("B",ucTxRxBuffer[10])[0]
-                            message_data = ucTxRxBuffer[11:return_value]
-                            self.extra_queue.put((pgn, 6, sa, dst_addr, message_data))
-
-                    
-        logger.debug("RP1210 Receive Thread is finished.")
-
-    def make_log_data(self,message_bytes,return_value,time_bytes,ucTxRxBuffer):
-        length_bytes = struct.pack("<H",return_value + 4)
-        message_bytes += length_bytes
-        message_bytes += time_bytes
-        message_bytes += ucTxRxBuffer[:return_value]
-        return message_bytes
-
 class RP1210Class():
     """A class to access RP1210 libraries for different devices."""
-    def __init__(self, dll_name):
+    def __init__(self, dll_name, backend=None):
         """
         Load the Windows Device Library
         The input argument is the dll_name from one of the manufacturers DLLs in the c:\Windows directory  
+        A backend object with the same functions, like an RP1210Simulator, 
+        can be used instead of a DLL.
         """
         self.nClientID = None
         self.ucTxRxBuffer = (c_char*2000)()
-        self.create_RP1210_functions(dll_name)
+        self.create_RP1210_functions(dll_name, backend)
 
-    def create_RP1210_functions(self,dll_name):
+    def create_RP1210_functions(self, dll_name, backend=None):
         """
         Create function prototypes to access the DLL of the RP1210 Drivers.
         """
@@ -149,7 +44,23 @@ class RP1210Class():
         
         self.dll_name = dll_name
 
-        if dll_name is not None:
+        if backend is None and dll_name == SIMULATOR_NAME:
+            backend = RP1210Simulator()
+
+        if backend is not None:
+            logger.debug("Using the {} backend instead of a DLL.".format(backend.__class__.__name__))
+            self.ClientConnect = backend.ClientConnect
+            self.ClientDisconnect = backend.ClientDisconnect
+            self.SendMessage = backend.SendMessage
+            self.ReadMessage = backend.ReadMessage
+            self.SendCommand = backend.SendCommand
+            self.ReadVersion = backend.ReadVersion
+            self.ReadDetailedVersion = backend.ReadDetailedVersion
+            self.GetHardwareStatus = backend.GetHardwareStatus
+            self.GetErrorMsg = backend.GetErrorMsg
+            self.GetHardwareStatusEx = backend.GetHardwareStatusEx
+            self.GetLastErrorMsg = backend.GetLastErrorMsg
+        elif dll_name is not None:
             logger.debug("Loading the {} file.".format(dll_name + ".dll"))
             try:
                 RP1210DLL = windll.LoadLibrary(dll_name + ".dll")
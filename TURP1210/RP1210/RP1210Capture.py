@@ -0,0 +1,265 @@
+"""
+A compact binary file for recording network traffic.
+
+The file starts with a 32 byte header:
+    magic (b"TUCP"), version, record size, payload size, protocol name,
+    start time
+and is followed by fixed size records:
+    host time (double), VDA time, id, flags, length, payload
+The id is the CAN identifier for CAN and J1939 (the 29 bit identifier built
+from the priority, PGN, destination and source) and the MID for J1708. The
+payload is the data after the identifier. Messages longer than the payload
+slot continue in the records that follow; the first record holds the whole
+length and the rest are marked with FLAG_CONTINUATION.
+
+All numbers are little endian, so the records can be viewed directly as a
+NumPy structured array with CaptureReader.as_array.
+"""
+import mmap
+import os
+import struct
+import threading
+from TURP1210.RP1210.RP1210RingBuffer import RECORD_HEADER, FLAG_ECHO, FLAG_EXTENDED
+import logging
+logger = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b"TUCP"
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct("<4sHHH8sd6x")
+
+FLAG_CONTINUATION = 0x08
+
+# Payload bytes per record. Most messages fit in one record.
+PAYLOAD_SIZES = {"CAN": 8,
+                 "J1939": 8,
+                 "J1708": 21}
+
+DEFAULT_BUFFER_SIZE = 65536
+CAPTURE_EXTENSION = ".bin"
+
+J1939_RX_HEADER = struct.Struct("<LBB") # PGN and priority, source, destination
+
+def get_capture_filename(storage_path, protocol, filename="NetworkTraffic"):
+    return os.path.join(storage_path, protocol + filename + CAPTURE_EXTENSION)
+
+def j1939_to_can_id(pgn, priority, sa, da):
+    """
+    Build a 29 bit CAN identifier from J1939 fields.
+    """
+    if (pgn >> 8) & 0xFF < 240: # PDU1 messages carry the destination
+        pgn = (pgn & 0x3FF00) | da
+    return ((priority & 0x07) << 26) | (pgn << 8) | sa
+
+def can_id_to_j1939(can_id):
+    """
+    Returns (pgn, priority, sa, da) for a 29 bit CAN identifier.
+    """
+    priority = (can_id >> 26) & 0x07
+    pgn = (can_id >> 8) & 0x3FFFF
+    sa = can_id & 0xFF
+    if (pgn >> 8) & 0xFF < 240:
+        da = pgn & 0xFF
+        pgn &= 0x3FF00
+    else:
+        da = 0xFF
+    return pgn, priority, sa, da
+
+def rp1210_to_capture(protocol, message, flags=0):
+    """
+    Split a message from RP1210_ReadMessage into (vda_time, id, flags, data)
+    for a capture file.
+    """
+    vda_time, echo = struct.unpack_from(">LB", message, 0)
+    if echo:
+        flags |= FLAG_ECHO
+    if protocol == "CAN":
+        if message[5]:
+            flags |= FLAG_EXTENDED
+            return vda_time, struct.unpack_from(">L", message, 6)[0], flags, message[10:]
+        return vda_time, struct.unpack_from(">H", message, 6)[0], flags, message[8:]
+    elif protocol == "J1939":
+        pgn, sa, da = J1939_RX_HEADER.unpack_from(message, 5)
+        can_id = j1939_to_can_id(pgn & 0xFFFFFF, (pgn >> 24) & 0x07, sa, da)
+        return vda_time, can_id, flags | FLAG_EXTENDED, message[11:]
+    else:
+        mid = message[5] if len(message) > 5 else 0
+        return vda_time, mid, flags, message[5:]
+
+def capture_to_rp1210(protocol, vda_time, message_id, flags, data):
+    """
+    Rebuild the RP1210_ReadMessage form of a captured message.
+    """
+    prefix = struct.pack(">LB", vda_time, 1 if flags & FLAG_ECHO else 0)
+    if protocol == "CAN":
+        if flags & FLAG_EXTENDED:
+            return prefix + b'\x01' + struct.pack(">L", message_id) + data
+        return prefix + b'\x00' + struct.pack(">H", message_id) + data
+    elif protocol == "J1939":
+        pgn, priority, sa, da = can_id_to_j1939(message_id)
+        return prefix + struct.pack("<L", pgn)[:3] + bytes([priority, sa, da]) + data
+    return prefix + data
+
+
+class CaptureWriter():
+    '''
+    Writes records to a capture file through an in memory buffer. The write
+    and flush methods can be called from different threads.
+    '''
+    def __init__(self, filename, protocol, payload_size=None, buffer_size=DEFAULT_BUFFER_SIZE, start_time=0.0):
+        self.filename = filename
+        self.protocol = protocol
+        if payload_size is None:
+            payload_size = PAYLOAD_SIZES.get(protocol, 8)
+        self.payload_size = payload_size
+        self.record_size = RECORD_HEADER.size + payload_size
+        self.buffer = bytearray(max(buffer_size // self.record_size, 1) * self.record_size)
+        self.position = 0
+        self.record_count = 0
+        self.message_count = 0
+        self.lock = threading.Lock()
+        self.capture_file = open(filename, 'wb')
+        self.capture_file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, self.record_size,
+                                                    payload_size, protocol.encode('ascii')[:8], start_time))
+
+    def write(self, timestamp, vda_time, message_id, flags, data):
+        """
+        Add one message. Long messages take more than one record.
+        """
+        length = len(data)
+        with self.lock:
+            self.message_count += 1
+            start = 0
+            while True:
+                if self.position == len(self.buffer):
+                    self.write_buffer()
+                chunk = data[start:start + self.payload_size]
+                RECORD_HEADER.pack_into(self.buffer, self.position, timestamp, vda_time, message_id, flags, length)
+                payload_start = self.position + RECORD_HEADER.size
+                self.buffer[payload_start:payload_start + len(chunk)] = chunk
+                if len(chunk) < self.payload_size:
+                    self.buffer[payload_start + len(chunk):payload_start + self.payload_size] = bytes(self.payload_size - len(chunk))
+                self.position += self.record_size
+                self.record_count += 1
+                start += self.payload_size
+                if start >= length:
+                    break
+                flags |= FLAG_CONTINUATION
+
+    def write_rp1210(self, timestamp, message):
+        """
+        Add a message in the form RP1210_ReadMessage returns it.
+        """
+        self.write(timestamp, *rp1210_to_capture(self.protocol, message))
+
+    def write_buffer(self):
+        self.capture_file.write(memoryview(self.buffer)[:self.position])
+        self.position = 0
+
+    def flush(self):
+        """
+        Get everything written so far into the file.
+        """
+        with self.lock:
+            if self.capture_file.closed:
+                return
+            self.write_buffer()
+            self.capture_file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.capture_file.closed:
+                return
+            self.write_buffer()
+            self.capture_file.close()
+        logger.debug("Wrote {} messages to {}".format(self.message_count, self.filename))
+
+
+class CaptureReader():
+    '''
+    Reads a capture file through a memory map.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as capture_file:
+            self.size = os.fstat(capture_file.fileno()).st_size
+            if self.size < CAPTURE_HEADER.size:
+                raise ValueError("{} is too short to be a capture file.".format(filename))
+            self.buffer = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.record_size, self.payload_size,
+            protocol, self.start_time) = CAPTURE_HEADER.unpack_from(self.buffer, 0)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+            self.buffer.close()
+            raise ValueError("{} is not a version {} capture file.".format(filename, CAPTURE_VERSION))
+        self.protocol = protocol.rstrip(b'\x00').decode('ascii')
+        self.record_count = (self.size - CAPTURE_HEADER.size) // self.record_size
+
+    def __len__(self):
+        return self.record_count
+
+    def record_offset(self, index):
+        return CAPTURE_HEADER.size + index * self.record_size
+
+    def read_record(self, index):
+        """
+        Returns (timestamp, vda_time, id, flags, length) for one record.
+        """
+        return RECORD_HEADER.unpack_from(self.buffer, self.record_offset(index))
+
+    def read_message(self, index):
+        """
+        Returns ((timestamp, vda_time, id, flags, data), next_index) for the
+        message starting at a record.
+        """
+        timestamp, vda_time, message_id, flags, length = RECORD_HEADER.unpack_from(self.buffer, self.record_offset(index))
+        payload_start = self.record_offset(index) + RECORD_HEADER.size
+        if length <= self.payload_size:
+            return (timestamp, vda_time, message_id, flags, self.buffer[payload_start:payload_start + length]), index + 1
+        data = bytearray()
+        next_index = index
+        while len(data) < length and next_index < self.record_count:
+            payload_start = self.record_offset(next_index) + RECORD_HEADER.size
+            data += self.buffer[payload_start:payload_start + min(self.payload_size, length - len(data))]
+            next_index += 1
+        return (timestamp, vda_time, message_id, flags, bytes(data)), next_index
+
+    def messages(self, start=0, stop=None):
+        """
+        Yields (timestamp, vda_time, id, flags, data) for the messages that
+        start in records start to stop.
+        """
+        if stop is None or stop > self.record_count:
+            stop = self.record_count
+        index = start
+        # Skip the end of a message that started before the first record
+        while index < stop and self.read_record(index)[3] & FLAG_CONTINUATION:
+            index += 1
+        while index < stop:
+            message, index = self.read_message(index)
+            yield message
+
+    def __iter__(self):
+        return self.messages()
+
+    def rp1210_messages(self, start=0, stop=None):
+        """
+        Yields (timestamp, message) with messages rebuilt in the form
+        RP1210_ReadMessage returns them.
+        """
+        for timestamp, vda_time, message_id, flags, data in self.messages(start, stop):
+            yield timestamp, capture_to_rp1210(self.protocol, vda_time, message_id, flags, data)
+
+    def as_array(self):
+        """
+        View the records as a NumPy structured array without copying them.
+        """
+        import numpy as np
+        dtype = np.dtype([("timestamp", "<f8"),
+                          ("vda_time", "<u4"),
+                          ("id", "<u4"),
+                          ("flags", "<u2"),
+                          ("length", "<u2"),
+                          ("payload", "u1", (self.payload_size,))])
+        return np.frombuffer(self.buffer, dtype=dtype, count=self.record_count, offset=CAPTURE_HEADER.size)
+
+    def close(self):
+        self.buffer.close()
@@ -0,0 +1,218 @@
+"""
+A sparse index for capture files.
+
+The records of a capture are grouped into blocks of BLOCK_SIZE records. The
+index keeps the first and last time in each block and, for every message key,
+the runs of blocks the key appears in. The keys match the ones used in the
+data package:
+    J1939: (PGN, SA)
+    J1708: (MID, PID)
+    CAN:   the CAN identifier
+A query only reads the blocks that can hold matching messages.
+
+The index is saved as JSON next to the capture and is rebuilt when the capture
+has changed since it was made.
+"""
+import json
+import traceback
+import numpy as np
+from TURP1210.RP1210.RP1210Capture import CaptureReader, FLAG_CONTINUATION, can_id_to_j1939
+import logging
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_EXTENSION = ".idx"
+BLOCK_SIZE = 1024
+
+def get_index_filename(capture_filename):
+    return capture_filename + INDEX_EXTENSION
+
+def j1939_key(can_id):
+    pgn, priority, sa, da = can_id_to_j1939(can_id)
+    return (pgn, sa)
+
+def j1587_pids(message):
+    """
+    Returns the PIDs in a J1708 message that starts with the MID. PIDs on
+    page 2 are returned with 256 added.
+    """
+    pids = []
+    index = 1
+    while index < len(message):
+        pid = message[index]
+        if pid == 255:
+            index += 1
+            if index >= len(message):
+                break
+            pid = message[index] + 256
+        index += 1
+        pids.append(pid)
+        if pid % 256 < 128:
+            index += 1
+        elif pid % 256 < 192:
+            index += 2
+        elif index < len(message):
+            index += message[index] + 1
+        else:
+            break
+    return pids
+
+def message_keys(protocol, message_id, data):
+    """
+    Returns the index keys for one captured message.
+    """
+    if protocol == "J1939":
+        return [j1939_key(message_id)]
+    elif protocol == "J1708":
+        return [(message_id, pid) for pid in j1587_pids(data)]
+    return [message_id]
+
+def block_runs(blocks):
+    """
+    Turn a sorted list of block numbers into [start, stop) runs.
+    """
+    runs = []
+    for block in blocks:
+        if runs and runs[-1][1] == block:
+            runs[-1][1] = block + 1
+        else:
+            runs.append([block, block + 1])
+    return runs
+
+
+class CaptureIndex():
+    '''
+    Time windows and message keys mapped to the blocks of a capture file.
+    '''
+    def __init__(self, reader, block_size=BLOCK_SIZE):
+        self.reader = reader
+        self.block_size = block_size
+        self.block_start_times = []
+        self.block_end_times = []
+        self.keys = {}
+
+    @classmethod
+    def open(cls, capture_filename):
+        """
+        Load the index saved next to a capture, or build and save a new one.
+        """
+        reader = CaptureReader(capture_filename)
+        index = cls(reader)
+        if not index.load():
+            index.build()
+            index.save()
+        return index
+
+    @property
+    def block_count(self):
+        return len(self.block_start_times)
+
+    def build(self):
+        """
+        Read the whole capture once to find the time range and keys of each
+        block.
+        """
+        records = self.reader.as_array()
+        record_count = len(records)
+        block_starts = np.arange(0, record_count, self.block_size)
+        if record_count:
+            self.block_start_times = np.minimum.reduceat(records["timestamp"], block_starts).tolist()
+            self.block_end_times = np.maximum.reduceat(records["timestamp"], block_starts).tolist()
+        else:
+            self.block_start_times = []
+            self.block_end_times = []
+        first_records = np.flatnonzero((records["flags"] & FLAG_CONTINUATION) == 0)
+        blocks = first_records // self.block_size
+
+        key_blocks = {}
+        if self.reader.protocol == "J1708":
+            # The PIDs have to be found one message at a time.
+            for record_index, block in zip(first_records.tolist(), blocks.tolist()):
+                (timestamp, vda_time, message_id, flags, data), next_index = self.reader.read_message(record_index)
+                for key in message_keys("J1708", message_id, data):
+                    key_blocks.setdefault(key, set()).add(block)
+        else:
+            ids = records["id"][first_records].astype(np.uint64)
+            pairs = np.unique((ids << np.uint64(32)) | blocks.astype(np.uint64))
+            for message_id, block in zip((pairs >> np.uint64(32)).tolist(), (pairs & np.uint64(0xFFFFFFFF)).tolist()):
+                key = message_keys(self.reader.protocol, message_id, b'')[0]
+                key_blocks.setdefault(key, set()).add(block)
+
+        self.keys = {repr(key): block_runs(sorted(key_blocks[key])) for key in key_blocks}
+        logger.debug("Indexed {} records with {} keys in {}".format(record_count, len(self.keys), self.reader.filename))
+
+    def save(self):
+        index_data = {"Version": INDEX_VERSION,
+                      "Protocol": self.reader.protocol,
+                      "Capture Size": self.reader.size,
+                      "Capture Start Time": self.reader.start_time,
+                      "Block Size": self.block_size,
+                      "Block Start Times": self.block_start_times,
+                      "Block End Times": self.block_end_times,
+                      "Keys": self.keys}
+        try:
+            with open(get_index_filename(self.reader.filename), 'w') as index_file:
+                json.dump(index_data, index_file)
+        except OSError:
+            logger.debug(traceback.format_exc())
+
+    def load(self):
+        """
+        Returns True if a saved index matches the capture file.
+        """
+        try:
+            with open(get_index_filename(self.reader.filename), 'r') as index_file:
+                index_data = json.load(index_file)
+        except (OSError, ValueError):
+            return False
+        if (index_data.get("Version") != INDEX_VERSION
+                or index_data.get("Capture Size") != self.reader.size
+                or index_data.get("Capture Start Time") != self.reader.start_time):
+            return False
+        self.block_size = index_data["Block Size"]
+        self.block_start_times = index_data["Block Start Times"]
+        self.block_end_times = index_data["Block End Times"]
+        self.keys = index_data["Keys"]
+        return True
+
+    def record_ranges(self, key=None, start_time=None, end_time=None):
+        """
+        Returns the (start, stop) record ranges that may hold messages with
+        the key between the two times. Neighboring blocks are merged.
+        """
+        if key is None:
+            runs = [[0, self.block_count]]
+        else:
+            runs = self.keys.get(repr(key), [])
+        ranges = []
+        for run_start, run_stop in runs:
+            for block in range(run_start, run_stop):
+                if start_time is not None and self.block_end_times[block] < start_time:
+                    continue
+                if end_time is not None and self.block_start_times[block] > end_time:
+                    continue
+                record_start = block * self.block_size
+                if ranges and ranges[-1][1] == record_start:
+                    ranges[-1][1] = record_start + self.block_size
+                else:
+                    ranges.append([record_start, record_start + self.block_size])
+        return [(start, min(stop, self.reader.record_count)) for start, stop in ranges]
+
+    def find(self, key=None, start_time=None, end_time=None):
+        """
+        Yields (timestamp, vda_time, id, flags, data) for the messages with
+        the key between the two times.
+        """
+        protocol = self.reader.protocol
+        for start, stop in self.record_ranges(key, start_time, end_time):
+            for message in self.reader.messages(start, stop):
+                timestamp, vda_time, message_id, flags, data = message
+                if start_time is not None and timestamp < start_time:
+                    continue
+                if end_time is not None and timestamp > end_time:
+                    continue
+                if key is None or key in message_keys(protocol, message_id, data):
+                    yield message
+
+    def close(self):
+        self.reader.close()
@@ -0,0 +1,169 @@
+from ctypes import c_char, c_short, byref
+import threading
+import time
+import struct
+from TURP1210.RP1210.RP1210Functions import *
+from TURP1210.RP1210.RP1210RingBuffer import *
+from TURP1210.RP1210.RP1210Capture import *
+import logging
+logger = logging.getLogger(__name__)
+
+# The fields at the start of every message from RP1210_ReadMessage
+RX_HEADER = struct.Struct(">LB") # VDA timestamp, echo
+EXTENDED_CAN_ID = struct.Struct(">L")
+STANDARD_CAN_ID = struct.Struct(">H")
+J1939_ID = struct.Struct("<LBB") # PGN and priority, source, destination
+
+class RP1210ReadMessageThread(threading.Thread):
+    '''This thread is designed to receive messages from the vehicle diagnostic
+    adapter (VDA) and write the data into a ring buffer. The class arguments are as
+    follows:
+    rx_buffer - An RP1210RingBuffer that takes the received messages.
+    extra_queue - A queue that takes the ISO 15765 messages on J1939.
+    RP1210_ReadMessage - a function handle to the VDA DLL. Any callable with
+                the same arguments works, so a fake one can be used for testing.
+    nClientID - this lets us know which network is being used to receive the
+                messages. This will likely be a 1 or 2
+    storage_path - the directory for the capture file of all the traffic.
+                Use None for no file.
+    batch_size - when given, the DLL is drained with non-blocking reads and up
+                to batch_size messages are handed to the readers at once.
+    batch_latency - the longest time in seconds a message is held back in a
+                batch. This is also how long to wait when the DLL is empty.'''
+
+    def __init__(self, parent, rx_buffer, extra_queue, RP1210_ReadMessage, nClientID, protocol, storage_path,
+                 filename="NetworkTraffic", batch_size=None, batch_latency=0.005):
+        threading.Thread.__init__(self)
+        self.root = parent
+        self.rx_buffer = rx_buffer
+        self.extra_queue = extra_queue
+        self.RP1210_ReadMessage = RP1210_ReadMessage
+        self.nClientID = nClientID
+        self.runSignal = True
+        self.message_count = 0
+        self.start_time = time.time()
+        self.duration = 0
+        if storage_path is None:
+            self.filename = None
+        else:
+            self.filename = get_capture_filename(storage_path, protocol, filename)
+        self.capture = None
+        self.protocol = protocol
+        if batch_size is not None:
+            # A batch has to fit in the ring before it is published
+            batch_size = max(1, min(batch_size, rx_buffer.capacity - 1))
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.batch_count = 0
+        self.read_errors = 0
+        self.pgns_to_block=[61444, 61443, 65134, 65215]
+        self.sources_to_block=[0, 11]
+        self.can_ids_to_block = []
+
+    def run(self):
+        ucTxRxBuffer = (c_char * 2000)()
+        # display a valid connection upon start.
+        logger.debug("Read Message Client ID: {}".format(self.nClientID))
+        if self.filename is not None:
+            self.capture = CaptureWriter(self.filename, self.protocol, start_time=self.start_time)
+        try:
+            if self.batch_size is None:
+                self.read_blocking(ucTxRxBuffer)
+            else:
+                self.read_batches(ucTxRxBuffer)
+        finally:
+            if self.capture is not None:
+                self.capture.close()
+        logger.debug("RP1210 Receive Thread is finished.")
+
+    def read_blocking(self, ucTxRxBuffer):
+        """
+        Wait in the DLL for each message and publish it right away.
+        """
+        while self.runSignal: #Look into threading.events
+                self.duration = time.time() - self.start_time
+                return_value = self.RP1210_ReadMessage(c_short(self.nClientID),
+                                                       byref(ucTxRxBuffer),
+                                                       c_short(2000),
+                                                       c_short(BLOCKING_IO))
+                if return_value > 0:
+                    self.store_message(time.time(), ucTxRxBuffer, return_value)
+
+    def read_batches(self, ucTxRxBuffer):
+        """
+        Read everything the DLL has buffered without blocking, then publish
+        the batch. Sleep for batch_latency when the DLL has nothing.
+        """
+        client_id = c_short(self.nClientID)
+        buffer_reference = byref(ucTxRxBuffer)
+        buffer_size = c_short(2000)
+        non_blocking = c_short(NON_BLOCKING_IO)
+        while self.runSignal:
+            batch_start = time.time()
+            self.duration = batch_start - self.start_time
+            count = 0
+            while count < self.batch_size:
+                return_value = self.RP1210_ReadMessage(client_id, buffer_reference, buffer_size, non_blocking)
+                if return_value <= 0:
+                    # 0 means the DLL is empty. Negative values are errors.
+                    if return_value < 0:
+                        self.read_errors += 1
+                    break
+                current_time = time.time()
+                self.store_message(current_time, ucTxRxBuffer, return_value, publish=False)
+                count += 1
+                if current_time - batch_start > self.batch_latency:
+                    break
+            if count:
+                self.rx_buffer.publish()
+                self.batch_count += 1
+            if return_value <= 0:
+                time.sleep(self.batch_latency)
+
+    def store_message(self, current_time, ucTxRxBuffer, return_value, publish=True):
+        """
+        Write one message from RP1210_ReadMessage into the ring buffer
+        without making copies of it, and record it in the capture file.
+        """
+        vda_timestamp, echo = RX_HEADER.unpack_from(ucTxRxBuffer, 0)
+        if echo:
+            flags = FLAG_ECHO
+        else:
+            #Echo is on, so we only want to count what others are sending.
+            flags = 0
+            self.message_count +=1
+
+        if self.protocol == "CAN":
+            if ucTxRxBuffer[5] != b'\x00': #extended
+                can_id = EXTENDED_CAN_ID.unpack_from(ucTxRxBuffer, 6)[0]
+                flags |= FLAG_EXTENDED
+                data_start = 10
+            else:
+                can_id = STANDARD_CAN_ID.unpack_from(ucTxRxBuffer, 6)[0]
+                data_start = 8
+            self.rx_buffer.write(current_time, vda_timestamp, can_id, flags, ucTxRxBuffer, return_value, publish)
+            if self.capture is not None:
+                self.capture.write(current_time, vda_timestamp, can_id, flags, ucTxRxBuffer[data_start:return_value])
+
+        elif self.protocol == "J1708":
+            mid = ucTxRxBuffer[5][0] if return_value > 5 else 0
+            self.rx_buffer.write(current_time, vda_timestamp, mid, flags, ucTxRxBuffer, return_value, publish)
+            if self.capture is not None:
+                self.capture.write(current_time, vda_timestamp, mid, flags, ucTxRxBuffer[5:return_value])
+
+        elif self.protocol == "J1939":
+            pgn, sa, dst_addr = J1939_ID.unpack_from(ucTxRxBuffer, 5)
+            if self.capture is not None:
+                can_id = j1939_to_can_id(pgn & 0xFFFFFF, (pgn >> 24) & 0x07, sa, dst_addr)
+                self.capture.write(current_time, vda_timestamp, can_id, flags | FLAG_EXTENDED, ucTxRxBuffer[11:return_value])
+            pgn &= 0xFFFFFF # The fourth byte is the priority
+            if (pgn not in self.pgns_to_block) or (sa not in self.sources_to_block):
+                self.rx_buffer.write(current_time, vda_timestamp, (pgn << 8) | sa, flags, ucTxRxBuffer, return_value, publish)
+            #ISO 15765 traffic only
+            if pgn == 0xDA00:
+                message_data = ucTxRxBuffer[11:return_value]
+                self.extra_queue.put((pgn, 6, sa, dst_addr, message_data))
+
+    def flush_capture(self):
+        if self.capture is not None:
+            self.capture.flush()
@@ -0,0 +1,140 @@
+"""
+A preallocated ring of fixed size records between the RP1210 read thread and
+the threads that use the messages.
+
+There is one writer. It copies each message into the next slot and then
+publishes it by advancing write_count, so it never waits on a lock and never
+blocks when the readers fall behind. The writer can also hold back a batch
+of records and publish them together. Every reader keeps its own position and
+counts the records that were overwritten before it got to them.
+
+Each record is a small header followed by a payload slot holding the message
+as it came from RP1210_ReadMessage. Messages longer than the slot, like
+J1939 transport messages put together by the adapter, are kept whole in a
+side table until their slot is reused.
+"""
+import ctypes
+import struct
+import logging
+logger = logging.getLogger(__name__)
+
+# timestamp, VDA time, message id, flags, message length
+RECORD_HEADER = struct.Struct("<dIIHH")
+
+FLAG_ECHO = 0x01
+FLAG_EXTENDED = 0x02
+FLAG_OVERSIZE = 0x04
+
+DEFAULT_CAPACITY = 16384
+DEFAULT_SLOT_SIZE = 64
+
+class RP1210RingBuffer():
+    '''
+    The ring itself. Only one thread may call write.
+    capacity - the number of records kept before they are overwritten.
+    slot_size - the number of message bytes stored in each record.
+    '''
+    def __init__(self, capacity=DEFAULT_CAPACITY, slot_size=DEFAULT_SLOT_SIZE):
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.record_size = RECORD_HEADER.size + slot_size
+        self.buffer = bytearray(capacity * self.record_size)
+        self.view = memoryview(self.buffer)
+        # Keep a ctypes view so messages can be copied in with memmove
+        self.ctypes_buffer = (ctypes.c_char * len(self.buffer)).from_buffer(self.buffer)
+        self.base_address = ctypes.addressof(self.ctypes_buffer)
+        self.oversize = {}
+        self.next_count = 0 # records written, including ones not published yet
+        self.write_count = 0 # records the readers can see
+        self.oversize_count = 0
+
+    def write(self, timestamp, vda_time, message_id, flags, message, length, publish=True):
+        """
+        Copy a message into the next slot. The message can be a ctypes buffer
+        or bytes. Only the first length bytes are used. With publish=False
+        the record is not seen by readers until publish is called.
+        """
+        sequence = self.next_count
+        offset = (sequence % self.capacity) * self.record_size
+        if self.oversize:
+            self.oversize.pop(sequence - self.capacity, None)
+        if length > self.slot_size:
+            self.oversize[sequence] = bytes(message[:length])
+            self.oversize_count += 1
+            flags |= FLAG_OVERSIZE
+            ctypes.memmove(self.base_address + offset + RECORD_HEADER.size, message, self.slot_size)
+        else:
+            ctypes.memmove(self.base_address + offset + RECORD_HEADER.size, message, length)
+        RECORD_HEADER.pack_into(self.buffer, offset, timestamp, vda_time, message_id, flags, length)
+        self.next_count = sequence + 1
+        if publish:
+            # Publishing the record is the last step
+            self.write_count = self.next_count
+
+    def publish(self):
+        """
+        Let the readers see every record written so far.
+        """
+        self.write_count = self.next_count
+
+    def reader(self):
+        """
+        Make a new reader that starts with the next record written.
+        """
+        return RP1210RingReader(self)
+
+
+class RP1210RingReader():
+    '''
+    One consumer's position in an RP1210RingBuffer. Readers do not change the
+    ring, so any number of them can follow the same writer.
+    '''
+    def __init__(self, ring):
+        self.ring = ring
+        self.read_count = ring.write_count
+        self.overruns = 0
+
+    def qsize(self):
+        return min(self.ring.write_count - self.read_count, self.ring.capacity)
+
+    def read(self, max_records=None):
+        """
+        Returns a list of (timestamp, vda_time, message_id, flags, message)
+        tuples for the records written since the last read. Records that were
+        overwritten before they were read are added to overruns.
+        """
+        ring = self.ring
+        write_count = ring.write_count
+        if write_count - self.read_count > ring.capacity:
+            self.overruns += write_count - ring.capacity - self.read_count
+            self.read_count = write_count - ring.capacity
+        end = write_count
+        if max_records is not None:
+            end = min(end, self.read_count + max_records)
+
+        records = []
+        header_size = RECORD_HEADER.size
+        for sequence in range(self.read_count, end):
+            offset = (sequence % ring.capacity) * ring.record_size
+            timestamp, vda_time, message_id, flags, length = RECORD_HEADER.unpack_from(ring.buffer, offset)
+            if flags & FLAG_OVERSIZE:
+                message = ring.oversize.get(sequence, b'')
+            else:
+                message = bytes(ring.view[offset + header_size:offset + header_size + length])
+            records.append((timestamp, vda_time, message_id, flags, message))
+
+        # The writer may have lapped us while copying. Throw away any record
+        # whose slot could have been reused.
+        first_valid = ring.next_count - ring.capacity + 1
+        if self.read_count < first_valid:
+            lost = min(first_valid, end) - self.read_count
+            self.overruns += lost
+            records = records[lost:]
+        self.read_count = end
+        return records
+
+    def skip(self):
+        """
+        Jump past everything written so far.
+        """
+        self.read_count = self.ring.write_count
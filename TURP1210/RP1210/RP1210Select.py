@@ -7,7 +7,8 @@ from PyQt5.QtWidgets import (QApplication,
                              QDialog,
                              QDialogButtonBox,
                              QVBoxLayout,
-                             QErrorMessage
+                             QErrorMessage,
+                             QFileDialog
                              )
 from PyQt5.QtCore import Qt, QCoreApplication
 import sys
@@ -17,6 +18,7 @@ import configparser
 import traceback
 import logging
 from TURP1210.UserData import get_storage_path
+from TURP1210.RP1210.RP1210Simulator import SIMULATOR_NAME, SIMULATOR_INI
 logger = logging.getLogger(__name__)
 
 class SelectRP1210(QDialog):
@@ -25,14 +27,15 @@ class SelectRP1210(QDialog):
     """
     def __init__(self,title):
         super(SelectRP1210,self).__init__()
+        # The simulator is always there, even without any RP1210 drivers
+        self.apis = [SIMULATOR_NAME]
         RP1210_config = configparser.ConfigParser()
         try:
             RP1210_config.read(os.path.join(os.environ["WINDIR"],"RP121032.ini"))
-        except:
+            self.apis += sorted(RP1210_config["RP1210Support"]["apiimplementations"].split(","))
+        except (KeyError, configparser.Error):
             logger.warning(traceback.format_exc())
-            QMessageBox.warning(self,"No RP1210 Device","The RP121032.ini file was not found. Please install an RP1210 compliant Vehicle Diagnostics adatper.")
-            return
-        self.apis = sorted(RP1210_config["RP1210Support"]["apiimplementations"].split(","))
+            QMessageBox.warning(self,"No RP1210 Device","The RP121032.ini file was not found. Please install an RP1210 compliant Vehicle Diagnostics adatper. Only the simulated adapter is available.")
         self.current_api_index = 0
         logger.debug("Current RP1210 APIs installed are: " + ", ".join(self.apis))
         storage = get_storage_path(title)
@@ -50,12 +53,14 @@ class SelectRP1210(QDialog):
             self.protocol = file_contents["protocol"]
             self.deviceID = file_contents["deviceID"]
             self.speed    = file_contents["speed"]
+            self.simulator_data_file = file_contents.get("simulator_data_file")
         except:
             logger.warning(traceback.format_exc())
             self.dll_name = False
             self.protocol = False
             self.deviceID = False
             self.speed = False
+            self.simulator_data_file = None
         
     
     def show_dialog(self):
@@ -125,7 +130,10 @@ class SelectRP1210(QDialog):
         for api_string in self.apis:
             self.vendor_configs[api_string] = configparser.ConfigParser()
             try:
-                self.vendor_configs[api_string].read(os.path.join(os.environ["WINDIR"],api_string + ".ini"))
+                if api_string == SIMULATOR_NAME:
+                    self.vendor_configs[api_string].read_string(SIMULATOR_INI)
+                else:
+                    self.vendor_configs[api_string].read(os.path.join(os.environ["WINDIR"],api_string + ".ini"))
                 #logger.debug("api_string = {}".format(api_string))
                 #logger.debug("The api ini file has the following sections:")
                 #logger.debug(vendor_config.sections())
@@ -265,6 +273,24 @@ class SelectRP1210(QDialog):
         self.deviceID = int(self.device_combo_box.itemText(device_index).split(":")[0].strip())
         self.speed = self.speed_combo_box.itemText(speed_index)
         self.protocol = self.protocol_combo_box.itemText(protocol_index).split(":")[0].strip()
+        if self.dll_name == SIMULATOR_NAME:
+            self.select_simulator_data_file()
+
+    def select_simulator_data_file(self):
+        """
+        Ask for the data package the simulator replays. Without one the
+        simulator makes up traffic.
+        """
+        fname = QFileDialog.getOpenFileName(self, 
+                                            'Open a Data Package to Simulate',
+                                            self.simulator_data_file if self.simulator_data_file else "",
+                                            "Data Packages (*.cpt *.json);;All Files (*)",
+                                            "Data Packages (*.cpt *.json)")
+        if fname[0]:
+            self.simulator_data_file = fname[0]
+        else:
+            self.simulator_data_file = None
+        logger.debug("Simulator data file: {}".format(self.simulator_data_file))
 
     def reject_RP1210(self):
         self.dll_name = None
@@ -0,0 +1,392 @@
+"""
+A simulated RP1210 adapter for testing without a vehicle.
+
+RP1210Simulator has the same ClientConnect, ClientDisconnect, ReadMessage,
+SendMessage and SendCommand functions as the DLL prototypes made in
+RP1210Class.create_RP1210_functions, so it can be used anywhere the DLL is.
+Each client gets traffic at a set rate. The traffic is replayed from the
+last messages in a data package, or made up when there is no data package.
+J1939 requests (PGN 59904) and J1587 requests (PID 0) are answered from the
+data package.
+
+RP1210Class uses the simulator when the DLL name is SIMULATOR_NAME.
+SelectRP1210 lists it with the installed adapters, using SIMULATOR_INI in
+place of a vendor ini file, and asks for the data package to replay.
+"""
+import ctypes
+import base64
+import collections
+from collections import OrderedDict
+import itertools
+import json
+import struct
+import time
+import traceback
+from TURP1210.RP1210.RP1210Functions import *
+from TURP1210.RP1210.RP1210Capture import j1939_to_can_id
+from TURP1210.J1939State import parse_repr_key, unpack_key, pgn_entry_from_data_package
+import logging
+logger = logging.getLogger(__name__)
+
+SIMULATOR_NAME = "TUSimulator"
+
+# The vendor ini file the selection dialog reads for the simulator
+SIMULATOR_INI = """
+[VendorInformation]
+Name=Simulated Adapter (No Vehicle)
+
+[DeviceInformation1]
+DeviceID=1
+DeviceName=Simulator
+DeviceDescription=Replays a data package or made up traffic
+
+[ProtocolInformation1]
+ProtocolString=J1939
+ProtocolDescription=SAE J1939 Protocol
+ProtocolSpeed=250,500,Auto
+Devices=1
+
+[ProtocolInformation2]
+ProtocolString=CAN
+ProtocolDescription=Controller Area Network
+ProtocolSpeed=250,500,Auto
+Devices=1
+
+[ProtocolInformation3]
+ProtocolString=J1708
+ProtocolDescription=SAE J1708 Protocol
+ProtocolSpeed=9600
+Devices=1
+"""
+
+REQUEST_PGN = 0xEA00
+J1587_REQUEST_PID = 0
+
+# Bits on the wire for one message, used to turn a bus load into a message rate.
+# An 8 byte extended CAN frame is 128 bits before bit stuffing. A J1708
+# character is 10 bits and a typical J1708 message is about 12 characters.
+BITS_PER_CAN_FRAME = 128
+BITS_PER_J1708_MESSAGE = 120
+
+DEFAULT_BITRATES = {"J1939": 250000,
+                    "CAN": 250000,
+                    "J1708": 9600}
+
+# Messages to send when there is no data package. The first data byte counts
+# up so the SPNs change and get decoded.
+SYNTHETIC_J1939_MESSAGES = [(61444, 0, 3),  # EEC1
+                            (61443, 0, 3),  # EEC2
+                            (65265, 0, 6),  # CCVS
+                            (65262, 0, 6),  # Engine Temperature
+                            (65263, 0, 6),  # Engine Fluid Level/Pressure
+                            (65270, 0, 6),  # Inlet/Exhaust Conditions
+                            (65266, 0, 6),  # Fuel Economy
+                            (65271, 0, 6),  # Vehicle Electrical Power
+                            (61442, 3, 3),  # ETC1
+                            (61441, 11, 3), # EBC1
+                            (65254, 0, 6)]  # Time/Date
+
+SYNTHETIC_J1708_MESSAGES = [(128, 84, b'\x00'),     # Road speed
+                            (128, 190, b'\x00\x00'), # Engine speed
+                            (128, 110, b'\x00'),     # Coolant temperature
+                            (128, 168, b'\x00\x00')] # Battery potential
+
+# The fields at the start of a message given to RP1210_SendMessage
+J1939_TX_HEADER = struct.Struct("<HBBBB") # PGN low word, PGN high byte, how/priority, source, destination
+RX_PREFIX = struct.Struct(">LB") # VDA timestamp, echo
+
+def load_data_package_file(filename):
+    """
+    Load a data package from a signed .cpt file or an exported JSON file.
+    """
+    with open(filename, 'r') as package_file:
+        contents = package_file.read()
+    if contents.lstrip().startswith("-----BEGIN PGP"):
+        import pgpy
+        contents = pgpy.PGPMessage.from_blob(contents).message
+    return json.loads(contents)
+
+def get_value(argument):
+    """
+    The app passes ctypes objects like c_short(1), but tests may pass ints.
+    """
+    try:
+        return argument.value
+    except AttributeError:
+        return argument
+
+def get_buffer(argument):
+    """
+    Find the ctypes buffer behind a byref() or POINTER argument.
+    """
+    try:
+        return argument._obj
+    except AttributeError:
+        pass
+    try:
+        return argument.contents
+    except AttributeError:
+        return argument
+
+def frames_per_second(protocol, bus_load, bitrate=None):
+    """
+    The message rate that gives the bus load (0 to 1) on a network.
+    """
+    if bitrate is None:
+        bitrate = DEFAULT_BITRATES.get(protocol, 250000)
+    if protocol == "J1708":
+        return bus_load * bitrate / BITS_PER_J1708_MESSAGE
+    return bus_load * bitrate / BITS_PER_CAN_FRAME
+
+
+class SimulatedClient():
+    '''
+    The state of one connection to the simulated adapter.
+    '''
+    def __init__(self, protocol, rate):
+        self.protocol = protocol
+        self.echo = False
+        self.pending = collections.deque()
+        self.traffic = None
+        self.interval = 1.0 / rate if rate else None
+        self.next_time = time.time()
+        self.sent_count = 0
+        self.read_count = 0
+
+
+class RP1210Simulator():
+    '''
+    A stand in for an RP1210 DLL.
+    data_package - a data package dictionary to replay and answer requests from.
+    bus_load - the fraction of each network's bit rate to fill with traffic.
+    rates - message rates per protocol, like {"J1939": 3900}. These take
+            the place of bus_load.
+    bitrates - bit rates per protocol, used with bus_load.
+    '''
+    def __init__(self, data_package=None, bus_load=0.3, rates={}, bitrates={}):
+        self.data_package = data_package
+        self.bus_load = bus_load
+        self.rates = dict(rates)
+        self.bitrates = dict(bitrates)
+        self.start_time = time.time()
+        self.clients = {}
+        self.next_client_id = 1
+        self.j1939_messages = OrderedDict(self.get_j1939_messages())
+        self.j1708_messages = OrderedDict(self.get_j1708_messages())
+
+        # The functions the app calls on a DLL
+        self.ClientConnect = self.client_connect
+        self.ClientDisconnect = self.client_disconnect
+        self.ReadMessage = self.read_message
+        self.SendMessage = self.send_message
+        self.SendCommand = self.send_command
+        self.ReadVersion = None
+        self.ReadDetailedVersion = None
+        self.GetHardwareStatus = None
+        self.GetErrorMsg = None
+        self.GetHardwareStatusEx = None
+        self.GetLastErrorMsg = None
+
+    def get_j1939_messages(self):
+        """
+        Returns a list of ((pgn, sa), data_bytes) with the last payload of
+        each PGN in the data package.
+        """
+        messages = []
+        if self.data_package is not None:
+            for key, entry in self.data_package.get("J1939 Parameter Group Numbers", {}).items():
+                try:
+                    data_bytes = pgn_entry_from_data_package(entry)["Bytes"]
+                    if data_bytes:
+                        messages.append((unpack_key(parse_repr_key(key)), data_bytes))
+                except (ValueError, AttributeError, TypeError):
+                    logger.debug(traceback.format_exc())
+        return messages
+
+    def get_j1708_messages(self):
+        """
+        Returns a list of ((mid, pid), data_bytes) with the last value of
+        each PID in the data package.
+        """
+        messages = []
+        if self.data_package is not None:
+            for key, entry in self.data_package.get("J1587 Message and Parameter IDs", {}).items():
+                try:
+                    # PIDs can be above 255, so the key is not packed
+                    mid, pid = [int(k) for k in key.strip("()").split(",")]
+                    data_bytes = base64.b64decode(entry["Message List"][-1][1])
+                    messages.append(((mid, pid), data_bytes))
+                except (ValueError, AttributeError, TypeError, KeyError, IndexError):
+                    logger.debug(traceback.format_exc())
+        return messages
+
+    def get_rate(self, protocol):
+        try:
+            return self.rates[protocol]
+        except KeyError:
+            return frames_per_second(protocol, self.bus_load, self.bitrates.get(protocol))
+
+    def vda_time(self):
+        # The adapter time stamp in milliseconds
+        return int(1000 * (time.time() - self.start_time)) & 0xFFFFFFFF
+
+    def client_connect(self, hwnd, device_id, protocol_bytes, tx_buffer_size=0, rx_buffer_size=0, is_app_packetizing=0):
+        protocol_string = get_value(protocol_bytes)
+        if isinstance(protocol_string, bytes):
+            protocol_string = protocol_string.decode('ascii', 'ignore')
+        protocol = protocol_string.split(":")[0]
+        if protocol not in DEFAULT_BITRATES:
+            return 136 # ERR_INVALID_PROTOCOL
+        client_id = self.next_client_id
+        self.next_client_id += 1
+        client = SimulatedClient(protocol, self.get_rate(protocol))
+        if protocol == "J1939":
+            client.traffic = self.j1939_traffic()
+        elif protocol == "CAN":
+            client.traffic = self.can_traffic()
+        elif protocol == "J1708":
+            client.traffic = self.j1708_traffic()
+        self.clients[client_id] = client
+        logger.debug("Simulated {} client {} sends {:0.1f} messages per second.".format(protocol, client_id, self.get_rate(protocol)))
+        return client_id
+
+    def client_disconnect(self, client_id):
+        try:
+            del self.clients[get_value(client_id)]
+        except KeyError:
+            return 129 # ERR_INVALID_CLIENT_ID
+        return 0
+
+    def send_command(self, command_number, client_id, command_buffer=None, length=0):
+        client = self.clients.get(get_value(client_id))
+        if client is None:
+            return 129 # ERR_INVALID_CLIENT_ID
+        if get_value(command_number) == RP1210_Echo_Transmitted_Messages and get_value(length):
+            client.echo = get_buffer(command_buffer)[0] not in (b'\x00', 0)
+        return 0
+
+    def read_message(self, client_id, rx_buffer, buffer_size, blocking=NON_BLOCKING_IO):
+        """
+        Copy the next message into rx_buffer and return its length. Returns 0
+        when there is nothing to read. A blocking read waits for the next
+        scheduled message, but only briefly so the caller can check if it
+        should stop.
+        """
+        client = self.clients.get(get_value(client_id))
+        if client is None:
+            return -129 # ERR_INVALID_CLIENT_ID
+        if client.pending:
+            message = client.pending.popleft()
+        else:
+            message = self.next_scheduled_message(client, get_value(blocking) == BLOCKING_IO)
+            if message is None:
+                return 0
+        if len(message) > get_value(buffer_size):
+            return -141 # ERR_MESSAGE_TOO_LONG
+        ctypes.memmove(get_buffer(rx_buffer), message, len(message))
+        client.read_count += 1
+        return len(message)
+
+    def next_scheduled_message(self, client, blocking):
+        if client.interval is None or client.traffic is None:
+            if blocking:
+                time.sleep(0.05)
+            return None
+        now = time.time()
+        if now < client.next_time:
+            if not blocking:
+                return None
+            time.sleep(min(client.next_time - now, 0.05))
+            if time.time() < client.next_time:
+                return None
+        elif now - client.next_time > 1:
+            # Don't try to catch up on more than a second of messages
+            client.next_time = now
+        client.next_time += client.interval
+        return RX_PREFIX.pack(self.vda_time(), 0) + next(client.traffic)
+
+    def send_message(self, client_id, tx_buffer, length, notify_status=0, blocking=0):
+        client = self.clients.get(get_value(client_id))
+        if client is None:
+            return 129 # ERR_INVALID_CLIENT_ID
+        message = bytes(get_buffer(tx_buffer)[:get_value(length)])
+        client.sent_count += 1
+        if client.echo:
+            client.pending.append(RX_PREFIX.pack(self.vda_time(), 1) + self.tx_to_rx(client.protocol, message))
+        try:
+            if client.protocol == "J1939":
+                self.answer_j1939_request(client, message)
+            elif client.protocol == "J1708":
+                self.answer_j1587_request(client, message)
+        except (IndexError, struct.error):
+            logger.debug(traceback.format_exc())
+        return 0
+
+    def tx_to_rx(self, protocol, message):
+        """
+        Convert a message given to SendMessage into the form ReadMessage
+        returns, without the time stamp and echo byte.
+        """
+        if protocol == "J1708":
+            return message[1:] # Drop the priority
+        return message
+
+    def answer_j1939_request(self, client, message):
+        pgn_low, pgn_high, priority, sa, da = J1939_TX_HEADER.unpack_from(message, 0)
+        if pgn_low + (pgn_high << 16) != REQUEST_PGN:
+            return
+        requested_pgn = struct.unpack("<L", message[6:9] + b'\x00')[0]
+        for (pgn, source), data_bytes in self.j1939_messages.items():
+            if pgn == requested_pgn and (da == 0xFF or da == source):
+                client.pending.append(RX_PREFIX.pack(self.vda_time(), 0) +
+                                      self.j1939_rx_message(pgn, 6, source, sa, data_bytes))
+
+    def answer_j1587_request(self, client, message):
+        # priority, MID, PID 0, requested PID
+        if message[2] != J1587_REQUEST_PID:
+            return
+        requested_pid = message[3]
+        if requested_pid == 255:
+            requested_pid = 256 + message[4]
+        for (mid, pid), data_bytes in self.j1708_messages.items():
+            if pid == requested_pid:
+                client.pending.append(RX_PREFIX.pack(self.vda_time(), 0) +
+                                      self.j1708_rx_message(mid, pid, data_bytes))
+
+    def j1939_rx_message(self, pgn, priority, sa, da, data_bytes):
+        return struct.pack("<L", pgn)[:3] + bytes([priority, sa, da]) + data_bytes
+
+    def j1708_rx_message(self, mid, pid, data_bytes):
+        if pid > 255:
+            return bytes([mid, 255, pid % 256]) + data_bytes
+        return bytes([mid, pid]) + data_bytes
+
+    def j1939_frames(self):
+        """
+        Yields (pgn, priority, sa, da, data_bytes) forever.
+        """
+        if self.j1939_messages:
+            for (pgn, sa), data_bytes in itertools.cycle(list(self.j1939_messages.items())):
+                yield (pgn, 6, sa, 0xFF, data_bytes)
+        else:
+            for count in itertools.count():
+                for pgn, sa, priority in SYNTHETIC_J1939_MESSAGES:
+                    yield (pgn, priority, sa, 0xFF, bytes([count & 0xFF, 0x7D, 0x7D, 0x7D, 0x7D, 0xFF, 0xFF, 0xFF]))
+
+    def j1939_traffic(self):
+        for pgn, priority, sa, da, data_bytes in self.j1939_frames():
+            yield self.j1939_rx_message(pgn, priority, sa, da, data_bytes)
+
+    def can_traffic(self):
+        # Extended frames: type byte, big endian identifier, data
+        for pgn, priority, sa, da, data_bytes in self.j1939_frames():
+            yield b'\x01' + struct.pack(">L", j1939_to_can_id(pgn, priority, sa, da)) + data_bytes[:8]
+
+    def j1708_traffic(self):
+        if self.j1708_messages:
+            for (mid, pid), data_bytes in itertools.cycle(list(self.j1708_messages.items())):
+                yield self.j1708_rx_message(mid, pid, data_bytes)
+        else:
+            for count in itertools.count():
+                for mid, pid, data_bytes in SYNTHETIC_J1708_MESSAGES:
+                    yield self.j1708_rx_message(mid, pid, bytes([count & 0xFF]) + data_bytes[1:])
@@ -0,0 +1,85 @@
+"""
+Run the slow parts of saving in a background thread.
+
+Serializing, compressing and signing the data package, copying and signing
+the logs and rendering the PDF report can take a long time. The SaveWorker
+runs them as a list of steps so the GUI thread keeps draining the receive
+buffers. The steps should only use the snapshot of the data package they
+were given, never the live one.
+
+Progress is put on a queue as (step, label) and read by the GUI with
+get_progress, the same way the receive threads hand over messages. Setting
+runSignal to False cancels the save before the next step.
+"""
+import json
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+def snapshot_data_package(data_package):
+    """
+    A deep copy of the data package that the live decoders can't change.
+    """
+    return json.loads(json.dumps(data_package))
+
+
+class SaveWorker(threading.Thread):
+    '''
+    Runs save steps one after the other in a background thread.
+    '''
+    def __init__(self, title="Saving"):
+        threading.Thread.__init__(self)
+        self.title = title
+        self.steps = []
+        self.results = OrderedDict()
+        self.progress_queue = queue.Queue()
+        self.runSignal = True
+        self.cancelled = False
+        self.error = None
+        self.progress = (0, "")
+        self.elapsed_time = None
+
+    def add_step(self, key, label, function, *args):
+        """
+        The return value of function(*args) is saved in results[key].
+        """
+        self.steps.append((key, label, function, args))
+
+    @property
+    def step_count(self):
+        return len(self.steps)
+
+    def run(self):
+        start_time = time.time()
+        for step, (key, label, function, args) in enumerate(self.steps):
+            if not self.runSignal:
+                self.cancelled = True
+                logger.info("{} was cancelled before: {}".format(self.title, label))
+                break
+            self.progress_queue.put((step, label))
+            try:
+                self.results[key] = function(*args)
+            except:
+                self.error = "{} failed while {}".format(self.title, label[0].lower() + label[1:])
+                logger.warning(self.error)
+                logger.debug(traceback.format_exc())
+                break
+        self.elapsed_time = time.time() - start_time
+        self.progress_queue.put((self.step_count, "Done"))
+        logger.debug("{} took {:0.3f} seconds.".format(self.title, self.elapsed_time))
+
+    def get_progress(self):
+        """
+        Returns the latest (step, label) the worker has reported.
+        """
+        while self.progress_queue.qsize():
+            self.progress = self.progress_queue.get()
+        return self.progress
+
+    def cancel(self):
+        self.runSignal = False
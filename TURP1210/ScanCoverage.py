@@ -0,0 +1,134 @@
+"""
+Track which scan requests have been answered so a scan can stop early.
+
+Each target of a scan ends up in one of these states:
+    Answered                 - the ECU sent the PGN or PID
+    Negative Acknowledgement - the ECU said it does not support the PGN (PGN 59392)
+    Timed Out                - there was no response
+    Skipped                  - not asked because it has never answered before
+A target that was answered or acknowledged is covered and is not requested
+again in later passes. The scan has converged when a pass covers nothing
+new and there are no new targets to ask, like from a source address that
+showed up during the last pass.
+"""
+from collections import OrderedDict
+from TURP1210.ScanScheduler import ANSWERED, NACKED, TIMED_OUT, GLOBAL_ADDRESS
+
+import logging
+logger = logging.getLogger(__name__)
+
+SKIPPED = "Skipped"
+COVERED = (ANSWERED, NACKED)
+
+
+class ScanCoverage():
+    '''
+    The state of every target asked for in a scan.
+    '''
+    def __init__(self):
+        self.status = OrderedDict()
+        self.requested = set()
+        self.j1587_sources = OrderedDict() # PID: MIDs that answered
+        self.passes = 0
+        self.gains = []
+        self.covered_at_start = 0
+
+    @property
+    def covered_count(self):
+        return sum(1 for status in self.status.values() if status in COVERED)
+
+    def is_covered(self, target):
+        return self.status.get(target) in COVERED
+
+    def set_status(self, target, status):
+        previous = self.status.get(target)
+        if previous == ANSWERED or (previous == NACKED and status != ANSWERED):
+            return
+        self.status[target] = status
+
+    def record(self, target, status, latency=None, source=None):
+        """
+        Record the result of a request. This can be used as the on_result
+        callback of a ScanScheduler.
+        """
+        self.set_status(target, status)
+        if status != ANSWERED or source is None:
+            return
+        if target[0] == "J1939" and target[2] == GLOBAL_ADDRESS:
+            # An answer to a global request also covers the address that sent it
+            self.set_status(("J1939", target[1], source), ANSWERED)
+        elif target[0] == "J1587":
+            mids = self.j1587_sources.setdefault(target[1], [])
+            if source not in mids:
+                mids.append(source)
+
+    def record_skipped(self, targets):
+        for target in targets:
+            if target not in self.status:
+                self.status[target] = SKIPPED
+
+    def get_remaining(self, targets):
+        """
+        Returns the targets that still need to be asked for.
+        """
+        return [target for target in targets if not self.is_covered(target)]
+
+    def converged(self, targets):
+        """
+        True when the last pass covered nothing new and every remaining
+        target was already asked for in it.
+        """
+        if not self.gains or self.gains[-1] > 0:
+            return False
+        return all(target in self.requested for target in targets)
+
+    def start_pass(self, targets):
+        self.requested.update(targets)
+        self.covered_at_start = self.covered_count
+
+    def end_pass(self):
+        """
+        Returns the number of targets the pass covered.
+        """
+        gain = self.covered_count - self.covered_at_start
+        self.gains.append(gain)
+        self.passes += 1
+        logger.info("Scan pass {} covered {} more targets, {} in all.".format(self.passes, gain, self.covered_count))
+        return gain
+
+    def get_missing(self):
+        """
+        Returns the (target, status) pairs that were not answered.
+        """
+        return [(target, status) for target, status in self.status.items() if status != ANSWERED]
+
+    def to_data_package(self, pgn_label=None, sa_name=None, pid_name=None):
+        """
+        Summarize the coverage for the data package. The functions give the
+        names shown with the PGNs, source addresses and PIDs.
+        """
+        counts = OrderedDict((status, 0) for status in [ANSWERED, NACKED, TIMED_OUT, SKIPPED])
+        for status in self.status.values():
+            counts[status] += 1
+        missing = []
+        for target, status in self.get_missing():
+            if target[0] == "J1939":
+                pgn, sa = target[1], target[2]
+                missing.append(OrderedDict([("Network", "J1939"),
+                                            ("PGN", pgn),
+                                            ("Name", pgn_label(pgn) if pgn_label else ""),
+                                            ("SA", sa),
+                                            ("Source", "Global" if sa == GLOBAL_ADDRESS else sa_name(sa) if sa_name else ""),
+                                            ("Result", status)]))
+            else:
+                pid = target[1]
+                missing.append(OrderedDict([("Network", "J1587"),
+                                            ("PID", pid),
+                                            ("Name", pid_name(pid) if pid_name else ""),
+                                            ("Result", status)]))
+        return OrderedDict([("Passes", self.passes),
+                            ("Converged", bool(self.gains) and self.gains[-1] == 0),
+                            ("Requested", len(self.status)),
+                            ("Results", counts),
+                            ("J1587 Responders", OrderedDict((str(pid), mids) for pid, mids in self.j1587_sources.items())),
+                            ("Missing", missing)])
@@ -0,0 +1,265 @@
+"""
+Send the request messages of a network scan with several requests in flight.
+
+A target is a tuple:
+    ("J1939", pgn, da) - a J1939 request for a PGN sent to a destination address
+    ("J1587", pid)     - a J1587 request for a PID
+Requests to different destinations are sent without waiting for each
+other, but only one request at a time goes to each destination, as J1939
+nodes are only expected to handle one request from a tool at a time. All
+J1587 requests share the J1708 network, so they count as one destination.
+
+The responses are put on response_queue by the J1939 processor and the
+J1587 tab as they are decoded:
+    ("J1939", time, pgn, sa, da, data_bytes)
+    ("J1587", time, mid, pid)
+A J1939 target is answered by its PGN from its destination address, or from
+any address for a global request. A negative acknowledgement (PGN 59392)
+for the PGN also ends the request. Targets that time out are tried again
+after a backoff that doubles each time. An answer that comes in late still
+ends the target.
+
+The requests sent on the CAN bus are held to a share of the bus capacity
+with a token bucket, so the scan does not crowd out the vehicle traffic.
+The scheduler does not block. Call step regularly, like from a QTimer or a
+loop that processes the Qt events.
+"""
+import queue
+import time
+import traceback
+from collections import OrderedDict, deque
+
+import logging
+logger = logging.getLogger(__name__)
+
+ACKNOWLEDGEMENT_PGN = 59392
+GLOBAL_ADDRESS = 0xFF
+J1708_DESTINATION = "J1708"
+
+# Bits in one extended CAN frame with 8 data bytes, including worst case stuffing
+CAN_FRAME_BITS = 160
+
+ANSWERED = "Answered"
+NACKED = "Negative Acknowledgement"
+TIMED_OUT = "Timed Out"
+
+# Control byte values of the acknowledgement PGN
+ACK_CONTROL = {0: "Acknowledgement",
+               1: "Negative Acknowledgement",
+               2: "Access Denied",
+               3: "Cannot Respond"}
+
+def get_destination(target):
+    if target[0] == "J1939":
+        return target[2]
+    return J1708_DESTINATION
+
+
+class ScanScheduler():
+    '''
+    Keeps several scan requests in flight and matches the responses.
+    '''
+    def __init__(self, send_request, get_timeout=None, skip_target=None,
+                 max_outstanding=8,
+                 max_attempts=2,
+                 backoff=0.25,
+                 max_backoff=4.0,
+                 max_bus_load=0.05,
+                 bitrate=250000):
+        """
+        send_request(target, attempt) puts the request on the network.
+        get_timeout(target, attempt) returns the seconds to wait for a
+        response, 1 second if it is not given. Targets that skip_target(target)
+        returns True for are not requested. max_bus_load is the share of the
+        CAN bus the requests may use.
+        """
+        self.send_request = send_request
+        self.get_timeout = get_timeout
+        self.skip_target = skip_target
+        self.max_outstanding = max_outstanding
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.requests_per_second = max_bus_load * bitrate / CAN_FRAME_BITS
+        self.tokens = 1.0
+        self.token_time = None
+
+        self.response_queue = queue.Queue()
+        # The callback is called with (target, status, latency, source) when a
+        # target is done. The source is the SA or MID that answered.
+        self.on_result = None
+
+        self.pending = OrderedDict() # destination: deque of (ready time, target)
+        self.outstanding = {} # target: (sent time, deadline)
+        self.busy = set() # destinations with a request in flight
+        self.attempts = {}
+        self.sent_times = {}
+        self.results = OrderedDict()
+        self.latencies = {}
+        self.sent_count = 0
+        self.target_count = 0
+        self.skipped = []
+
+    def add_targets(self, targets):
+        """
+        Queue targets to be requested. A target that is already queued or in
+        flight is not added again. The skipped list holds the targets of
+        this call that were skipped, each one once.
+        """
+        queued = set(target for requests in self.pending.values() for ready_time, target in requests)
+        self.skipped = []
+        skipped = set()
+        for target in targets:
+            if target in queued or target in self.outstanding or target in skipped:
+                continue
+            if self.skip_target is not None and self.skip_target(target):
+                skipped.add(target)
+                self.skipped.append(target)
+                continue
+            queued.add(target)
+            self.attempts[target] = 0
+            self.sent_times[target] = []
+            self.results.pop(target, None)
+            self.pending.setdefault(get_destination(target), deque()).append((0, target))
+            self.target_count += 1
+
+    @property
+    def done(self):
+        return not self.outstanding and not any(self.pending.values())
+
+    @property
+    def completed_count(self):
+        return self.target_count - len(self.outstanding) - sum(len(requests) for requests in self.pending.values())
+
+    def cancel(self):
+        self.target_count -= len(self.outstanding) + sum(len(requests) for requests in self.pending.values())
+        self.pending.clear()
+        self.outstanding.clear()
+        self.busy.clear()
+
+    def timeout_for(self, target, attempt):
+        if self.get_timeout is None:
+            return 1.0
+        return self.get_timeout(target, attempt)
+
+    def take_token(self, now):
+        """
+        Returns True if another CAN request fits in the bus load budget.
+        """
+        if self.token_time is not None:
+            self.tokens = min(1.0, self.tokens + (now - self.token_time) * self.requests_per_second)
+        self.token_time = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def step(self, now=None):
+        """
+        Match the responses that came in, expire the requests that timed out
+        and send new ones. Returns True when the scan is done.
+        """
+        if now is None:
+            now = time.time()
+        self.read_responses()
+        self.check_timeouts(now)
+        self.send_requests(now)
+        return self.done
+
+    def read_responses(self):
+        while self.response_queue.qsize():
+            response = self.response_queue.get()
+            try:
+                if response[0] == "J1939":
+                    self.match_j1939(*response[1:])
+                else:
+                    self.match_j1587(*response[1:])
+            except (IndexError, TypeError, ValueError):
+                logger.debug(traceback.format_exc())
+
+    def match_j1939(self, rx_time, pgn, sa, da, data_bytes):
+        if pgn == ACKNOWLEDGEMENT_PGN:
+            control = data_bytes[0]
+            if control == 0:
+                return
+            requested_pgn = data_bytes[5] + (data_bytes[6] << 8) + (data_bytes[7] << 16)
+            logger.debug("{} for PGN {} from SA {}".format(ACK_CONTROL.get(control, "Acknowledgement"), requested_pgn, sa))
+            self.finish(("J1939", requested_pgn, sa), NACKED, rx_time, sa)
+            return
+        self.finish(("J1939", pgn, sa), ANSWERED, rx_time, sa)
+        self.finish(("J1939", pgn, GLOBAL_ADDRESS), ANSWERED, rx_time, sa)
+
+    def match_j1587(self, rx_time, mid, pid):
+        self.finish(("J1587", pid), ANSWERED, rx_time, mid)
+
+    def finish(self, target, status, rx_time=None, source=None):
+        """
+        End a target. A response that comes in after its request timed out
+        still counts, and its latency is measured from the last request sent
+        before it came in.
+        """
+        sent_times = self.sent_times.get(target)
+        if not sent_times or self.results.get(target) in (ANSWERED, NACKED):
+            return
+        latency = None
+        if rx_time is not None:
+            earlier = [sent_time for sent_time in sent_times if sent_time <= rx_time]
+            if not earlier:
+                # This came in before the request was sent
+                return
+            latency = rx_time - earlier[-1]
+            self.latencies[target] = latency
+        if target in self.outstanding:
+            del self.outstanding[target]
+            self.busy.discard(get_destination(target))
+        else:
+            self.remove_pending(target)
+        self.results[target] = status
+        if self.on_result is not None:
+            self.on_result(target, status, latency, source)
+
+    def remove_pending(self, target):
+        requests = self.pending.get(get_destination(target))
+        if requests:
+            self.pending[get_destination(target)] = deque(request for request in requests if request[1] != target)
+
+    def check_timeouts(self, now):
+        for target, (sent_time, deadline) in list(self.outstanding.items()):
+            if now < deadline:
+                continue
+            if self.attempts[target] < self.max_attempts:
+                del self.outstanding[target]
+                self.busy.discard(get_destination(target))
+                retry_delay = min(self.max_backoff, self.backoff * 2 ** (self.attempts[target] - 1))
+                self.pending[get_destination(target)].append((now + retry_delay, target))
+            else:
+                self.finish(target, TIMED_OUT)
+
+    def send_requests(self, now):
+        for destination, requests in self.pending.items():
+            if len(self.outstanding) >= self.max_outstanding:
+                break
+            if destination in self.busy or not requests:
+                continue
+            # Take the first request that is ready. Retries wait for their backoff.
+            for index, (ready_time, target) in enumerate(requests):
+                if ready_time <= now:
+                    break
+            else:
+                continue
+            if destination != J1708_DESTINATION and not self.take_token(now):
+                continue
+            del requests[index]
+            self.attempts[target] += 1
+            self.sent_times[target].append(now)
+            self.outstanding[target] = (now, now + self.timeout_for(target, self.attempts[target]))
+            self.busy.add(destination)
+            self.sent_count += 1
+            try:
+                self.send_request(target, self.attempts[target])
+            except:
+                logger.debug(traceback.format_exc())
+        # Give the other destinations the first turn next time
+        if self.pending:
+            destination, requests = self.pending.popitem(last=False)
+            self.pending[destination] = requests
@@ -0,0 +1,110 @@
+"""
+Detached signatures for large files.
+
+The file is hashed in chunks and only a small manifest with its name, size
+and SHA-256 hash is signed, so the file is never held in memory. The
+signature is a clear signed PGP message saved next to the file with a .sig
+extension. Verifying hashes the file again in chunks and compares it with
+the signed manifest.
+"""
+import hashlib
+import json
+import os
+import traceback
+from collections import OrderedDict
+import pgpy
+
+import logging
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1 << 20
+SIGNATURE_EXTENSION = ".sig"
+
+def get_signature_filename(filename):
+    return filename + SIGNATURE_EXTENSION
+
+def hash_file(filename, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Returns (SHA-256 hex digest, size) for a file.
+    """
+    file_hash = hashlib.sha256()
+    size = 0
+    with open(filename, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(chunk_size), b''):
+            file_hash.update(chunk)
+            size += len(chunk)
+    return file_hash.hexdigest(), size
+
+def copy_and_hash(source, destination, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Copy a file in chunks and hash what was copied in the same pass. Returns
+    (SHA-256 hex digest, size) of the copy.
+    """
+    file_hash = hashlib.sha256()
+    size = 0
+    with open(source, 'rb') as in_file, open(destination, 'wb') as out_file:
+        for chunk in iter(lambda: in_file.read(chunk_size), b''):
+            file_hash.update(chunk)
+            out_file.write(chunk)
+            size += len(chunk)
+    return file_hash.hexdigest(), size
+
+def make_file_manifest(filename, digest, size):
+    return OrderedDict([("File Name", os.path.basename(filename)),
+                        ("Size", size),
+                        ("Hash Algorithm", "SHA256"),
+                        ("SHA256", digest)])
+
+def sign_manifest(filename, digest, size, private_key):
+    """
+    Sign the manifest for a file that has already been hashed and save the
+    signature next to it. Returns the signed message.
+    """
+    manifest = make_file_manifest(filename, digest, size)
+    signed_message = pgpy.PGPMessage.new(json.dumps(manifest, indent=4), cleartext=True)
+    signed_message |= private_key.sign(signed_message)
+    with open(get_signature_filename(filename), 'w') as signature_file:
+        signature_file.write(str(signed_message))
+    return signed_message
+
+def sign_file_detached(filename, private_key):
+    """
+    Hash a file in chunks and save a detached signature for it. Returns the
+    signed message.
+    """
+    digest, size = hash_file(filename)
+    return sign_manifest(filename, digest, size, private_key)
+
+def copy_and_sign(source, destination, private_key):
+    """
+    Copy a file that may still be growing, like a network log, and sign the
+    copy. Returns the signed message.
+    """
+    digest, size = copy_and_hash(source, destination)
+    return sign_manifest(destination, digest, size, private_key)
+
+def verify_file_detached(filename, key):
+    """
+    Check a file against its detached signature. Returns (verified, reason).
+    """
+    try:
+        signed_message = pgpy.PGPMessage.from_file(get_signature_filename(filename))
+        manifest = json.loads(signed_message.message)
+    except:
+        logger.debug(traceback.format_exc())
+        return False, "The signature file could not be read."
+    try:
+        verification = key.verify(signed_message)
+    except:
+        logger.debug(traceback.format_exc())
+        return False, "There was an issue with verifying the signature."
+    if not any(verified for verified, by, signature, subject in verification.good_signatures):
+        return False, "There were no good signatures found."
+    try:
+        digest, size = hash_file(filename)
+    except OSError:
+        logger.debug(traceback.format_exc())
+        return False, "The file could not be read."
+    if size != manifest.get("Size") or digest != manifest.get("SHA256"):
+        return False, "The file does not match the signed hash."
+    return True, "The file matches the signed hash."
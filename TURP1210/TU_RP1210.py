@@ -81,17 +81,29 @@ import humanize
 import random
 import os
 import threading
+from collections import OrderedDict
 
 from TURP1210.RP1210.RP1210 import *
 from TURP1210.RP1210.RP1210Functions import *
 from TURP1210.RP1210.RP1210Select import *
 from TURP1210.GPSInterface import *
+from TURP1210.J1939State import *
 from TURP1210.J1939Tab import *
 from TURP1210.J1587Tab import *
 from TURP1210.ComponentInfoTab import *
 from TURP1210.UserData import *
 from TURP1210.PDFReports import *
+from TURP1210.CaptureReplay import *
+from TURP1210.IncrementalStore import *
+from TURP1210.StreamSigning import *
+from TURP1210.SaveWorker import *
+from TURP1210.DataPackageEncoder import *
+from TURP1210.ScanScheduler import *
+from TURP1210.LatencyTracker import *
+from TURP1210.ScanCoverage import *
+from TURP1210.J1939Transport import *
 from TURP1210.ISO15765 import *
+from TURP1210.CompiledDatabase import *
 from TURP1210.Graphing.graphing import * 
 
 import logging
@@ -151,34 +163,31 @@ class TU_RP1210(QMainWindow):
         progress_label = QLabel("Loading the J1939 Database")
         #load the J1939 Database
         progress.setLabel(progress_label)
+        database_cache = get_storage_path(title)
         try:
-            with open("J1939db.json",'r') as j1939_file:
-                self.j1939db = json.load(j1939_file) 
-        except FileNotFoundError:
-            try:
-                with open(os.path.join(module_directory,"J1939db.json"),'r') as j1939_file:
-                    self.j1939db = json.load(j1939_file) 
-            except FileNotFoundError: 
-                # Make a data structure to do something anyways
-                logger.debug("J1939db.json file was not found.")
-                self.j1939db = {"J1939BitDecodings":{},
-                                "J1939FMITabledb": {},
-                            "J1939LampFlashTabledb": {},
-                            "J1939OBDTabledb": {},
-                            "J1939PGNdb": {},
-                            "J1939SAHWTabledb": {},
-                            "J1939SATabledb": {},
-                            "J1939SPNdb": {} }
+            # A J1939db.json in the working directory is used before the one in the package
+            self.j1939db = load_database(["J1939db.json", os.path.join(module_directory,"J1939db.json")], database_cache)
+        except FileNotFoundError: 
+            # Make a data structure to do something anyways
+            logger.debug("J1939db.json file was not found.")
+            self.j1939db = {"J1939BitDecodings":{},
+                            "J1939FMITabledb": {},
+                        "J1939LampFlashTabledb": {},
+                        "J1939OBDTabledb": {},
+                        "J1939PGNdb": {},
+                        "J1939SAHWTabledb": {},
+                        "J1939SATabledb": {},
+                        "J1939SPNdb": {} }
         logger.info("Done Loading J1939db")
         progress.setValue(1)
         QCoreApplication.processEvents()
 
-        self.rx_queues = {}
+        self.rx_buffers = {}
+        self.rx_readers = {}
 
         progress_label.setText("Loading the J1587 Database")
         try:
-            with open(os.path.join(module_directory,"J1587db.json"),'r') as j1587_file:
-                self.j1587db = json.load(j1587_file)
+            self.j1587db = load_database(os.path.join(module_directory,"J1587db.json"), database_cache)
         except FileNotFoundError:
             logger.debug("J1587db.json file was not found.")
             self.j1587db = { "FMI": {},
@@ -234,17 +243,37 @@ class TU_RP1210(QMainWindow):
         os.system("TASKKILL /F /IM DGServer1.exe")  
         
         self.update_rate = 200
+        self.read_batch_size = 1000 # Records read from a ring buffer between checks of the time
+        self.adapter_batch_size = None # Set to a number to drain the adapter with non-blocking batch reads
 
         self.module_directory = module_directory
         
         self.user_data = UserData(self.title)
 
         self.isodriver = None
+        self.replay = None
+        self.backup_store = None
+        self.backup_worker = None
+        self.save_worker = None
+        self.save_finished = None
+        self.replay_timer = None
 
         self.source_addresses=[]
         self.long_pgn_timeouts = [65227, ]
         self.long_pgn_timeout_value = 2
         self.short_pgn_timeout_value = .1
+        self.j1587_timeout_value = .5
+        self.j1587_tool_mids = [0xac, 0xb6]
+        self.scan_passes = 5 # Most passes. The scan stops when a pass covers nothing new.
+        self.scan_max_outstanding = 8 # Requests in flight to different addresses
+        self.scan_max_attempts = 2 # Tries for each request in a pass
+        self.scan_max_bus_load = 0.05 # Share of the CAN bus used for requests
+        self.latency_tracker = LatencyTracker(os.path.join(get_storage_path(self.title), LATENCY_FILE))
+        self.scan_coverage = None
+        # Reassemble the multi-packet J1939 messages from the raw CAN traffic too,
+        # for adapters that drop some of them when the bus is busy.
+        self.reassemble_can_transport = False
+        self.can_transport = J1939TransportProtocol()
 
         self.export_path =  os.path.join(winshell.my_documents(), __name__)
         if not os.path.isdir(self.export_path):
@@ -328,6 +357,12 @@ class TU_RP1210(QMainWindow):
         open_file.triggered.connect(self.open_file)
         file_menu.addAction(open_file)
 
+        replay_action = QAction(QIcon(os.path.join(module_directory,r'icons/icons8_Open_48px_1.png')), '&Replay Capture Files', self)
+        replay_action.setShortcut('Ctrl+R')
+        replay_action.setStatusTip('Decode network traffic recorded in capture files.')
+        replay_action.triggered.connect(self.open_capture_files)
+        file_menu.addAction(replay_action)
+
         save_file = QAction(QIcon(os.path.join(module_directory,r'icons/icons8_Save_48px.png')), '&Save', self)
         save_file.setShortcut('Ctrl+S')
         save_file.setStatusTip('Save the current data file.')
@@ -668,13 +703,13 @@ class TU_RP1210(QMainWindow):
                                             "patch":TU_RP1210_version["minor"]}}
         
         try:
-            self.CAN_file_name = logging_dictionary['handlers']["can_handler"]["filename"]
+            self.CAN_file_name = get_capture_filename(get_storage_path(self.title), "CAN")
         except:
             logger.debug(traceback.format_exc())
             self.CAN_file_name = "No file available"
 
         try:
-            self.J1708_log_name = logging_dictionary['handlers']["j1708_handler"]["filename"]
+            self.J1708_log_name = get_capture_filename(get_storage_path(self.title), "J1708")
         except:
             logger.debug(traceback.format_exc())
             self.J1708_log_name = "No file available"
@@ -712,6 +747,7 @@ class TU_RP1210(QMainWindow):
         self.data_package["Distance Information"] = {}
         self.data_package["ECU Time Information"] = {}
         self.data_package["Event Data"] = {}
+        self.data_package["Scan Coverage"] = {}
         self.data_package["GPS Data"] = {
             "Altitude": 0.0,
             "GPS Time": None,
@@ -746,6 +782,7 @@ class TU_RP1210(QMainWindow):
     #     l.addHandler(streamHandler)    
 
     def upload_data_package(self):
+        self.J1939.update_data_package()
         returned_message = self.user_data.upload_data(self.data_package)
         logger.debug("returned_message:")
         logger.debug(returned_message)
@@ -849,19 +886,9 @@ class TU_RP1210(QMainWindow):
         """
         Reload and refresh the data tables.
         """
-        self.J1939.pgn_data_model.aboutToUpdate()
-        self.J1939.j1939_unique_ids = self.data_package["J1939 Parameter Group Numbers"]
-        self.J1939.pgn_data_model.setDataDict(self.J1939.j1939_unique_ids)
-        self.J1939.pgn_data_model.signalUpdate()
+        self.J1939.load_data_package(self.data_package)
         #TODO: Add the row and column resizers like the one for UDS.
 
-        self.J1939.pgn_rows = list(self.J1939.j1939_unique_ids.keys())
-        
-        self.J1939.spn_data_model.aboutToUpdate()
-        self.J1939.unique_spns = self.data_package["J1939 Suspect Parameter Numbers"]
-        self.J1939.spn_data_model.setDataDict(self.J1939.unique_spns)
-        self.J1939.spn_data_model.signalUpdate()
-
         self.J1939.dm01_data_model.aboutToUpdate()
         self.J1939.active_trouble_codes = self.data_package["Diagnostic Codes"]["DM01"]
         self.J1939.dm01_data_model.setDataDict(self.J1939.active_trouble_codes)
@@ -891,40 +918,110 @@ class TU_RP1210(QMainWindow):
     def plot_decrypted_data(self):
         pass
 
-    def save_file(self, backup=False):
+    def save_file(self, backup=False, pdf=False, pretty_json=False):
         """
         Save the file as a CPT (short for TruckCRYPT) file to the
-        current path. 
+        current path. With pretty_json set, the json file next to it is
+        written indented for reading instead of the signed compact text.
+        Backups only append the changes since the last backup to an
+        IncrementalStore next to the file.
+
+        The data package is copied and the signing, log copies and PDF report
+        are done by a SaveWorker, so the receive buffers keep being read while
+        saving. Returns the worker.
         """
-
-        #update the data package
-        progress = QProgressDialog(self)
-        progress.setMinimumWidth(600)
-        progress.setWindowTitle("Saving and Digitally Signing Files")
-        progress.setMinimumDuration(0)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.setMaximum(4)
-        
         if backup:
-            temp_name = os.path.basename(self.filename)
-            temp_name.strip("Backup_")
-            backup_name = "Backup_{}".format(temp_name)
-            filename = os.path.normpath(os.path.join(self.export_path, backup_name))
-        else:
-            filename = os.path.normpath(os.path.join(self.export_path, self.filename))
-            self.data_package["File Name"] = self.filename
-
-        progress_label = QLabel("Saving and signing {} file to {}".format(self.title,filename))
-        progress.setLabel(progress_label)
+            return self.save_backup_store()
+        if self.save_worker is not None and self.save_worker.is_alive():
+            self.statusBar().showMessage("The last save has not finished yet.")
+            return None
 
-        saved_pgp_message = self.user_data.make_pgp_message(self.data_package)
+        filename = os.path.normpath(os.path.join(self.export_path, self.filename))
+        self.data_package["File Name"] = self.filename
+        self.J1939.update_data_package()
+        self.flush_captures()
+        snapshot = snapshot_data_package(self.data_package)
+
+        worker = SaveWorker("Saving and Digitally Signing Files")
+        worker.add_step("Data File", 
+                        "Saving and signing {} file to {}".format(self.title,filename),
+                        self.write_data_file, snapshot, filename, pretty_json)
+        log_files = self.get_log_files()
+        worker.add_step("CAN Log File", "Saving and signing CAN logs.",
+                        self.sign_support_file, log_files["CAN Log File"], " CAN Log", filename)
+        worker.add_step("J1708 Log File", "Saving and signing J1708 logs.",
+                        self.sign_support_file, log_files["J1708 Log File"], " J1708 Log", filename)
+        worker.add_step("Session Log File", "Saving and signing session debug logs.",
+                        self.sign_support_file, log_files["Session Log File"], " Session Log", filename)
+        if pdf:
+            worker.add_step("PDF", "Generating PDF Report",
+                            self.render_pdf, worker, filename[:-3]+'pdf')
+        self.start_save_worker(worker)
+        return worker
+
+    def write_data_file(self, data_package, filename, pretty_json=False):
+        """
+        Sign the data package and write the cpt and json files. This runs
+        in the SaveWorker.
+        """
+        saved_pgp_message = self.user_data.make_pgp_message(data_package)
         with open(filename,'w') as file_out:
             file_out.write(str(saved_pgp_message))
 
-        if not backup:
-            with open(filename[:-3] + 'json', 'w') as outfile:
+        with open(filename[:-3] + 'json', 'w') as outfile:
+            if pretty_json:
+                outfile.write(pretty_dumps(data_package))
+            else:
                 outfile.write(saved_pgp_message.message)
-            msg = "Saved signed file to {}".format(filename)
+        return saved_pgp_message
+
+    def render_pdf(self, worker, pdf_filename):
+        return self.pdf_engine.go(worker.results["Data File"], pdf_filename)
+
+    def start_save_worker(self, worker, finished=None):
+        """
+        Start the worker and follow it with a progress dialog. finished is
+        called with the worker when it is done.
+        """
+        self.save_worker = worker
+        self.save_finished = finished
+        self.save_progress = QProgressDialog(self)
+        self.save_progress.setMinimumWidth(600)
+        self.save_progress.setWindowTitle(worker.title)
+        self.save_progress.setMinimumDuration(0)
+        self.save_progress.setWindowModality(Qt.WindowModal)
+        self.save_progress.setMaximum(worker.step_count)
+        self.save_progress.setLabel(QLabel(""))
+        # Not a daemon, so quitting waits for the files to be written
+        worker.start()
+        self.save_timer = QTimer(self)
+        self.save_timer.timeout.connect(self.check_save_worker)
+        self.save_timer.start(100) #milliseconds
+
+    def check_save_worker(self):
+        step, label = self.save_worker.get_progress()
+        if self.save_progress.wasCanceled():
+            self.save_worker.cancel()
+        else:
+            self.save_progress.setLabelText(label)
+            self.save_progress.setValue(step)
+        if self.save_worker.is_alive():
+            return
+        self.save_timer.stop()
+        self.save_progress.close()
+        self.finish_save(self.save_worker)
+        if self.save_finished is not None:
+            self.save_finished(self.save_worker)
+
+    def finish_save(self, worker):
+        """
+        Put the results of the worker into the live data package.
+        """
+        for key_name in self.get_log_files():
+            if key_name in worker.results:
+                self.data_package["Network Logs"][key_name].update(worker.results[key_name])
+        if "Data File" in worker.results:
+            msg = "Saved signed file to {}".format(os.path.join(self.export_path, self.filename))
             logger.info(msg)
             self.filename = os.path.basename(self.filename)
             self.setWindowTitle('{} {}.{} - {}'.format(self.title,
@@ -932,66 +1029,83 @@ class TU_RP1210(QMainWindow):
                                                        TU_RP1210_version["minor"],
                                                        self.filename))
             self.statusBar().showMessage(msg)
-        progress.setValue(1)
-        
-        #CAN Logs
-        progress_label.setText("Saving and signing CAN logs.")
-        QCoreApplication.processEvents()
-        self.sign_and_save_support_files(logging_dictionary["handlers"]["can_handler"]["filename"],
-                                             " CAN Log", 
-                                             "CAN Log File")
-        progress.setValue(2)
-        
-        progress_label.setText("Saving and signing J1708 logs.")
-        QCoreApplication.processEvents()
-        self.sign_and_save_support_files(logging_dictionary["handlers"]["j1708_handler"]["filename"],
-                                             " J1708 Log", 
-                                             "J1708 Log File")
-        progress.setValue(3)
-        
-        
-        # Session Logs
-        progress_label.setText("Saving and signing session debug logs.")
-        QCoreApplication.processEvents()
-        self.sign_and_save_support_files(logging_dictionary["handlers"]["file_handler"]["filename"],
-                                         " Session Log", 
-                                         "Session Log File")
-        progress.setValue(4)
-        progress_label.setText("Done with saving and signing all the user files.")
-        QCoreApplication.processEvents()
-        
+        if worker.error is not None:
+            QMessageBox.warning(self, "File Saving Error", worker.error)
+        elif worker.cancelled:
+            self.statusBar().showMessage("Saving was cancelled.")
         self.Components.rebuild_trees()
-        return saved_pgp_message
     
-    def sign_and_save_support_files(self, support_filename, suffix, key_name):
+    def get_log_files(self):
+        """
+        The log files saved with the data package, by their Network Logs name.
+        """
+        return OrderedDict([("CAN Log File", get_capture_filename(get_storage_path(self.title), "CAN")),
+                            ("J1708 Log File", get_capture_filename(get_storage_path(self.title), "J1708")),
+                            ("Session Log File", logging_dictionary["handlers"]["file_handler"]["filename"])])
+
+    def save_backup_store(self):
+        """
+        Append the changed parts of the data package and the new log data
+        to the backup store. The store is written by a SaveWorker without a
+        progress dialog, so backups don't interrupt the user. Returns the
+        worker, or None if the last backup is still being written.
+        """
+        if self.backup_worker is not None:
+            if self.backup_worker.is_alive():
+                logger.debug("The last backup has not finished yet.")
+                return None
+            if self.backup_worker.error is not None:
+                self.statusBar().showMessage(self.backup_worker.error)
+        backup_name = "Backup_{}".format(os.path.basename(self.filename))
+        store_path = get_store_path(os.path.normpath(os.path.join(self.export_path, backup_name)))
+        self.J1939.update_data_package()
+        self.flush_captures()
+        snapshot = snapshot_data_package(self.data_package)
+
+        worker = SaveWorker("Saving a Backup")
+        worker.add_step("Backup", "Appending the changes to {}".format(store_path),
+                        self.write_backup_store, snapshot, store_path, self.get_log_files())
+        # Not a daemon, so quitting waits for the store to be written
+        worker.start()
+        self.backup_worker = worker
+        return worker
+
+    def write_backup_store(self, data_package, store_path, log_files):
+        """
+        Append to the backup store. This runs in the SaveWorker.
+        """
+        if self.backup_store is None or self.backup_store.path != store_path:
+            self.backup_store = IncrementalStore(store_path, sign=self.user_data.make_pgp_message)
+        return self.backup_store.save(data_package, log_files)
+
+    def flush_captures(self):
+        """
+        Write the buffered network traffic out to the capture files.
+        """
+        for read_message_thread in self.read_message_threads.values():
+            read_message_thread.flush_capture()
+
+    def sign_support_file(self, support_filename, suffix, filename):
         """
         A routine to use PGP signing on all the supporting files for the cpt file. This
-        includes CAN Logs, J1708 Logs, and Session logs.
+        includes CAN Logs, J1708 Logs, and Session logs. The log is copied next to
+        the cpt file and the copy gets a detached signature of its hash, so the
+        log is never loaded into memory.
+
+        Returns the entry for the Network Logs in the data package.
         """
-        filename = os.path.normpath(os.path.join(self.export_path, self.filename))
+        new_file_name = filename[:-4] + suffix + os.path.splitext(support_filename)[1]
         try:
-            
-            with open(support_filename,'rb') as can_file:
-                file_contents = can_file.read()
-            pgp_message = self.user_data.make_pgp_message({suffix: base64.b64encode(file_contents).decode('ascii','strict')})
-            if pgp_message.is_signed:
+            if self.user_data.private_key is not None:
+                pgp_message = copy_and_sign(support_filename, new_file_name, self.user_data.private_key)
                 can_signature = ", ".join([str(s) for s in pgp_message.signatures])
                 can_signer = ", ".join(pgp_message.signers)
-                if ", ".join(pgp_message.signers) == can_signer:
-                    can_signer += " ({})".format(self.user_data.private_key.userids[0])
-                else:
-                    can_signer += " (Unknown ID)"
+                can_signer += " ({})".format(self.user_data.private_key.userids[0])
                 logger.info("PGP Message Signers are {}".format(can_signer))
             else:
+                copy_and_hash(support_filename, new_file_name)
                 can_signature = "No Signature Information Available"
                 can_signer = None
-            new_file_name = filename[:-4] + suffix +".pgp"
-            if support_filename[-4:] == 'json':
-                shutil.copy(support_filename, new_file_name[:-3]+support_filename[-4:])
-            else:
-                shutil.copy(support_filename, new_file_name[:-3]+support_filename[-3:])
-            with open(new_file_name,'w') as file_out:
-                file_out.write(str(pgp_message))
             can_file_size = humanize.naturalsize(os.path.getsize(new_file_name), binary=True)
             logger.debug("Saved{} with a size of {}".format(suffix,can_file_size))
         except:
@@ -1000,12 +1114,14 @@ class TU_RP1210(QMainWindow):
             can_signer = "Not Signed"
             can_file_size = None
 
-        
-        self.data_package["Network Logs"][key_name]["Name"] = new_file_name
-        self.data_package["Network Logs"][key_name]["Size"] = can_file_size
-        self.data_package["Network Logs"][key_name]["Signature"] = can_signature
-        self.data_package["Network Logs"][key_name]["Signer"] = can_signer
+        return {"Name": new_file_name,
+                "Size": can_file_size,
+                "Signature": can_signature,
+                "Signer": can_signer}
 
+    def sign_and_save_support_files(self, support_filename, suffix, key_name):
+        filename = os.path.normpath(os.path.join(self.export_path, self.filename))
+        self.data_package["Network Logs"][key_name].update(self.sign_support_file(support_filename, suffix, filename))
 
     def save_file_as(self):
         filters = "{} Data Files (*.cpt);;All Files (*.*)".format(self.title)
@@ -1024,34 +1140,21 @@ class TU_RP1210(QMainWindow):
             return self.save_file()
     
     def export_to_pdf(self):
-        
-        progress = QProgressDialog(self)
-        progress.setMinimumWidth(600)
-        progress.setWindowTitle("Generating PDF Report")
-        progress.setMinimumDuration(0)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.setMaximum(2)
-
         logger.debug("Export to PDF Selected.")
-        data_message = self.save_file()
-        fname = os.path.join(self.export_path, self.filename)
-        progress.setValue(1)
-        QCoreApplication.processEvents()
-        try:
+        worker = self.save_file(pdf=True)
+        if worker is not None:
+            self.save_finished = self.finish_pdf_export
 
-            ret = self.pdf_engine.go(data_message, fname[:-3]+'pdf')
-        except:
-            logger.warning(traceback.format_exc())
-            ret = "Error"
+    def finish_pdf_export(self, worker):
+        ret = worker.results.get("PDF", "Error")
         logger.info("PDF Export returned {}".format(ret))
-        progress.setValue(2)
         if ret == "Success":
             try:
                 os.startfile(os.path.join(self.export_path, self.filename[:-3]+'pdf'), 'open')
             except:
                 logger.debug(traceback.format_exc())
                 QMessageBox.information(self,"PDF Generation","Successfully exported PDF file to {} in\n{}".format(self.filename[:-3]+'pdf', self.export_path))
-        else:
+        elif not worker.cancelled:
             QMessageBox.warning(self,"PDF Generation","There was an issue generating the PDF: {}".format(ret))
         
         del self.pdf_engine    
@@ -1059,18 +1162,19 @@ class TU_RP1210(QMainWindow):
         
     def export_to_json(self):
         logger.debug("Export to JSON Selected.")
-        self.save_file() 
-        try:
-            filename = os.path.join(self.export_path,self.filename)
-            with open(filename[:-3] + 'json', 'w') as outfile:
-                json.dump(self.data_package, outfile, indent=4, sort_keys=True)
+        worker = self.save_file(pretty_json=True)
+        if worker is not None:
+            self.save_finished = self.finish_json_export
+
+    def finish_json_export(self, worker):
+        filename = os.path.join(self.export_path,self.filename)
+        if "Data File" in worker.results:
             info = "Successfully exported JSON file from {}".format(filename)
             QMessageBox.information(self,"Export Successful",info)
             logger.info(info)
-        except:
-            logger.debug(traceback.format_exc())
+        elif not worker.cancelled:
             QMessageBox.warning(self,"JSON Export Error","There was an error exporting the JSON format from {}".format(filename))
-        
+
 
     def confirm_quit(self):
         self.close()
@@ -1082,6 +1186,9 @@ class TU_RP1210(QMainWindow):
             QMessageBox.Yes)
         if result == QMessageBox.Yes:
             logger.debug("Quitting.")
+            if self.save_worker is not None and self.save_worker.is_alive():
+                logger.info("Waiting for the save to finish.")
+                self.save_worker.join()
             event.accept()
         else:
             event.ignore()
@@ -1098,6 +1205,21 @@ class TU_RP1210(QMainWindow):
     def save_j1939_csv(self):
         logger.debug("Save J1939 Log to Comma Separated Values Table")
 
+    def get_simulator(self, data_file):
+        """
+        Make a simulated adapter that replays the data package in data_file,
+        or makes up traffic when there is no file.
+        """
+        data_package = None
+        if data_file:
+            try:
+                data_package = load_data_package_file(data_file)
+                logger.info("Simulating the data package in {}".format(data_file))
+            except Exception:
+                logger.debug(traceback.format_exc())
+                QMessageBox.warning(self,"Simulator","The data package in {} could not be loaded. The simulator will make up traffic instead.".format(data_file))
+        return RP1210Simulator(data_package)
+
     def selectRP1210(self, automatic=False):
         logger.debug("Select RP1210 function called.")
         selection = SelectRP1210(self.title)
@@ -1133,7 +1255,10 @@ class TU_RP1210(QMainWindow):
         progress.setMaximum(6)
       
         # Once an RP1210 DLL is selected, we can connect to it using the RP1210 helper file.
-        self.RP1210 = RP1210Class(dll_name)
+        if dll_name == SIMULATOR_NAME:
+            self.RP1210 = RP1210Class(dll_name, backend=self.get_simulator(selection.simulator_data_file))
+        else:
+            self.RP1210 = RP1210Class(dll_name)
     
         if self.RP1210_toolbar is None:
             self.setup_RP1210_menus()
@@ -1155,12 +1280,14 @@ class TU_RP1210(QMainWindow):
         file_contents={ "dll_name":dll_name,
                         "protocol":protocol,
                         "deviceID":deviceID,
-                        "speed":speed
+                        "speed":speed,
+                        "simulator_data_file":selection.simulator_data_file
                        }
         with open(selection.connections_file,"w") as rp1210_file:
             json.dump(file_contents, rp1210_file)
 
-        self.rx_queues={}
+        self.rx_buffers = {}
+        self.rx_readers = {}
         self.read_message_threads={}
         self.extra_queues = {}
         # Set all filters to pass.  This allows messages to be read.
@@ -1183,15 +1310,18 @@ class TU_RP1210(QMainWindow):
                                                        None, 0)
                 if return_value == 0:
                     logger.debug("RP1210_Set_All_Filters_States_to_Pass for {} is successful.".format(protocol))
-                    #setup a Receive queue. This keeps the GUI responsive and enables messages to be received.
-                    self.rx_queues[protocol] = queue.Queue(10000)
+                    #setup a Receive buffer. This keeps the GUI responsive and enables messages to be received.
+                    self.rx_buffers[protocol] = RP1210RingBuffer()
+                    self.rx_readers[protocol] = self.rx_buffers[protocol].reader()
                     self.extra_queues[protocol] = queue.Queue(10000)
                     self.read_message_threads[protocol] = RP1210ReadMessageThread(self, 
-                                                                                  self.rx_queues[protocol],
+                                                                                  self.rx_buffers[protocol],
                                                                                   self.extra_queues[protocol],
                                                                                   self.RP1210.ReadMessage, 
                                                                                   nClientID,
-                                                                                  protocol, self.title)
+                                                                                  protocol,
+                                                                                  get_storage_path(self.title),
+                                                                                  batch_size=self.adapter_batch_size)
                     self.read_message_threads[protocol].setDaemon(True) #needed to close the thread when the application closes.
                     self.read_message_threads[protocol].start()
                     logger.debug("Started RP1210ReadMessage Thread.")
@@ -1199,6 +1329,7 @@ class TU_RP1210(QMainWindow):
                     self.statusBar().showMessage("{} connected using {}".format(protocol,dll_name))
                     if protocol == "J1939":
                         self.isodriver = ISO15765Driver(self, self.extra_queues["J1939"])
+                        self.J1939.start_decode_thread(self.rx_buffers["J1939"].reader())
                     
                 else :
                     logger.debug('RP1210_Set_All_Filters_States_to_Pass returns {:d}: {}'.format(return_value,self.RP1210.get_error_code(return_value)))
@@ -1381,7 +1512,9 @@ class TU_RP1210(QMainWindow):
     def start_scan(self):
         """
         Perform a scan of the vehicle network by sending a series of request messages over the
-        different vehicle networks. The requests are randomized.
+        different vehicle networks. The requests are randomized and a ScanScheduler keeps
+        several of them in flight. Each pass only asks for what has not been answered
+        yet, and the scan stops when a pass covers nothing new.
         """
         if not self.check_connections():
             logger.info("No Vehicle Network Traffic Detected.")
@@ -1416,8 +1549,9 @@ class TU_RP1210(QMainWindow):
             logger.debug("PC Time = {}, GPS time = {}, PC - GPS = {:02f} seconds".format(self.extraction_time_pc, 
                 self.extraction_time_gps, self.extraction_time_pc - self.extraction_time_gps))
 
-            passes = 5
-            total_requests = passes * (len(self.J1939.j1939_request_pgns) * len(self.source_addresses) + 33) #for ISO
+            passes = self.scan_passes
+            total_requests = passes * (len(self.J1939.j1939_request_pgns) * len(self.source_addresses) + 
+                                       len(self.J1587.j1587_request_pids) + 33) #for ISO
 
             progress = QProgressDialog(self)
             progress.setMinimumWidth(600)
@@ -1432,66 +1566,40 @@ class TU_RP1210(QMainWindow):
             request_count = int(0.021*total_requests)
             progress.setValue(request_count)
             
-            
-
             self.J1587.j1587_request_pids.sort(reverse=True)
 
-            j1587_tool_mids = [0xac, 0xb6]
+            self.scan_coverage = ScanCoverage()
+            scheduler = self.make_scan_scheduler()
             for request_pass in range(passes):
+                random.shuffle(self.source_addresses)
+                targets = [("J1939", pgn, address) for pgn in self.J1939.j1939_request_pgns for address in self.source_addresses]
+                targets += [("J1587", pid) for pid in self.J1587.j1587_request_pids]
+                targets = self.scan_coverage.get_remaining(targets)
+                if not targets or self.scan_coverage.converged(targets):
+                    logger.info("Scan coverage converged after {} passes.".format(request_pass))
+                    break
                 self.get_iso_parameters()
-                j1587_parameter_count = 0
-                logger.info("Starting Pass {}".format(request_pass))
-                for pgn in self.J1939.j1939_request_pgns:
-                    if pgn in self.long_pgn_timeouts:  
-                        self.request_timeout = self.long_pgn_timeout_value
-                    else:
-                        self.request_timeout = self.short_pgn_timeout_value
-                    logger.debug("Sending J1939 request for PGN {}".format(pgn))
-                    progress.setValue(request_count)
-                    try:
-                        pgn_name = self.J1939.j1939db["J1939PGNdb"]["{}".format(pgn)]["Name"]
-                    except:
-                        pgn_name= ""
-                    progress_label.setText("Pass {}: Requesting PGN {} - {}".format(request_pass+1, pgn, pgn_name))
-                    
-                    random.shuffle(self.source_addresses)
-                    for address in self.source_addresses:
-                        request_count += 1
-                        # Send the request for a PGN onto the J1939 Network
-                        # and wait for a response
-                        start_time = time.time()
-                        self.send_j1939_request(pgn, DA=address)
-                        while (not progress.wasCanceled() and
-                               time.time() - start_time < self.request_timeout and 
-                               not self.find_j1939_data(pgn, sa=address)):
-                            time.sleep(.1)
-                            # Send out the request 3 times
-                            QApplication.processEvents() 
-                            #time.sleep(.01) # do nothing while we wait. 
-
-                        if progress.wasCanceled():
-                            logger.info("Network scan stopped by user.")
-                            progress.deleteLater()
-                            self.start_oem_scan()
-                            return
-                    self.Components.rebuild_trees()
-
-                    #J1587
-                    tool = j1587_tool_mids[request_pass % 2] #Switch between requesting tool MIDs
-                    j1587_parameter_count += 1
-                    try:
-                        pid = self.J1587.j1587_request_pids[j1587_parameter_count]
-                        if pid < 255:
-                            j1587_request = bytes([0x03, tool, 0, pid])
-                        else:
-                            j1587_request = bytes([0x04, tool, 0, 255, pid % 256])
-                        self.RP1210.send_message(self.client_ids["J1708"], j1587_request)
-                        logger.debug("Sent J1587 request for PID {}".format(pid))   
-                    except IndexError:
-                        pass   
+                request_count += 33
+                logger.info("Starting Pass {} with {} requests".format(request_pass, len(targets)))
+                progress_label.setText("Pass {}: Requesting {} J1939 PGNs and J1587 PIDs".format(request_pass+1, len(targets)))
+                self.scan_coverage.start_pass(targets)
+                scheduler.add_targets(targets)
+                finished = self.run_scan_scheduler(scheduler, progress, request_count)
+                self.scan_coverage.record_skipped(scheduler.skipped)
+                self.scan_coverage.end_pass()
+                if not finished:
+                    logger.info("Network scan stopped by user.")
+                    self.update_scan_coverage()
+                    progress.deleteLater()
+                    self.start_oem_scan()
+                    return
+                request_count += len(targets)
+                self.Components.rebuild_trees()
 
                 random.shuffle(self.J1939.j1939_request_pgns)
                 random.shuffle(self.J1587.j1587_request_pids) 
+            logger.info("Sent {} requests for {} targets.".format(scheduler.sent_count, scheduler.target_count))
+            self.update_scan_coverage()
             
             progress.deleteLater()
             logger.info("Finished with Standards Based Data Extraction.")
@@ -1501,6 +1609,101 @@ class TU_RP1210(QMainWindow):
     def start_oem_scan(self):
         #override this function 
         pass
+
+    def make_scan_scheduler(self, max_attempts=None):
+        if max_attempts is None:
+            max_attempts = self.scan_max_attempts
+        self.latency_tracker.set_profile(self.get_vehicle_profile())
+        scheduler = ScanScheduler(self.send_scan_request,
+                                  get_timeout=self.get_scan_timeout,
+                                  skip_target=self.latency_tracker.should_skip,
+                                  max_outstanding=self.scan_max_outstanding,
+                                  max_attempts=max_attempts,
+                                  max_bus_load=self.scan_max_bus_load)
+        scheduler.on_result = self.record_scan_result
+        return scheduler
+
+    def record_scan_result(self, target, status, latency=None, source=None):
+        self.latency_tracker.record(target, status, latency, source)
+        if self.scan_coverage is not None:
+            self.scan_coverage.record(target, status, latency, source)
+
+    def update_scan_coverage(self):
+        '''
+        Put what the scan covered and what it missed in the data package.
+        '''
+        if self.scan_coverage is None:
+            return
+        self.data_package["Scan Coverage"] = self.scan_coverage.to_data_package(pgn_label=self.J1939.get_pgn_label,
+                                                                                sa_name=self.J1939.get_sa_name,
+                                                                                pid_name=self.J1587.get_pid_name)
+        results = self.data_package["Scan Coverage"]["Results"]
+        logger.info("Scan coverage: {}".format(", ".join("{} {}".format(count, status) for status, count in results.items())))
+
+    def get_vehicle_profile(self):
+        '''
+        Name the vehicle for the latency tracker by its VIN, or by its source
+        addresses when no VIN has been seen yet.
+        '''
+        for source, values in sorted(self.data_package["Component Information"].items()):
+            try:
+                vin = values["VIN"].strip("* \x00")
+            except (KeyError, AttributeError, TypeError):
+                continue
+            if vin:
+                return vin
+        return "SA " + ",".join("{}".format(sa) for sa in sorted(self.source_addresses))
+
+    def get_scan_timeout(self, target, attempt=1):
+        # The fixed timeouts are used until a target has answered
+        if target[0] == "J1587":
+            default = self.j1587_timeout_value
+        elif target[1] in self.long_pgn_timeouts:
+            default = self.long_pgn_timeout_value
+        else:
+            default = self.short_pgn_timeout_value
+        return self.latency_tracker.get_timeout(target, attempt, default)
+
+    def send_scan_request(self, target, attempt):
+        if target[0] == "J1939":
+            logger.debug("Sending J1939 request for PGN {} to {}".format(target[1], target[2]))
+            self.send_j1939_request(target[1], DA=target[2])
+        elif self.client_ids["J1708"] is not None:
+            pid = target[1]
+            tool = self.j1587_tool_mids[attempt % 2] #Switch between requesting tool MIDs
+            if pid < 255:
+                j1587_request = bytes([0x03, tool, 0, pid])
+            else:
+                j1587_request = bytes([0x04, tool, 0, 255, pid % 256])
+            self.RP1210.send_message(self.client_ids["J1708"], j1587_request)
+            logger.debug("Sent J1587 request for PID {}".format(pid))
+
+    def run_scan_scheduler(self, scheduler, progress=None, progress_start=0):
+        '''
+        Run the scheduler until all of its requests are answered or timed out while
+        the GUI keeps processing the network messages. Returns False if the scan
+        was cancelled.
+        '''
+        pgns = set(target[1] for requests in scheduler.pending.values() for ready_time, target in requests if target[0] == "J1939")
+        self.J1939.processor.watch_responses(scheduler.response_queue, pgns | set([ACKNOWLEDGEMENT_PGN]))
+        self.J1587.response_queue = scheduler.response_queue
+        completed_before = scheduler.completed_count
+        try:
+            while not scheduler.step():
+                if progress is not None:
+                    if progress.wasCanceled():
+                        scheduler.cancel()
+                        return False
+                    progress.setValue(progress_start + scheduler.completed_count - completed_before)
+                QApplication.processEvents()
+                time.sleep(.01)
+        finally:
+            self.J1939.processor.stop_watching()
+            self.J1587.response_queue = None
+            self.latency_tracker.save()
+        if scheduler.skipped:
+            logger.info("Skipped {} requests that have never been answered.".format(len(scheduler.skipped)))
+        return True
   
     def copy_and_sign_files(self, additional_files=[]):
         
@@ -1509,7 +1712,7 @@ class TU_RP1210(QMainWindow):
         with open(os.path.join(self.export_path,'PGPpublicKeyFile.txt'), 'w') as outfile:
             outfile.write(str(self.user_data.private_key.pubkey))
         with open(os.path.join(self.export_path,'README.txt'), 'w') as outfile:
-            outfile.write("The files in this directory ending in pgp are signed PGPmessage files that have contain the original data. The files can be verified using the PGP public key.")
+            outfile.write("The files in this directory ending in sig are signed PGP messages with the SHA256 hash of the file with the same name. The files can be verified using the PGP public key.")
         
         file_list = [self.data_package["Network Logs"]["CAN Log File Name"],
                      self.data_package["Network Logs"]["J1708 Log File Name"],
@@ -1522,7 +1725,7 @@ class TU_RP1210(QMainWindow):
         for file in file_list:
             self.sign_file(file)
             shutil.copy2(file, os.path.join(self.export_path, main_file + ' ' + file))
-            shutil.copy2(file + ".pgp", os.path.join(self.export_path, main_file + ' ' + file + ".pgp"))
+            shutil.copy2(get_signature_filename(file), os.path.join(self.export_path, get_signature_filename(main_file + ' ' + file)))
     
     def open_and_sign_file(self):
         fname = QFileDialog.getOpenFileName(self, 'Open file')
@@ -1583,7 +1786,10 @@ class TU_RP1210(QMainWindow):
             with open(file_to_verify_name, 'rb') as f:
                 data_dict["First File Bytes"] = f.read(150)
             data_dict["File Name"] = file_to_verify_name
-            data_dict["Signature File Name"] = file_to_verify_name + '.pgp' 
+            if os.path.isfile(get_signature_filename(file_to_verify_name)):
+                data_dict["Signature File Name"] = get_signature_filename(file_to_verify_name)
+            else:
+                data_dict["Signature File Name"] = file_to_verify_name + '.pgp' 
             data_dict["Signature"] = 'PGP Signature Block'
             data_dict["Public Key"] = str(self.user_data.private_key.pubkey)
             logger.debug("Verification Report inputs:")
@@ -1604,21 +1810,19 @@ class TU_RP1210(QMainWindow):
                     QMessageBox.Close)  
     
     def sign_file(self, filename,show_dialog=True):
+        """
+        Save a detached signature for the file. The file is hashed in chunks
+        instead of being read into memory.
+        """
         logger.info("Begin PGP Signing of {}".format(filename))
-        try:
-            with open(filename,'rb') as f:
-                message = f.read()
-        except FileNotFoundError:
-            logger.debug(traceback.format_exc())
+        if not os.path.isfile(filename):
+            logger.info("Missing file {}".format(filename))
             return False
 
-        new_file = filename + ".pgp"
+        new_file = get_signature_filename(filename)
         try:
-            signed_stream = self.sign_stream(message, self.user_data.private_key)
-            
-            with open(new_file, 'w') as signed_file:
-                signed_file.write(str(signed_stream))
-            info_message = "Successfully wrote a signed PGP message to {}".format(new_file)
+            sign_file_detached(filename, self.user_data.private_key)
+            info_message = "Successfully wrote a PGP signature to {}".format(new_file)
             logger.info(info_message)
             if show_dialog:
                 msg_box = QMessageBox.information(self, "Successful Signing",
@@ -1709,8 +1913,22 @@ class TU_RP1210(QMainWindow):
 
     def verify_file(self, filename):
         """
-        filename should be a file that was saved as a PGP message and signed with the user's private key.
+        filename should be a file that was saved as a PGP message and signed with the user's private key,
+        or a file with a detached signature (or the signature itself).
         """
+        if filename.endswith(SIGNATURE_EXTENSION):
+            filename = filename[:-len(SIGNATURE_EXTENSION)]
+        if os.path.isfile(get_signature_filename(filename)):
+            verified, reason = verify_file_detached(filename, self.user_data.private_key)
+            logger.info("Verification of {}: {}".format(filename, reason))
+            if not verified:
+                QMessageBox.warning(self, 
+                    "Signature Not Verified",
+                    reason,
+                    QMessageBox.Close,
+                    QMessageBox.Close)
+            return verified
+
         #Load the PGP message
         try:
             message = pgpy.PGPMessage.from_file(filename)
@@ -1753,7 +1971,7 @@ class TU_RP1210(QMainWindow):
         '''
         
         try:
-            return self.J1939.j1939_unique_ids[repr((pgn,sa))]["Bytes"]
+            return self.J1939.j1939_unique_ids[pack_key(pgn, sa)]["Bytes"]
         except KeyError:
             return False
           
@@ -1871,39 +2089,49 @@ class TU_RP1210(QMainWindow):
     
 
     def read_rp1210(self):
-        # This function needs to run often to keep the queues from filling
+        # This function needs to run often to keep the ring buffers from being overwritten
         #try:
-        for protocol in self.rx_queues.keys():
-            if protocol in self.rx_queues:
-                start_time = time.time()
-                while self.rx_queues[protocol].qsize():
-                    #Get a message from the queue. These are raw bytes
-                    #if not protocol == "J1708":
-                    rxmessage = self.rx_queues[protocol].get()
+        for protocol, rx_reader in self.rx_readers.items():
+            if protocol == "J1939" and self.J1939.decode_thread is not None:
+                # The J1939 messages are decoded in their own thread
+                continue
+            start_time = time.time()
+            overruns = rx_reader.overruns
+            if protocol == "CAN" and not self.reassemble_can_transport:
+                # CAN traffic is only recorded in the capture file by the read thread
+                rx_reader.skip()
+                continue
+            records = rx_reader.read(self.read_batch_size)
+            while records:
+                for record in records:
+                    #Each record holds the raw bytes from RP1210_ReadMessage
                     if protocol == "CAN":
-                        #Just great a log file.
-                        CANlogger.info("{:0.6f},{},{:08X},{},".format(rxmessage[0],
-                                                                      rxmessage[1],
-                                                                      rxmessage[2],
-                                                                      rxmessage[3]) + 
-                                       ",".join("{:02X}".format(c) for c in rxmessage[4]))
-                    
+                        # The single frames already come from the J1939 client
+                        try:
+                            for message in self.can_transport.j1939_messages(record[0], record[4], single_frames=False):
+                                self.J1939.fill_j1939_table((record[0], message))
+                        except:
+                            logger.debug(traceback.format_exc())
                     elif protocol == "J1939":
                         try:
-                            self.J1939.fill_j1939_table(rxmessage)
+                            self.J1939.fill_j1939_table((record[0], record[4]))
                             #J1939logger.info(rxmessage)
                         except:
                             logger.debug(traceback.format_exc())
                     elif protocol == "J1708":
                         try:
-                            self.J1587.fill_j1587_table(rxmessage)    
-                            J1708logger.info("{:0.6f},".format(rxmessage[0]) + ",".join("{:02X}".format(c) for c in rxmessage[1]))
+                            self.J1587.fill_j1587_table((record[0], record[4]))    
                         except:
                             logger.debug(traceback.format_exc())
-                    
-                    if time.time() - start_time + 50 > self.update_rate: #give some time to process events
-                        logger.debug("Can't keep up with messages.")
-                        return
+                
+                if time.time() - start_time + 50 > self.update_rate: #give some time to process events
+                    logger.debug("Can't keep up with messages.")
+                    break
+                records = rx_reader.read(self.read_batch_size)
+            if rx_reader.overruns > overruns:
+                logger.debug("{} messages on {} were overwritten before they were read.".format(rx_reader.overruns - overruns, protocol))
+        self.J1939.update_tables()
+
     def register_software(self):
         logging.debug("Register Software Request")                      
         self.edit_user_data()
@@ -1939,6 +2167,7 @@ class TU_RP1210(QMainWindow):
             self.RP1210.disconnectRP1210(nClientID)
             if protocol in self.read_message_threads:
                 self.read_message_threads[protocol].runSignal = False
+        self.J1939.stop_decode_thread()
         try:
             self.GPS.ser.close()
         except:
@@ -1946,5 +2175,56 @@ class TU_RP1210(QMainWindow):
         
         logger.debug("Exiting.")
 
-    def decode_can_log_file(self, filename):
-        pass
\ No newline at end of file
+    def open_capture_files(self):
+        filters = "Capture Files (*{});;All Files (*.*)".format(CAPTURE_EXTENSION)
+        fnames = QFileDialog.getOpenFileNames(self, 
+                                              'Replay Capture Files',
+                                              get_storage_path(self.title),
+                                              filters)
+        if not fnames[0]:
+            return
+        speed, ok = QInputDialog.getDouble(self, 
+                                           "Replay Speed",
+                                           "Times faster than real time (0 is as fast as possible):",
+                                           0, 0, 10000, 1)
+        if ok:
+            self.decode_can_log_file(fnames[0], speed)
+
+    def decode_can_log_file(self, filename, speed=None):
+        """
+        Replay one capture file, or a list of them, through the decoders.
+        The replay runs a step at a time from a timer to keep the GUI
+        responsive.
+        """
+        if isinstance(filename, str):
+            filenames = [filename]
+        else:
+            filenames = filename
+        self.stop_replay()
+        try:
+            self.replay = CaptureReplay(self, filenames, speed)
+        except (OSError, ValueError) as e:
+            logger.debug(traceback.format_exc())
+            QMessageBox.warning(self, "File Format Error", str(e))
+            return
+        logger.info("Replaying {}".format(", ".join(filenames)))
+        self.replay_timer = QTimer(self)
+        self.replay_timer.timeout.connect(self.replay_step)
+        self.replay_timer.start(self.update_rate)
+
+    def replay_step(self):
+        # Leave half of each tick for the GUI
+        if self.replay.step(time_limit=self.update_rate / 2000):
+            self.statusBar().showMessage("Replayed {} of {} messages.".format(self.replay.message_count, 
+                                                                               self.replay.total_records))
+        else:
+            self.statusBar().showMessage("Finished replaying {} messages.".format(self.replay.message_count))
+            self.stop_replay()
+
+    def stop_replay(self):
+        if self.replay_timer is not None:
+            self.replay_timer.stop()
+            self.replay_timer = None
+        if self.replay is not None:
+            self.replay.close()
+            self.replay = None
\ No newline at end of file
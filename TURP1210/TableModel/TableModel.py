@@ -1,5 +1,5 @@
 
-from PyQt5.QtCore import Qt, QAbstractTableModel, QSortFilterProxyModel, QVariant
+from PyQt5.QtCore import Qt, QAbstractTableModel, QSortFilterProxyModel, QVariant, QModelIndex
 from PyQt5.QtGui import QIcon
 
 from collections import OrderedDict
@@ -11,6 +11,8 @@ class J1939TableModel(QAbstractTableModel):
         self.data_dict = OrderedDict()
         self.header = []
         self.table_rows = []
+        self.visible_rows = 0
+        self.dirty_range = None
 
     def setDataHeader(self, header):
         self.header = header
@@ -19,7 +21,46 @@ class J1939TableModel(QAbstractTableModel):
     def setDataDict(self, new_dict):
         self.data_dict = OrderedDict(new_dict)
         self.table_rows = list(new_dict.keys())
-        
+        self.visible_rows = len(self.table_rows)
+        self.dirty_range = None
+
+    def setDataStore(self, store):
+        ''' share the rows of a J1939StateStore instead of copying them '''
+        self.data_dict = store
+        self.table_rows = store.rows
+        self.visible_rows = len(self.table_rows)
+        self.dirty_range = None
+
+    def markDirty(self, row, col):
+        ''' remember a changed cell until the next flushUpdates '''
+        if self.dirty_range is None:
+            self.dirty_range = [row, row, col, col]
+        else:
+            if row < self.dirty_range[0]:
+                self.dirty_range[0] = row
+            elif row > self.dirty_range[1]:
+                self.dirty_range[1] = row
+            if col < self.dirty_range[2]:
+                self.dirty_range[2] = col
+            elif col > self.dirty_range[3]:
+                self.dirty_range[3] = col
+
+    def flushUpdates(self):
+        ''' tell viewers about the rows added to the store and the cells marked
+        dirty since the last flush. Returns the number of new rows.'''
+        new_rows = len(self.table_rows) - self.visible_rows
+        if new_rows > 0:
+            self.beginInsertRows(QModelIndex(), self.visible_rows, len(self.table_rows) - 1)
+            self.visible_rows = len(self.table_rows)
+            self.endInsertRows()
+        if self.dirty_range is not None:
+            top, bottom, left, right = self.dirty_range
+            self.dirty_range = None
+            bottom = min(bottom, self.visible_rows - 1)
+            if top <= bottom:
+                self.dataChanged.emit(self.index(top, left), self.index(bottom, right))
+        return max(new_rows, 0)
+
     def aboutToUpdate(self):
         self.layoutAboutToBeChanged.emit()
 
@@ -57,7 +98,7 @@ class J1939TableModel(QAbstractTableModel):
             return False
 
     def rowCount(self, index=QVariant()):
-        return len(self.data_dict)
+        return self.visible_rows
 
     def columnCount(self, index=QVariant()):
         return len(self.header)
@@ -28,6 +28,7 @@ from pgpy.constants import (PubKeyAlgorithm,
 from passlib.hash import pbkdf2_sha256 as passwd
 
 from TURP1210.TU_crypt.TU_crypt import *
+from TURP1210.DataPackageEncoder import canonical_dumps
     
 import requests
 import traceback
@@ -610,7 +611,7 @@ class UserData(QDialog):
         """
         Convert a python dictionary to a signed pgp message to be sent across the internet or saved.
         """
-        file_contents = json.dumps(data_dict, indent=4, sort_keys=True)
+        file_contents = canonical_dumps(data_dict)
         pgp_message = pgpy.PGPMessage.new(file_contents,
                                  cleartext=False,
                                  sensitive=False,
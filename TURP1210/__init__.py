@@ -1,11 +1,30 @@
 from TURP1210.RP1210.RP1210 import *
 from TURP1210.RP1210.RP1210Functions import *
+from TURP1210.RP1210.RP1210RingBuffer import *
+from TURP1210.RP1210.RP1210Capture import *
+from TURP1210.RP1210.RP1210CaptureIndex import *
+from TURP1210.RP1210.RP1210ReadMessage import *
+from TURP1210.RP1210.RP1210Simulator import *
 from TURP1210.RP1210.RP1210Select import *
 from TURP1210.GPSInterface import *
+from TURP1210.CompiledDatabase import *
+from TURP1210.J1939Decoder import *
+from TURP1210.J1939BatchDecoder import *
+from TURP1210.J1939State import *
+from TURP1210.J1939Pipeline import *
 from TURP1210.J1939Tab import *
 from TURP1210.J1587Tab import *
 from TURP1210.ComponentInfoTab import *
 from TURP1210.UserData import *
 from TURP1210.PDFReports import *
+from TURP1210.CaptureReplay import *
+from TURP1210.IncrementalStore import *
+from TURP1210.StreamSigning import *
+from TURP1210.SaveWorker import *
+from TURP1210.DataPackageEncoder import *
+from TURP1210.ScanScheduler import *
+from TURP1210.LatencyTracker import *
+from TURP1210.ScanCoverage import *
+from TURP1210.J1939Transport import *
 from TURP1210.ISO15765 import *
 from TURP1210.Graphing.graphing import * 
@@ -132,6 +132,7 @@ setup(
                       'reportlab>=3.4.0',
                       'PGPy>=0.4.3',
                       'matplotlib>=2.0.2',
+                      'numpy>=1.13.0',
                       'passlib>=1.7.1',
                       'pdfrw>=0.4',
                       'humanize>=0.5.1',